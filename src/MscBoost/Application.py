@@ -1,15 +1,25 @@
+import gzip
 import os
 import pathlib
 import platform
 import signal
+import shutil
 import sys
+import tempfile
+import time
 import traceback
 
+try:
+    import fcntl
+except ImportError: # pragma: no cover
+    fcntl = None # e.g. Windows: no locking
+
 from .CompliantArgumentParser import _CompliantArgumentParser
+from .Conversions import ConvertStorageSize, ConvertTime
 from .EnvironmentVariable import EnvironmentVariable
 from .Logging import Log, get_log_call_count
 from .UsageException import UsageException
-from .Util import get_timestamp_string
+from .Util import convert_timestamp_string_to_timestamp, get_timestamp_string
 
 # MSC_APP_LOGGING holds a comma separated list of the following:
 #   off         ... no logging
@@ -19,6 +29,134 @@ from .Util import get_timestamp_string
 #   invocation  ... log every application invocation
 MSC_APP_LOGGING = EnvironmentVariable("MSC_APP_LOGGING", "MSC Application logging (off|all|app-error|usage-error|invocation).", default_value="app-error")
 
+MSC_APP_LOG_MAX_SIZE = EnvironmentVariable("MSC_APP_LOG_MAX_SIZE", "Rotate the application log file at this size.", default_value="10MB")
+MSC_APP_LOG_MAX_AGE = EnvironmentVariable("MSC_APP_LOG_MAX_AGE", "Rotate the application log file when its first entry is older, e.g. 24h.")
+MSC_APP_LOG_MAX_TOTAL_SIZE = EnvironmentVariable("MSC_APP_LOG_MAX_TOTAL_SIZE", "Delete the oldest rotated application log files above this total size.", default_value="100MB")
+MSC_APP_LOG_COMPRESS = EnvironmentVariable("MSC_APP_LOG_COMPRESS", "Compress the rotated application log files with gzip.")
+
+class AppLogFile(object):
+    """
+    Application log file that is rotated when it exceeds max_size bytes or its first entry is older than max_age seconds.
+    The rotated files are named <file_name>.<timestamp>, with compress set they are gzipped (<file_name>.<timestamp>.gz).
+    The oldest rotated files are deleted when they take more than max_total_size bytes.
+    Appending is safe for concurrent processes: O_APPEND and an exclusive flock() during the rotation check and the write.
+    """
+    def __init__(self, file_name, max_size=None, max_age=None, max_total_size=None, compress=None):
+        self.file_name = file_name
+        self.max_size = max_size if max_size is not None else ConvertStorageSize().convert(MSC_APP_LOG_MAX_SIZE.get_value())
+        if max_age is None and MSC_APP_LOG_MAX_AGE.get_value():
+            max_age = ConvertTime().convert(MSC_APP_LOG_MAX_AGE.get_value())
+        self.max_age = max_age
+        self.max_total_size = max_total_size if max_total_size is not None else ConvertStorageSize().convert(MSC_APP_LOG_MAX_TOTAL_SIZE.get_value())
+        self.compress = compress if compress is not None else MSC_APP_LOG_COMPRESS.get_value() is not None
+
+    def append(self, txt):
+        """
+        Append txt with a single write call, rotate the file before when required.
+        """
+        data = txt.encode()
+        rotated_file_name = None
+        while True:
+            fd = os.open(self.file_name, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    try:
+                        current_inode = os.stat(self.file_name).st_ino
+                    except FileNotFoundError:
+                        current_inode = None # rotated, the new file isn't created yet
+                    if os.fstat(fd).st_ino != current_inode:
+                        # Another process rotated the file while we waited for the lock
+                        continue
+                if rotated_file_name is None and self._is_rotation_required(fd, len(data)):
+                    rotated_file_name = self._rotate()
+                    continue
+                os.write(fd, data)
+                break
+            finally:
+                os.close(fd)
+        if rotated_file_name is not None:
+            self._cleanup(rotated_file_name)
+
+    def _is_rotation_required(self, fd, nr_of_bytes):
+        size = os.fstat(fd).st_size
+        if size == 0:
+            return False
+        if self.max_size and size + nr_of_bytes > self.max_size:
+            return True
+        if self.max_age:
+            try:
+                first_timestamp = convert_timestamp_string_to_timestamp(os.pread(fd, 20, 0).decode())
+            except (AttributeError, OSError, ValueError):
+                return False
+            return time.time() - time.mktime(first_timestamp.timetuple()) > self.max_age
+        return False
+
+    def _rotate(self):
+        rotated_file_name = "%s.%s" % (self.file_name, get_timestamp_string(file_name_compatible=True))
+        nr = 1
+        while os.path.exists(rotated_file_name) or os.path.exists(rotated_file_name + ".gz"):
+            nr += 1
+            rotated_file_name = "%s.%s-%d" % (self.file_name, get_timestamp_string(file_name_compatible=True), nr)
+        os.rename(self.file_name, rotated_file_name)
+        return rotated_file_name
+
+    def _cleanup(self, rotated_file_name):
+        """
+        Compress the rotated file and remove the oldest rotated files above max_total_size.
+        Concurrent processes may remove the rotated files at any time (size cap), missing files are skipped.
+        """
+        if self.compress:
+            self._compress(rotated_file_name)
+        if self.max_total_size:
+            self._limit_total_size()
+
+    def _compress(self, rotated_file_name):
+        """
+        Replace the rotated file by its gzipped version.
+        The data is written to a temporary file that isn't a rotated file name, so no partial .gz file is visible.
+        """
+        log_dir, base_name = os.path.split(rotated_file_name)
+        fd, temp_file_name = tempfile.mkstemp(prefix=".%s." % base_name, suffix=".tmp", dir=log_dir or ".")
+        try:
+            with os.fdopen(fd, "wb") as f_temp, open(rotated_file_name, "rb") as f_in, gzip.GzipFile(fileobj=f_temp, mode="wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.replace(temp_file_name, rotated_file_name + ".gz")
+            os.unlink(rotated_file_name)
+        except FileNotFoundError:
+            pass # Removed by a concurrent process
+        finally:
+            if os.path.exists(temp_file_name):
+                os.unlink(temp_file_name)
+
+    def _limit_total_size(self):
+        log_dir, base_name = os.path.split(self.file_name)
+        rotated_files = []
+        for entry in os.scandir(log_dir or "."):
+            if entry.name.startswith(base_name + "."):
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        rotated_files.append((st.st_mtime, entry.path, st.st_size))
+                except FileNotFoundError:
+                    pass # Removed by a concurrent process
+        total_size = sum(size for (mtime, path, size) in rotated_files)
+        for mtime, path, size in sorted(rotated_files):
+            if total_size <= self.max_total_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass # e.g. deleted by a concurrent process
+            total_size -= size
+
+    def get_rotated_file_names(self):
+        """
+        Return the names of the rotated files.
+        """
+        log_dir, base_name = os.path.split(self.file_name)
+        return sorted(entry.path for entry in os.scandir(log_dir or ".") if entry.name.startswith(base_name + "."))
+
 ## @brief Main application.
 # See also <a href="https://docs.python.org/3/howto/argparse.html">argparse</a>.
 class Application(object):
@@ -112,14 +250,18 @@ class Application(object):
                 log_to_log_file = True
                 exception_msg = "%s\n%s" % (e, traceback.format_exc())
             Log().error("*** ERROR: {0}".format(e))
-            Log().out(1, traceback.format_exc())
+            Log().out_lazy(1, traceback.format_exc)
 
         if log_to_log_file:
             self._log_invocation()
             log_file_name = self._get_logfile_name()
             start_time, cwd, args = self.app_startup_information
-            with open(log_file_name, "a") as f:
-                print("%s: ERROR: %s" % (get_timestamp_string(), exception_msg), file=f)
+            lines = ["%s: ERROR: %s" % (get_timestamp_string(), exception_msg)]
+            ring_buffer = Log().ring_buffer
+            if ring_buffer is not None:
+                lines.append("Recent log messages:")
+                lines.extend("  %s" % line for line in ring_buffer.get_lines())
+            AppLogFile(log_file_name).append("\n".join(lines) + "\n")
             Log().info("  See '%s' for error details" % log_file_name)
         self._exit(1)
 
@@ -224,8 +366,7 @@ class Application(object):
         log_file_name = self._get_logfile_name()
         start_time, cwd, args = self.app_startup_information
         args = " ".join(args)
-        with open(log_file_name, "a") as f:
-            print("%s [%s]: %s" % (start_time, cwd, args), file=f)
+        AppLogFile(log_file_name).append("%s [%s]: %s\n" % (start_time, cwd, args))
         self.invocation_logged = True
 
     ## @return List with possible directories containing helper files.
@@ -12,10 +12,20 @@
 #  Copyright (c) 2016-2023 -- MSC Technologies
 # ----------------------------------------------------------------------------------
 
-import time
+import array
+import collections
+import concurrent.futures
+import csv
+import functools
+import itertools
+import numbers
+import operator
 
+from MscBoost.EnvironmentVariable import EnvironmentVariable
 from MscBoost.UsageException import UsageException
 
+MSC_CONVERSION_CACHE_SIZE = EnvironmentVariable("MSC_CONVERSION_CACHE_SIZE", "Number of values per interpretation cached by convert_value() and string_repr(), 0 disables the cache.", default_value="4096")
+
 def int_val(value, unit="", multiplicator=1, accept_float=True):
     if unit:
         s_val = value[:-len(unit)]
@@ -42,35 +52,36 @@ class ConversionBase(object):
     def examples(self):
         return ""  # pragma: no cover
 
+def _is_integer_string(number):
+    """
+    Return True for integer strings with an optional sign, e.g. "-123".
+    """
+    return number[1:].isdigit() if number[:1] in ("+", "-") else number.isdigit()
+
 class ConvertStorageSize(ConversionBase):
     name = "storage-size"
+    # Units should match C++ libMscBoost, kB is accepted as alternative to KB
+    UNITS = {"B": 1, "KB": 1000, "kB": 1000, "KiB": 1024, "MB": 1000**2, "MiB": 1024**2,
+             "GB": 1000**3, "GiB": 1024**3, "TB": 1000**4, "TiB": 1024**4}
+    UNIT_CHARS = "BKkiMGT"
+    TYPECODE = "q" # array typecode of convert_values() results
     def examples(self):
         return "2B. Possible units are B,KB,KiB,MB,MiB,GB,GiB,TB,TiB. KB has factor 1000, KiB factor 1024"
     def convert(self, value):
-        retval = None
-        # Units should match C++ libMscBoost
-        if type(value) == str:
-            if value.endswith("TiB"):
-                retval = int_val(value, "TiB", 1024**4)
-            elif value.endswith("TB"):
-                retval = int_val(value, "TB", 1000**4)
-            elif value.endswith("GiB"):
-                retval = int_val(value, "GiB", 1024**3)
-            elif value.endswith("GB"):
-                retval = int_val(value, "GB", 1000**3)
-            elif value.endswith("MiB"):
-                retval = int_val(value, "MiB", 1024**2)
-            elif value.endswith("MB"):
-                retval = int_val(value, "MB", 1000**2)
-            elif value.endswith("KiB"):
-                retval = int_val(value, "KiB", 1024)
-            elif value.endswith("KB"):
-                retval = int_val(value, "kB", 1000)
-            elif value.endswith("B"):
-                retval = int_val(value, "B")
-        else:
-            retval = value
-        return retval
+        if type(value) != str:
+            return value
+        # Single pass: strip the unit characters and look up the remaining suffix
+        value = value.strip()
+        number = value.rstrip(self.UNIT_CHARS)
+        factor = self.UNITS.get(value[len(number):])
+        # e.g. "6 KiB": the blank between number and unit
+        number = number.rstrip()
+        if factor is None or not number:
+            return None
+        if _is_integer_string(number):
+            # Exact for integers
+            return int(number) * factor
+        return int(float(number) * factor)
     def string_repr(self, value):
         if value < 0:
             sign_str = "-"
@@ -93,29 +104,21 @@ class ConvertTime(ConversionBase):
     name = "time"
     def examples(self):
         return "1ps, 2.3ns, 8us, 8.5ms, 1s, 6min, 2h, 2:15:59.25"
+    UNITS = {"ps": 1E-12, "ns": 1E-9, "us": 1E-6, "ms": 1E-3, "s": 1, "min": 60, "h": 3600}
+    UNIT_CHARS = "psnumih"
+    TYPECODE = "d"
     def convert(self, value):
-        retval = None
-        if type(value) == str:
-            if value.endswith("ps"):
-                retval = float_val(value, "ps", 1E-12)
-            elif value.endswith("ns"):
-                retval = float_val(value, "ns", 1E-9)
-            elif value.endswith("us"):
-                retval = float_val(value, "us", 1E-6)
-            elif value.endswith("ms"):
-                retval = float_val(value, "ms", 1E-3)
-            elif value.endswith("s"):
-                retval = float_val(value, "s")
-            elif value.endswith("min"):
-                retval = float_val(value, "min", 60)
-            elif value.endswith("h"):
-                retval = float_val(value, "h", 3600)
-            elif value.count(":") == 2:
-                hr, min, sec = value.split(":")
-                retval = int(hr)*3600 + int(min)*60 + float(sec)
-        else:
-            retval = value
-        return retval
+        if type(value) != str:
+            return value
+        value = value.strip()
+        number = value.rstrip(self.UNIT_CHARS)
+        factor = self.UNITS.get(value[len(number):])
+        if factor is not None and number:
+            return float(number) * factor
+        if value.count(":") == 2:
+            hr, min, sec = value.split(":")
+            return int(hr)*3600 + int(min)*60 + float(sec)
+        return None
     def string_repr(self, value):
         if value < 0:
             sign_str = "-"
@@ -144,13 +147,12 @@ class ConvertTime(ConversionBase):
                     unit = "s"
                 # if int_value > 60 and abs(value-int_value) > 1E-15:
                 else:
-                    midnight = time.mktime((0, 1, 2, 0, 0, 0, 0, 1, 0))
+                    minutes, seconds = divmod(int_value, 60)
+                    hours, minutes = divmod(minutes, 60)
                     msecs = ("%.2f" % (value-int_value))[1:]
-                    time_str = "%s%s" % (time.strftime("%H:%M:%S", time.localtime(midnight + int_value)), msecs)
+                    time_str = "%d:%02d:%02d%s" % (hours, minutes, seconds, msecs)
                     time_str = time_str.rstrip("0")
                     time_str = time_str.rstrip(".")
-                    if time_str.startswith("0"):
-                        time_str = time_str[1:]
                     return time_str
         str_val = "%1.2f" % val
         str_val = str_val.rstrip("0")  # e.g. 100.00 -> 100.
@@ -163,11 +165,65 @@ for obj in list(globals().values()):
         if obj.name:
             CONVERSION_MAPPING[obj.name] = obj()
 
+class ConversionCache(object):
+    """
+    Bounded LRU caches of the convert() and string_repr() results of each interpretation with hit/miss statistics.
+    """
+    def __init__(self, size):
+        self.set_size(size)
+
+    def set_size(self, size):
+        """
+        Cache up to size values per interpretation and function, 0 disables the caches. Clears the caches.
+        """
+        ## Number of cached values per interpretation and function
+        self.size = size
+        ## interpretation: cached convert function
+        self.convert = {}
+        ## interpretation: cached string_repr function
+        self.string_repr = {}
+        for name, conv in CONVERSION_MAPPING.items():
+            if size > 0:
+                # typed: e.g. convert(1) and convert(1.0) return different types
+                self.convert[name] = functools.lru_cache(maxsize=size, typed=True)(conv.convert)
+                self.string_repr[name] = functools.lru_cache(maxsize=size, typed=True)(conv.string_repr)
+            else:
+                self.convert[name] = conv.convert
+                self.string_repr[name] = conv.string_repr
+
+    def clear(self):
+        """
+        Clear the cached values and the statistics.
+        """
+        for func in list(self.convert.values()) + list(self.string_repr.values()):
+            if hasattr(func, "cache_clear"):
+                func.cache_clear()
+
+    def get_statistics(self):
+        """
+        Return {interpretation: {"convert": (hits, misses), "string_repr": (hits, misses)}}.
+        """
+        statistics = {}
+        for name in CONVERSION_MAPPING:
+            statistics[name] = {}
+            for func_name, funcs in (("convert", self.convert), ("string_repr", self.string_repr)):
+                if hasattr(funcs[name], "cache_info"):
+                    cache_info = funcs[name].cache_info()
+                    statistics[name][func_name] = (cache_info.hits, cache_info.misses)
+                else:
+                    statistics[name][func_name] = (0, 0)
+        return statistics
+
+CONVERSION_CACHE = ConversionCache(int(MSC_CONVERSION_CACHE_SIZE.get_value()))
+
 def convert_value(value, interpretation, raise_error=False, create_value_object=False, parameter_name=None):
     if interpretation in CONVERSION_MAPPING:
         conv = CONVERSION_MAPPING[interpretation]
         try:
-            result = conv.convert(value)
+            if type(value) == str:
+                result = CONVERSION_CACHE.convert[interpretation](value)
+            else:
+                result = conv.convert(value)
         except:
             result = None
         if result is None:
@@ -193,15 +249,166 @@ def convert_param_value(value, interpretation):
 
 def string_repr(value, interpretation):
     if interpretation in CONVERSION_MAPPING:
-        conv = CONVERSION_MAPPING[interpretation]
-        return conv.string_repr(value)
+        try:
+            return CONVERSION_CACHE.string_repr[interpretation](value)
+        except TypeError: # e.g. unhashable value
+            return CONVERSION_MAPPING[interpretation].string_repr(value)
     else:
         return None
 
+INT64_MAX = 2**63 - 1
+FLOAT_EXACT_INT_MAX = 2**53 # Larger integers can't be represented exactly as float
+
+## The numpy module, None when it isn't installed, False until _get_numpy() was called
+_numpy = False
+
+def _get_numpy():
+    """
+    Return the numpy module or None when it isn't installed.
+    numpy is imported on first use only: importing it takes longer than most command line tools run.
+    """
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError: # pragma: no cover
+            numpy = None # convert_values() uses the array module instead
+        _numpy = numpy
+    return _numpy
+
+def _split_units(texts, conv):
+    """
+    Split the strings texts into number strings and unit factors, without a Python loop per value.
+    Returns (numbers, factors), the factor is None when a text has no unit of conv.
+    """
+    texts = list(map(str.strip, texts))
+    numbers = list(map(str.rstrip, texts, itertools.repeat(conv.UNIT_CHARS)))
+    # The number is a prefix of the text, so removing it once leaves the unit
+    units = map(str.replace, texts, numbers, itertools.repeat(""), itertools.repeat(1))
+    return numbers, list(map(conv.UNITS.get, units))
+
+def _split_values(values, conv):
+    """
+    Split the list values into number strings and unit factors, see _split_units().
+    Returns (numbers, factors, others), others are the indices of the values without unit (e.g. 1:02:07.5 or numbers),
+    they are converted one by one.
+    """
+    if set(map(type, values)) <= {str}:
+        texts = values
+    else:
+        texts = [value if isinstance(value, str) else "" for value in values]
+    numbers, factors = _split_units(texts, conv)
+    others = []
+    if None in factors:
+        others = [index for index, factor in enumerate(factors) if factor is None]
+        for index in others:
+            numbers[index] = "0"
+            factors[index] = 0
+    return numbers, factors, others
+
+def _multiply_numbers(numbers, factors, numpy):
+    """
+    Return (products, invalid indices) of the parsed numbers and factors, a numpy array when numpy is given.
+    """
+    invalid = []
+    for retry in (False, True):
+        try:
+            if numpy is not None:
+                nr_of_numbers = len(numbers)
+                products = numpy.fromiter(map(float, numbers), numpy.float64, nr_of_numbers)
+                products *= numpy.fromiter(factors, numpy.float64, nr_of_numbers)
+            else:
+                products = list(map(operator.mul, map(float, numbers), factors))
+            return products, invalid
+        except ValueError:
+            if retry: # pragma: no cover
+                raise
+            # At least one invalid number: find them and parse the others again
+            for index, number in enumerate(numbers):
+                try:
+                    float(number)
+                except ValueError:
+                    invalid.append(index)
+                    numbers[index] = "0"
+
+def _get_exact_integers(numbers, factors, products, invalid, numpy):
+    """
+    Return [(index, value)] for the integers beyond float precision, their products are set to 0.
+    Values beyond int64 are added to invalid.
+    """
+    # The negated comparisons also catch inf and nan
+    if numpy is not None:
+        large = numpy.flatnonzero(~(abs(products) < FLOAT_EXACT_INT_MAX)).tolist()
+    else:
+        large = [index for index, product in enumerate(products) if not -FLOAT_EXACT_INT_MAX < product < FLOAT_EXACT_INT_MAX]
+    exact_values = []
+    for index in large:
+        number = numbers[index].strip()
+        exact_value = int(number) * factors[index] if _is_integer_string(number) else products[index]
+        if abs(exact_value) <= INT64_MAX:
+            exact_values.append((index, int(exact_value)))
+        else:
+            invalid.append(index)
+        products[index] = 0
+    return exact_values
+
+def _create_result(products, typecode, numpy):
+    """
+    Return (result, valid) for the products: numpy arrays when numpy is given, else an array.array and a list.
+    """
+    if numpy is not None:
+        return products.astype(typecode), numpy.ones(len(products), dtype=bool)
+    return array.array(typecode, map(int, products) if typecode == "q" else products), [True] * len(products)
+
+def _convert_others(values, others, conv, result, valid):
+    """
+    Convert the values at the indices others one by one.
+    """
+    for index in others:
+        try:
+            value = conv.convert(values[index])
+            result[index] = int(value) if conv.TYPECODE == "q" else float(value)
+        except (ValueError, TypeError, OverflowError):
+            valid[index] = False
+
+def convert_values(values, interpretation, use_numpy=True):
+    """
+    Convert many values of one interpretation at once.
+    The strings are split into numbers and unit factors and parsed in bulk, only other values are converted one by one.
+    Returns (values, valid): with numpy a numpy int64 (storage-size) or float64 (time) array and a boolean mask,
+    else an array.array and a list of bools. Invalid values are 0.
+    """
+    if interpretation not in CONVERSION_MAPPING:
+        raise Exception("Couldn't convert values as %s\nPossible interpretations: %s" %
+                        (interpretation, ", ".join(CONVERSION_MAPPING.keys())))
+    conv = CONVERSION_MAPPING[interpretation]
+    numpy = _get_numpy() if use_numpy else None
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        if values.dtype.kind in "iuf":
+            return values.astype(conv.TYPECODE), numpy.ones(len(values), dtype=bool)
+        values = values.tolist()
+    else:
+        values = list(values)
+    numbers, factors, others = _split_values(values, conv)
+    products, invalid = _multiply_numbers(numbers, factors, numpy)
+    exact_values = _get_exact_integers(numbers, factors, products, invalid, numpy) if conv.TYPECODE == "q" else []
+    result, valid = _create_result(products, conv.TYPECODE, numpy)
+    for index, value in exact_values:
+        result[index] = value
+    for index in invalid:
+        result[index] = 0
+        valid[index] = False
+    _convert_others(values, others, conv, result, valid)
+    return result, valid
+
 class ValueWithUnit(object):
     """
     Handle floating point numbers including a unit.
+    Compares and hashes like its value, but values of different interpretations (e.g. 1s and 1B) are never equal
+    and can't be ordered.
+    Don't change the value of objects used as dict keys (see FrozenValueWithUnit).
     """
+    __slots__ = ("value", "converter")
     def __init__(self, value, converter):
         self.value = value
         self.converter = converter
@@ -214,14 +421,49 @@ class ValueWithUnit(object):
         return int(self.value)
     def __bool__(self):
         return bool(self.value)
+    def __hash__(self):
+        # Equal to plain numbers, so it must hash like them
+        return hash(self.value)
     def _build_retval(self, value):
         return self.__class__(value, self.converter)
     def __neg__(self):  # -a
         return self._build_retval(-self.value)
     def __abs__(self):  # abs(a)
         return self._build_retval(abs(self.value))
+    def __eq__(self, other):  # a == b
+        if isinstance(other, ValueWithUnit):
+            return type(self.converter) is type(other.converter) and self.value == other.value
+        if isinstance(other, numbers.Number):
+            return self.value == other
+        return NotImplemented
     def __lt__(self, other):  # a < b
-        return self.value < other.value
+        if isinstance(other, ValueWithUnit):
+            if type(self.converter) is not type(other.converter):
+                return NotImplemented
+            return self.value < other.value
+        else:
+            return self.value < other
+    def __le__(self, other):  # a <= b
+        if isinstance(other, ValueWithUnit):
+            if type(self.converter) is not type(other.converter):
+                return NotImplemented
+            return self.value <= other.value
+        else:
+            return self.value <= other
+    def __gt__(self, other):  # a > b
+        if isinstance(other, ValueWithUnit):
+            if type(self.converter) is not type(other.converter):
+                return NotImplemented
+            return self.value > other.value
+        else:
+            return self.value > other
+    def __ge__(self, other):  # a >= b
+        if isinstance(other, ValueWithUnit):
+            if type(self.converter) is not type(other.converter):
+                return NotImplemented
+            return self.value >= other.value
+        else:
+            return self.value >= other
     def __add__(self, other):  # a + b
         if isinstance(other, ValueWithUnit):
             return self._build_retval(self.value + other.value)
@@ -268,6 +510,143 @@ class ValueWithUnit(object):
     def __rfloordiv__(self, other):  # other // self
         return self._build_retval(other // self.value)
 
+class FrozenValueWithUnit(ValueWithUnit):
+    """
+    Immutable ValueWithUnit, e.g. for dict keys and sets.
+    """
+    __slots__ = ()
+    def __init__(self, value, converter):
+        _set_value(self, value)
+        _set_converter(self, converter)
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenValueWithUnit is immutable")
+    def __delattr__(self, name):
+        raise AttributeError("FrozenValueWithUnit is immutable")
+
+_set_value = ValueWithUnit.value.__set__
+_set_converter = ValueWithUnit.converter.__set__
+_get_value = ValueWithUnit.value.__get__
+
+def sum_values_with_unit(values):
+    """
+    Return the sum of the ValueWithUnit values (0 for no values), faster than sum().
+    """
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    if not values:
+        return 0
+    return values[0]._build_retval(sum(map(_get_value, values)))
+
+def mean_values_with_unit(values):
+    """
+    Return the mean of the ValueWithUnit values.
+    """
+    if not isinstance(values, (list, tuple)):
+        values = list(values)
+    if not values:
+        raise ValueError("mean of no values")
+    return values[0]._build_retval(sum(map(_get_value, values)) / len(values))
+
+def _create_array(values):
+    """
+    Return an int64 array.array of the list values, a float array.array if any value isn't an int.
+    """
+    return array.array("q" if all(type(value) is int for value in values) else "d", values)
+
+class ValueWithUnitArray(object):
+    """
+    Many values of one interpretation in a numpy array or, without numpy, an array.array.
+    Arithmetic works on all values at once, indexing returns ValueWithUnit objects.
+    """
+    __slots__ = ("values", "converter")
+    def __init__(self, values, interpretation, use_numpy=True):
+        ## The converter of the interpretation
+        self.converter = CONVERSION_MAPPING[interpretation]
+        numpy = _get_numpy() if use_numpy else None
+        if numpy is not None:
+            values = numpy.asarray(values)
+            if values.dtype.kind not in "iuf":
+                values = values.astype(self.converter.TYPECODE)
+        elif not isinstance(values, array.array):
+            values = _create_array(list(values))
+        ## numpy array or array.array of the values
+        self.values = values
+
+    @classmethod
+    def from_strings(cls, strings, interpretation, use_numpy=True):
+        """
+        Convert strings like "1KiB", raise the convert_value() Exception for the first invalid one.
+        """
+        strings = list(strings)
+        values, valid = convert_values(strings, interpretation, use_numpy=use_numpy)
+        if not all(valid):
+            convert_value(strings[list(valid).index(False)], interpretation, raise_error=True)
+        return cls(values, interpretation, use_numpy=use_numpy)
+
+    def _build_retval(self, values):
+        retval = object.__new__(self.__class__)
+        retval.converter = self.converter
+        if isinstance(values, list): # array.array result
+            values = _create_array(values)
+        retval.values = values
+        return retval
+    def _apply(self, operation, other):
+        if isinstance(other, ValueWithUnitArray):
+            other = other.values
+        elif isinstance(other, ValueWithUnit):
+            other = other.value
+        if isinstance(self.values, array.array):
+            if isinstance(other, array.array):
+                if len(other) != len(self.values):
+                    raise ValueError("ValueWithUnitArray lengths differ: %d, %d" % (len(self.values), len(other)))
+                return self._build_retval(list(map(operation, self.values, other)))
+            return self._build_retval(list(map(operation, self.values, itertools.repeat(other))))
+        return self._build_retval(operation(self.values, other))
+
+    def __len__(self):
+        return len(self.values)
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._build_retval(self.values[index])
+        if isinstance(self.values, array.array):
+            return ValueWithUnit(self.values[index], self.converter)
+        return ValueWithUnit(self.values[index].item(), self.converter)
+    def __iter__(self):
+        for value in self.values.tolist():
+            yield ValueWithUnit(value, self.converter)
+    def __repr__(self):
+        return "[%s]" % ", ".join(map(self.converter.string_repr, self.values.tolist()))
+    def sum(self):
+        if isinstance(self.values, array.array):
+            return ValueWithUnit(sum(self.values), self.converter)
+        return ValueWithUnit(self.values.sum().item(), self.converter)
+    def mean(self):
+        if not len(self.values):
+            raise ValueError("mean of no values")
+        return self.sum() / len(self.values)
+    def min(self):
+        if isinstance(self.values, array.array):
+            return ValueWithUnit(min(self.values), self.converter)
+        return ValueWithUnit(self.values.min().item(), self.converter)
+    def max(self):
+        if isinstance(self.values, array.array):
+            return ValueWithUnit(max(self.values), self.converter)
+        return ValueWithUnit(self.values.max().item(), self.converter)
+    def __neg__(self):  # -a
+        return self._apply(operator.mul, -1)
+    def __add__(self, other):  # a + b
+        return self._apply(operator.add, other)
+    def __sub__(self, other):  # a - b
+        return self._apply(operator.sub, other)
+    def __mul__(self, other):  # a * b
+        return self._apply(operator.mul, other)
+    def __truediv__(self, other):  # a / b
+        return self._apply(operator.truediv, other)
+    def __radd__(self, other):  # other + self
+        return self._apply(operator.add, other)
+    def __rmul__(self, other):  # other * self
+        return self._apply(operator.mul, other)
+
 def create_value_with_unit(value, interpretation, raise_error=True):
     return convert_value(value, interpretation, raise_error=raise_error, create_value_object=True)
 
@@ -288,3 +667,100 @@ def parameter_value(parameter_name, value, interpretation, min=None, max=None):
         exception_msg = "Parameter '%s': value %s is out of valid range: [%s..%s]" % (parameter_name, value, min_bound, max_bound)
         raise Exception(exception_msg)
     return value
+
+def _convert_csv_chunk(line_numbers, rows, columns):
+    """
+    Convert the columns ([(index, name, interpretation)]) of rows.
+    Returns (rows, error messages), bad fields are set to None.
+    """
+    errors = []
+    for index, name, interpretation in columns:
+        fields = [row[index] if index < len(row) else "" for row in rows]
+        values, valid = convert_values(fields, interpretation)
+        values = values.tolist()
+        for row, line_number, field, value, is_valid in zip(rows, line_numbers, fields, values, valid):
+            if index >= len(row):
+                row.extend([None] * (index + 1 - len(row)))
+            if is_valid:
+                row[index] = value
+            else:
+                row[index] = None
+                try:
+                    convert_value(field, interpretation, raise_error=True)
+                except Exception as e:
+                    errors.append((line_number, "Line %d, column '%s': %s" % (line_number, name, e)))
+    errors.sort(key=lambda error: error[0])
+    return rows, [message for line_number, message in errors]
+
+def _read_csv_chunks(reader, chunk_size):
+    """
+    Yield (line numbers, rows) of at most chunk_size rows from the csv reader.
+    """
+    while True:
+        line_numbers = []
+        rows = []
+        for row in itertools.islice(reader, chunk_size):
+            line_numbers.append(reader.line_num)
+            rows.append(row)
+        if not rows:
+            return
+        yield line_numbers, rows
+
+def _get_csv_column_infos(header, columns):
+    """
+    Return [(index, name, interpretation)] of the columns ({name: interpretation}) in the CSV header.
+    """
+    column_infos = []
+    for name, interpretation in columns.items():
+        if name not in header:
+            raise Exception("Column '%s' not found in CSV header: %s" % (name, ", ".join(header)))
+        column_infos.append((header.index(name), name, interpretation))
+    return column_infos
+
+def _convert_csv_chunks(chunks, column_infos, processes):
+    """
+    Yield (rows, error messages) of the converted chunks in their order, see _convert_csv_chunk().
+    processes > 1 converts the chunks in worker processes.
+    """
+    if processes <= 1:
+        for line_numbers, rows in chunks:
+            yield _convert_csv_chunk(line_numbers, rows, column_infos)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        # Only a few chunks per process are in flight to keep the memory usage constant
+        futures = collections.deque()
+        for line_numbers, rows in chunks:
+            futures.append(executor.submit(_convert_csv_chunk, line_numbers, rows, column_infos))
+            if len(futures) >= 2 * processes:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+def convert_csv_rows(lines, columns, chunk_size=10000, processes=1, errors=None, delimiter=","):
+    """
+    Convert the named columns of CSV lines (e.g. an open file) chunk by chunk, without reading all lines.
+    columns maps column names of the header line to interpretations, e.g. {"size": "storage-size"}.
+    Yields the header and the converted rows. processes > 1 converts the chunks in worker processes.
+    A bad field raises an Exception with its line number and the convert_value() error text.
+    If errors is a list, the messages are appended to it instead and the bad fields are None.
+    """
+    reader = csv.reader(lines, delimiter=delimiter)
+    header = next(reader, None)
+    if header is None:
+        return
+    column_infos = _get_csv_column_infos(header, columns)
+    yield header
+    for rows, chunk_errors in _convert_csv_chunks(_read_csv_chunks(reader, chunk_size), column_infos, processes):
+        if chunk_errors:
+            if errors is None:
+                raise Exception(chunk_errors[0])
+            errors.extend(chunk_errors)
+        yield from rows
+
+def convert_csv_file(input_file_name, output_file_name, columns, delimiter=",", **kwargs):
+    """
+    Write the CSV file input_file_name with the converted columns to output_file_name, see convert_csv_rows().
+    """
+    with open(input_file_name, newline="") as input_file, open(output_file_name, "w", newline="") as output_file:
+        rows = convert_csv_rows(input_file, columns, delimiter=delimiter, **kwargs)
+        csv.writer(output_file, delimiter=delimiter).writerows(rows)
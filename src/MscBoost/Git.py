@@ -12,7 +12,13 @@
 #  Copyright (c) 2016-2017 -- MSC Technologies
 # ----------------------------------------------------------------------------------
 
+import concurrent.futures
+import json
+import os
 import subprocess
+import tempfile
+import threading
+import time
 
 import git
 from .EnvironmentVariable import EnvironmentVariable
@@ -21,6 +27,8 @@ from .Logging import Log
 MSC_PUBLIC_GIT_SERVER = "ssh://gitolite@msc-git02.msc-ge.com:9418/"
 MSC_GIT_SERVER = EnvironmentVariable("MSC_GIT_SERVER", "MSC Git Server.", default_value=MSC_PUBLIC_GIT_SERVER)
 MSC_GIT_SERVER_CACHE = EnvironmentVariable("MSC_GIT_SERVER_CACHE", "MSC Git Server Cache.")
+MSC_GIT_ACCESS_TIMEOUT = EnvironmentVariable("MSC_GIT_ACCESS_TIMEOUT", "Timeout in seconds for the reachability check of the git servers.", default_value="5")
+MSC_GIT_ACCESS_CACHE_TTL = EnvironmentVariable("MSC_GIT_ACCESS_CACHE_TTL", "Time in seconds the reachability of the git servers is cached.", default_value="60")
 
 class GitException(Exception):
     def __init__(self, msg):
@@ -35,26 +43,342 @@ def branch_name_sort_key(name):
     """
     return {"master": chr(1), "develop": chr(2)}.get(name, name)
 
+# Modification times closer than this to the snapshot creation time can't be trusted
+# (coarse file system timestamps), such snapshots are reloaded on the next access.
+RACY_REF_STAMP_NS = 2 * 10**9
+
+def _get_file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None)
+    return (path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+def get_ref_stamp(git_dir, common_dir=None):
+    """
+    Return a stamp that changes whenever HEAD, packed-refs or a loose ref below refs/ changes.
+    git writes loose refs via a lock file that is renamed afterwards, therefore the modification times of the
+    directories below refs/ are sufficient to detect changed loose refs.
+    """
+    common_dir = common_dir or git_dir
+    stamp = [_get_file_stamp(os.path.join(git_dir, "HEAD")), _get_file_stamp(os.path.join(common_dir, "packed-refs"))]
+    for dir_path, dir_names, file_names in os.walk(os.path.join(common_dir, "refs")):
+        stamp.append(_get_file_stamp(dir_path))
+    return tuple(stamp)
+
+class RefSnapshot(object):
+    """
+    All refs of a repository, read at once: HEAD, local branches, origin branches and tags.
+    Tags are peeled, i.e. annotated tags map to the commit they point at.
+    """
+    def __init__(self, stamp, head_ref, head_sha1, refs):
+        self.stamp = stamp
+        self.created_ns = time.time_ns()
+        self.is_racy = max([entry[1] or 0 for entry in stamp]) >= self.created_ns - RACY_REF_STAMP_NS
+        ## Full symbolic ref name of HEAD, e.g. 'refs/heads/master'. None in detached head state.
+        self.head_ref = head_ref
+        self.head_sha1 = head_sha1
+        ## refname -> SHA1 of the object the ref points at
+        self.refs = refs
+        self.branches = {}
+        self.remote_branches = {}
+        self.tags = {}
+        self._tag_names_by_sha1 = None
+        ## Cache for results that only depend on the refs, e.g. branch containment of a commit
+        self.cache = {}
+
+    def __repr__(self):
+        return "<%s %d refs>" % (self.__class__.__name__, len(self.refs))
+
+    @classmethod
+    def load(cls, repo, stamp):
+        """
+        Read all refs of repo using a single 'git for-each-ref' call.
+        """
+        refs = {}
+        peeled = {}
+        output = repo.git.for_each_ref("--format=%(objectname) %(*objectname) %(refname)")
+        for line in output.splitlines():
+            sha1, peeled_sha1, ref_name = line.split(" ", 2)
+            refs[ref_name] = sha1
+            peeled[ref_name] = peeled_sha1 or sha1
+        head_ref = None
+        head_sha1 = None
+        with open(os.path.join(repo.git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if head.startswith("ref: "):
+            head_ref = head[5:]
+            head_sha1 = refs.get(head_ref)
+        else:
+            head_sha1 = head
+        snapshot = cls(stamp, head_ref, head_sha1, refs)
+        for ref_name, sha1 in refs.items():
+            if ref_name.startswith("refs/heads/"):
+                snapshot.branches[ref_name[len("refs/heads/"):]] = sha1
+            elif ref_name.startswith("refs/remotes/origin/"):
+                branch_name = ref_name[len("refs/remotes/origin/"):]
+                if branch_name != "HEAD":
+                    snapshot.remote_branches[branch_name] = sha1
+            elif ref_name.startswith("refs/tags/"):
+                snapshot.tags[ref_name[len("refs/tags/"):]] = peeled[ref_name]
+        return snapshot
+
+    def is_current(self):
+        """
+        Check whether this snapshot is still valid.
+        A new directory below refs/ changes the modification time of its parent, so the directories known
+        from the stamp are sufficient for the check.
+        """
+        if self.is_racy:
+            return False
+        for entry in self.stamp:
+            if _get_file_stamp(entry[0]) != entry:
+                return False
+        return True
+
+    def get_head_branch_name(self):
+        """
+        Return the name of the checked out branch or None in detached head state.
+        """
+        if self.head_ref is not None and self.head_ref.startswith("refs/heads/"):
+            return self.head_ref[len("refs/heads/"):]
+        return None
+
+    def _get_tag_names_by_sha1(self):
+        """
+        Return the reverse tag index: SHA1 -> sorted tuple of tag names.
+        Annotated tags are indexed by their tag object and the commit they point at.
+        """
+        if self._tag_names_by_sha1 is None:
+            tag_names_by_sha1 = {}
+            for tag_name, sha1 in self.tags.items():
+                tag_names_by_sha1.setdefault(sha1, []).append(tag_name)
+                tag_object_sha1 = self.refs["refs/tags/" + tag_name]
+                if tag_object_sha1 != sha1:
+                    tag_names_by_sha1.setdefault(tag_object_sha1, []).append(tag_name)
+            self._tag_names_by_sha1 = dict([(sha1, tuple(sorted(tag_names))) for sha1, tag_names in tag_names_by_sha1.items()])
+        return self._tag_names_by_sha1
+
+    def get_tag_names_for(self, sha1):
+        """
+        Return a sorted list of tag names pointing at sha1.
+        """
+        return list(self._get_tag_names_by_sha1().get(sha1, ()))
+
+    def resolve(self, name):
+        """
+        Return the SHA1 for HEAD, a full SHA1 or a ref name using the git lookup order.
+        None is returned when name can't be resolved using the refs, e.g. for abbreviated SHA1s.
+        """
+        if name == "HEAD":
+            return self.head_sha1
+        if len(name) == 40 and all(c in "0123456789abcdef" for c in name):
+            return name
+        for prefix in ("", "refs/", "refs/tags/", "refs/heads/", "refs/remotes/"):
+            sha1 = self.refs.get(prefix + name)
+            if sha1 is not None:
+                return sha1
+        return None
+
+class GitStatus(object):
+    """
+    Status of a working tree, see GitRepository.get_status().
+    """
+    def __init__(self):
+        ## Name of the checked out branch, None in detached head state
+        self.branch_name = None
+        ## SHA1 of HEAD, None before the first commit
+        self.head_sha1 = None
+        self.is_detached = False
+        ## Upstream branch, e.g. 'origin/master' or None
+        self.upstream = None
+        ## Number of commits ahead/behind upstream (None when there is no upstream)
+        self.ahead = None
+        self.behind = None
+        ## Staged, unstaged, unmerged and untracked changes
+        self.staged = False
+        self.unstaged = False
+        self.unmerged = False
+        self.untracked = False
+        ## Tuple of the tag names at HEAD or None
+        self.tag_names = None
+        ## Tag based version string of HEAD like 'git describe --tags --dirty --always'
+        self.version = None
+
+    def __repr__(self):
+        return "<%s %s %s%s>" % (self.__class__.__name__, self.branch_name or "(detached)", self.version, " dirty" if self.is_dirty() else "")
+
+    def is_dirty(self, unstaged=True, staged=True):
+        """
+        Check whether there are unstaged and/or staged changes in the working tree.
+        """
+        return (unstaged and (self.unstaged or self.unmerged)) or (staged and (self.staged or self.unmerged))
+
+    def _parse_header(self, key, value):
+        """
+        Evaluate a '# branch.<key> <value>' header line of 'git status --porcelain=v2 --branch'.
+        """
+        if key == "branch.oid":
+            self.head_sha1 = None if value == "(initial)" else value
+        elif key == "branch.head":
+            if value == "(detached)":
+                self.is_detached = True
+            else:
+                self.branch_name = value
+        elif key == "branch.upstream":
+            self.upstream = value
+        elif key == "branch.ab":
+            ahead, behind = value.split()
+            self.ahead = int(ahead)
+            self.behind = -int(behind)
+
+    def parse(self, porcelain_v2_output):
+        """
+        Evaluate the output of 'git status --porcelain=v2 --branch'.
+        """
+        for line in porcelain_v2_output.splitlines():
+            if line.startswith("# "):
+                key, dummy, value = line[2:].partition(" ")
+                self._parse_header(key, value)
+            elif line.startswith("1 ") or line.startswith("2 "):
+                # e.g. '1 .M N... 100644 100644 100644 <sha1> <sha1> readme.txt'
+                self.staged = self.staged or line[2] != "."
+                self.unstaged = self.unstaged or line[3] != "."
+            elif line.startswith("u "):
+                self.unmerged = True
+            elif line.startswith("? "):
+                self.untracked = True
+
+class GitBatchProcess(object):
+    """
+    A long running 'git cat-file --batch-check' process that resolves revisions to SHA1s without starting
+    a git process per query. Queries are serialized, so an instance can be shared between threads.
+    The process is restarted when it terminated unexpectedly.
+    """
+    # Revisions are written in chunks to avoid a deadlock due to full pipe buffers
+    CHUNK_SIZE = 256
+
+    def __init__(self, git_dir):
+        self.cmd = [git.Git.GIT_PYTHON_GIT_EXECUTABLE or "git", "--git-dir=%s" % git_dir, "cat-file", "--batch-check=%(objectname) %(objecttype)"]
+        self.process = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, "running" if self.process is not None else "stopped")
+
+    def _start(self):
+        self.process = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def _stop(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:  # pragma: no cover
+                pass
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+    def close(self):
+        """
+        Terminate the git process.
+        """
+        with self.lock:
+            self._stop()
+
+    def _resolve_chunk(self, revisions):
+        self.process.stdin.write(("\n".join(revisions) + "\n").encode())
+        self.process.stdin.flush()
+        sha1s = []
+        for revision in revisions:
+            line = self.process.stdout.readline().decode().rstrip("\n")
+            if not line:
+                raise OSError("git cat-file terminated")
+            sha1, dummy, object_type = line.rpartition(" ")
+            if object_type in ("missing", "ambiguous"):
+                sha1 = None
+            sha1s.append(sha1)
+        return sha1s
+
+    def resolve(self, revisions):
+        """
+        Return a list of SHA1s for the given revisions. None is returned for revisions that can't be resolved.
+        """
+        sha1s = [None] * len(revisions)
+        # Line breaks would break the line based protocol
+        valid_indices = [idx for idx, revision in enumerate(revisions) if revision and "\n" not in revision]
+        with self.lock:
+            for start in range(0, len(valid_indices), self.CHUNK_SIZE):
+                indices = valid_indices[start:start + self.CHUNK_SIZE]
+                chunk = [revisions[idx] for idx in indices]
+                for attempt in (1, 2):
+                    try:
+                        if self.process is None or self.process.poll() is not None:
+                            self._stop()
+                            self._start()
+                        chunk_sha1s = self._resolve_chunk(chunk)
+                        break
+                    except (OSError, ValueError):
+                        self._stop()
+                        if attempt == 2:
+                            raise
+                for idx, sha1 in zip(indices, chunk_sha1s):
+                    sha1s[idx] = sha1
+        return sha1s
+
+# Ref snapshots are shared between all GitRepository instances of the same repository
+REF_SNAPSHOTS = {}
+REF_SNAPSHOTS_LOCK = threading.Lock()
+
 class GitRepository(git.Repo):
+    _batch_process = None
+    _batch_process_lock = threading.Lock()
+
     def __repr__(self):
         return "<%s '%s'>" % (self.__class__.__name__, self._working_tree_dir)
 
+    def close(self):
+        if self._batch_process is not None:
+            self._batch_process.close()
+        super().close()
+
+    def _get_batch_process(self):
+        """
+        Return the GitBatchProcess of this repository, it is created on first use.
+        """
+        with self._batch_process_lock:
+            if self._batch_process is None:
+                self._batch_process = GitBatchProcess(self.git_dir)
+            return self._batch_process
+
+    def get_ref_snapshot(self):
+        """
+        Return a RefSnapshot of this repository.
+        The snapshot is reused as long as HEAD, packed-refs and refs/ are unchanged.
+        """
+        git_dir = os.path.realpath(self.git_dir)
+        with REF_SNAPSHOTS_LOCK:
+            snapshot = REF_SNAPSHOTS.get(git_dir)
+        if snapshot is None or not snapshot.is_current():
+            stamp = get_ref_stamp(git_dir, os.path.realpath(getattr(self, "common_dir", git_dir)))
+            snapshot = RefSnapshot.load(self, stamp)
+            with REF_SNAPSHOTS_LOCK:
+                REF_SNAPSHOTS[git_dir] = snapshot
+        return snapshot
+
     def get_branch_names(self, local=True, remote=False):
         """
         Return a list of existing branch names for this repository.
         When remote==True: Return known branches from remotes.origin
         """
-        branch_names = []
+        snapshot = self.get_ref_snapshot()
+        branch_names = set()
         if local:
-            branch_names.extend([b.name for b in self.branches])
+            branch_names.update(snapshot.branches)
         if remote:
-            for ref in self.remotes.origin.refs:
-                branch_name = ref.name.partition("/")[2]
-                if branch_name != "HEAD":
-                    if branch_name not in branch_names:
-                        branch_names.append(branch_name)
-        branch_names.sort()
-        return branch_names
+            branch_names.update(snapshot.remote_branches)
+        return sorted(branch_names)
 
     def get_tag_names(self, commit_id=None):
         """
@@ -62,66 +386,125 @@ class GitRepository(git.Repo):
         When commit_id is None: return all available TAGS.
         Otherwise return all TAGS pointing at commit_id
         """
+        snapshot = self.get_ref_snapshot()
         if commit_id is None:
-            return [t.name for t in self.tags]
-        else:
+            return sorted(snapshot.tags)
+        sha1 = snapshot.resolve(commit_id)
+        if sha1 is None:
             return self.git.tag("--points-at", commit_id).split()
+        return snapshot.get_tag_names_for(sha1)
 
     def get_branch_and_tag_info(self):
         """
         Return the branch_name/tag_names HEAD in the repository.
         Return the branch name and a tuple of all matching tag names. When no tag names are found: None is returned as tag_names.
         """
-        # pylama:ignore=C901: C901 'GitRepository.get_branch_and_tag_info' is too complex (11) [mccabe]
-        sha1_maybe, ref = self.head._get_ref_info(self.head.repo, self.head.path)
-        if ref is not None:
-            # e.g.: (sha1_maybe==None, ref=='refs/heads/v1.0.0')
-            branch_name = self.active_branch.name
-            sha1_maybe = self.head.object.hexsha
+        snapshot = self.get_ref_snapshot()
+        sha1 = snapshot.head_sha1
+        if snapshot.head_ref is not None:
+            # e.g.: head_ref=='refs/heads/v1.0.0'
+            branch_name = snapshot.get_head_branch_name()
         else:
-            # e.g.: (sha1_maybe=='55df1ae9c0e30fb064ab8c107a7a9f767020585b', ref==None)
+            # e.g.: sha1=='55df1ae9c0e30fb064ab8c107a7a9f767020585b'
             # Detached head state:
-            # run git log <branchname> to find the branch that contains sha1_maybe
-            branch_names = sorted(self.get_branch_names(), key=branch_name_sort_key)
-            branch_name = None
-            for b_name in branch_names:
-                if sha1_maybe in self.git.log('--pretty=format:%H', b_name):
-                    branch_name = b_name
-                    break
-            if branch_name is None:
-                # When the above test didn't succeed:
-                # run git log <origin/branchname> to find the branch that contains sha1_maybe
-                remote_branch_names = self.get_branch_names(local=False, remote=True)
-                for b_name in branch_names:
-                    if b_name in remote_branch_names:
-                        if sha1_maybe in self.git.log('--pretty=format:%H', "origin/" + b_name):
-                            branch_name = b_name
-                            break
-        tag_names = []
-        tag_string = self.git.log('--pretty=format:%d', sha1_maybe, "-1").strip(" ()\n")
-        for tag_candidate in tag_string.split(","):
-            tag_candidate = tag_candidate.strip()
-            if tag_candidate.startswith("tag: "):
-                tag_names.append(tag_candidate[5:])
-        if tag_names:
-            tag_names.sort()
-            tag_names = tuple(tag_names)
-        else:
-            tag_names = None
+            # find the branch that contains sha1, local branches are preferred over origin/<branchname>
+            branch_name = self._find_branch_containing(sha1)
+        tag_names = tuple(snapshot.get_tag_names_for(sha1)) or None
         return (branch_name, tag_names)
 
+    def _get_branches_containing(self, commit_id, local=True, remote=False):
+        """
+        Return the sets (local_branch_names, remote_branch_names) of all branches that contain commit_id.
+        All branches are checked with a single 'git for-each-ref --contains' call.
+        Remote branch names are returned without the 'origin/' prefix.
+        """
+        ref_patterns = []
+        if local:
+            ref_patterns.append("refs/heads")
+        if remote:
+            ref_patterns.append("refs/remotes/origin")
+        local_branch_names = set()
+        remote_branch_names = set()
+        if ref_patterns:
+            output = self.git.for_each_ref("--contains", commit_id, "--format=%(refname)", *ref_patterns)
+            for ref_name in output.splitlines():
+                if ref_name.startswith("refs/heads/"):
+                    local_branch_names.add(ref_name[len("refs/heads/"):])
+                elif ref_name.startswith("refs/remotes/origin/"):
+                    branch_name = ref_name[len("refs/remotes/origin/"):]
+                    if branch_name != "HEAD":
+                        remote_branch_names.add(branch_name)
+        return local_branch_names, remote_branch_names
+
+    def get_branch_names_containing(self, commit_id, local=True, remote=False):
+        """
+        Return a sorted list of the branch names that contain commit_id.
+        When remote==True: Also consider known branches from remotes.origin
+        """
+        local_branch_names, remote_branch_names = self._get_branches_containing(commit_id, local, remote)
+        return sorted(local_branch_names | remote_branch_names)
+
+    def is_shallow(self):
+        """
+        Check whether this repository is a shallow clone.
+        """
+        return os.path.exists(os.path.join(getattr(self, "common_dir", self.git_dir), "shallow"))
+
+    def deepen(self, depth=None, branch_names=None):
+        """
+        Fetch more history for a shallow clone.
+        When depth is None: fetch the complete history, otherwise deepen the history by depth commits.
+        Without branch_names the configured refspec of origin is fetched, i.e. a single branch clone stays
+        a single branch clone. With branch_names only these origin branches are fetched, not the configured refspec.
+        """
+        Log().out(2, "Deepening '%s'", self._working_tree_dir)
+        refspecs = ["+refs/heads/%s:refs/remotes/origin/%s" % (name, name) for name in branch_names or []]
+        if depth is None:
+            self.git.fetch("--unshallow", "origin", *refspecs)
+        else:
+            self.git.fetch("--deepen=%d" % depth, "origin", *refspecs)
+
+    def _find_branch_containing(self, commit_id):
+        """
+        Return the best matching branch name that contains commit_id or None.
+        Local branches are checked first, then origin/<branchname> for all local branch names.
+        Candidates are prioritized via branch_name_sort_key.
+        Shallow clones with local branches are deepened when no branch contains commit_id.
+        """
+        snapshot = self.get_ref_snapshot()
+        cache_key = ("branch_containing", commit_id)
+        if cache_key not in snapshot.cache:
+            local_branch_names, remote_branch_names = self._get_branches_containing(commit_id, local=True, remote=True)
+            candidates = local_branch_names or remote_branch_names.intersection(snapshot.branches)
+            if candidates:
+                snapshot.cache[cache_key] = min(candidates, key=branch_name_sort_key)
+            elif snapshot.branches and self.is_shallow():
+                try:
+                    self.deepen(branch_names=sorted(set(snapshot.branches).intersection(snapshot.remote_branches)))
+                except git.GitCommandError as e:
+                    Log().out(2, "Deepening '%s' failed: %s", self._working_tree_dir, e)
+                    snapshot.cache[cache_key] = None
+                else:
+                    return self._find_branch_containing(commit_id)
+            else:
+                snapshot.cache[cache_key] = None
+        return snapshot.cache[cache_key]
+
     def is_in_detached_head_state(self):
         """
         Check whether the current checkout is in detached head state.
         """
-        ref = self.head._get_ref_info(self.head.repo, self.head.path)[1]
-        return ref is None
+        return self.get_ref_snapshot().head_ref is None
 
     def get_checkout_info_string(self):
         """
         Get a descriptive info string for the current checked out branch/tag
         """
-        active_branch_name, active_tag_names = self.get_branch_and_tag_info()
+        status = self.get_status(untracked_files="no")
+        active_branch_name = status.branch_name
+        if status.is_detached:
+            active_branch_name = self._find_branch_containing(status.head_sha1)
+        active_tag_names = status.tag_names
         branch_info = "Branch: %s" % active_branch_name if active_branch_name else None
         if active_tag_names:
             if len(active_tag_names) == 1:
@@ -132,13 +515,33 @@ class GitRepository(git.Repo):
             tag_info = None
         info_list = [info for info in [branch_info, tag_info] if info]
         info_string = ", ".join(info_list)
-        head_version = self.get_head_version()
-        if head_version not in (active_tag_names or []):
-            info_string += " [%s]" % head_version
-        if self.is_in_detached_head_state():
+        if status.version not in (active_tag_names or []):
+            info_string += " [%s]" % status.version
+        if status.is_detached:
             info_string += " [Detached HEAD]"
         return info_string
 
+    def get_status(self, untracked_files="normal", fast=False):
+        """
+        Return a GitStatus for the working tree using 'git status --porcelain=v2 --branch' and 'git describe'.
+        untracked_files: 'no', 'normal' or 'all' (see git status --untracked-files)
+        When fast is set: use the untracked cache and - with git >= 2.36 - the builtin file system monitor.
+        """
+        config = []
+        if fast:
+            config.append("core.untrackedCache=true")
+            # Older git versions interpret core.fsmonitor as hook command
+            if self.git.version_info >= (2, 36):
+                config.append("core.fsmonitor=true")
+        status = GitStatus()
+        status.parse(self.git(c=config).status("--porcelain=v2", "--branch", "--untracked-files=%s" % untracked_files))
+        if status.head_sha1 is not None:
+            status.tag_names = tuple(self.get_ref_snapshot().get_tag_names_for(status.head_sha1)) or None
+            status.version = self.git.describe("--tags", "--always", status.head_sha1)
+            if status.is_dirty():
+                status.version += "-dirty"
+        return status
+
     def get_active_branch_name(self):
         """
         Get the name of the active branch name.
@@ -162,7 +565,19 @@ class GitRepository(git.Repo):
         Get an SHA1 string for the given version.
         version can be any symbolic git revision name.
         """
-        return self.git.rev_parse(version+"^0")
+        return self.get_sha1_for_versions([version])[0]
+
+    def get_sha1_for_versions(self, versions):
+        """
+        Get a list of SHA1 strings for the given versions.
+        All versions are resolved using the long running git process of this repository.
+        """
+        sha1s = self._get_batch_process().resolve([version + "^0" for version in versions])
+        for idx, sha1 in enumerate(sha1s):
+            if sha1 is None:
+                # Let git report the problem
+                sha1s[idx] = self.git.rev_parse(versions[idx] + "^0")
+        return sha1s
 
     def is_dirty(self, unstaged=True, staged=True):
         """
@@ -187,12 +602,13 @@ class GitRepository(git.Repo):
         When tag_message is not None: Use it to create an annotated tag
         When tag_message is None: Create a lightweight tag
         """
-        if tag_name not in self.get_tag_names():
+        snapshot = self.get_ref_snapshot()
+        if tag_name not in snapshot.tags:
             # a) a new TAG
             super(self.__class__, self).create_tag(tag_name, message=tag_message)
         else:
             # b) an existing TAG
-            if self.tags[tag_name].commit == self.head.commit:
+            if snapshot.tags[tag_name] == snapshot.head_sha1:
                 # b1) All o.k.: TAG already present at HEAD
                 pass
             else:
@@ -200,21 +616,25 @@ class GitRepository(git.Repo):
                 raise GitException("%s: TAG '%s' does already exist in commit history" % (self, tag_name))
         return tag_name
 
-    def push(self, with_tags=False, all=False, force=False, where_to="origin"):
+    def push(self, with_tags=False, all=False, force=False, where_to="origin", atomic=False):
         """
         Push to the remote repository
+        Branches (the active branch or all branches) and tags are pushed using a single connection.
+        When force is set: the branches are force pushed.
+        When atomic is set: either all refs are updated on the remote side or none.
         """
-        infos = []
+        branch_refspec_prefix = "+" if force else ""
         if all:
-            infos.extend(self.remotes[where_to].push("--all"))
+            refspecs = [branch_refspec_prefix + "refs/heads/*:refs/heads/*"]
         else:
-            infos.extend(self.remotes[where_to].push(refspec="{}:{}".format(self.active_branch.name,self.active_branch.name)))
-
-        if force:
-            infos.extend(self.remotes[where_to].push("--force"))
-
+            branch_ref = "refs/heads/%s" % self.active_branch.name
+            refspecs = ["%s%s:%s" % (branch_refspec_prefix, branch_ref, branch_ref)]
         if with_tags:
-            infos.extend(self.remotes[where_to].push("--tags"))
+            refspecs.append("refs/tags/*:refs/tags/*")
+        kwargs = {}
+        if atomic:
+            kwargs["atomic"] = True
+        infos = self.remotes[where_to].push(refspec=refspecs, **kwargs)
 
         failure_flags = git.remote.PushInfo.DELETED | git.remote.PushInfo.ERROR | git.remote.PushInfo.NO_MATCH | git.remote.PushInfo.REJECTED | git.remote.PushInfo.REMOTE_FAILURE | git.remote.PushInfo.REMOTE_REJECTED
         for info in infos:
@@ -267,7 +687,7 @@ class MscGitRepository(GitRepository):
         if not sync_target:
             sync_target = self._get_sync_target(MSC_PUBLIC_GIT_SERVER)
 
-        Log().out(2, "sync_to_public: %s -> %s" % (self.remotes.origin.url, sync_target))
+        Log().out_lazy(2, lambda: "sync_to_public: %s -> %s" % (self.remotes.origin.url, sync_target))
         if not dry_run:
             if sync_to_public_remote in [r.name for r in self.remotes]:
                 # Delete remote when it does already exist
@@ -288,40 +708,413 @@ class MscGitRepository(GitRepository):
             Log().error("'%s': %s" % (self._working_tree_dir, e))
             return False
 
+DEFAULT_PORTS = {"ssh": 22, "git": 9418, "http": 80, "https": 443}
+
+def _split_remote_url(url):
+    """
+    Return (scheme, user_and_host, port) of a git remote URL.
+    For local repositories (paths and file:// URLs) ("file", "", None) is returned.
+    """
+    if "://" in url:
+        scheme, dummy, location = url.partition("://")
+        if scheme == "file":
+            return ("file", "", None)
+        location = location.partition("/")[0]
+    else:
+        # scp like syntax: [user@]host:path
+        scheme = "ssh"
+        location, sep, path = url.partition(":")
+        if not sep or "/" in location:
+            return ("file", "", None)
+        location += ":"
+    user_and_host, sep, port = location.rpartition(":")
+    if not sep:
+        user_and_host = location
+    port = int(port) if port.isdigit() else DEFAULT_PORTS.get(scheme)
+    return (scheme, user_and_host, port)
+
+def get_remote_host(url):
+    """
+    Return the host name of a git remote URL.
+    For local repositories (paths and file:// URLs) an empty string is returned.
+    """
+    return _split_remote_url(url)[1].rpartition("@")[2]
+
+class RepositoryResult(object):
+    """
+    The result of an operation on a single repository of a MscGitWorkspace.
+    """
+    def __init__(self, path, success, duration, error=None):
+        self.path = path
+        self.success = success
+        ## Duration of the operation in seconds
+        self.duration = duration
+        ## The error text when the operation failed
+        self.error = error
+
+    def __repr__(self):
+        state = "o.k." if self.success else "failed: %s" % self.error
+        return "<%s '%s' %.2fs %s>" % (self.__class__.__name__, self.path, self.duration, state)
+
+class MscGitWorkspace(object):
+    """
+    Run MscGitRepository operations (update, sync_to_public) on many repositories in parallel.
+    At most max_workers repositories are processed at the same time, remote operations are limited to
+    max_connections_per_host concurrent connections per remote host.
+    """
+    def __init__(self, paths, max_workers=8, max_connections_per_host=4):
+        self.paths = list(paths)
+        self.max_workers = max_workers
+        self.max_connections_per_host = max_connections_per_host
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
+
+    def __repr__(self):
+        return "<%s %d repositories>" % (self.__class__.__name__, len(self.paths))
+
+    def _get_host_semaphore(self, url):
+        host = get_remote_host(url)
+        with self._host_semaphores_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_connections_per_host)
+            return self._host_semaphores[host]
+
+    def _run_operation(self, path, operation):
+        """
+        Run operation(path, repo) on the repository at path.
+        operation returns the remote URL and a function that does the remote access.
+        """
+        start_time = time.time()
+        repo = None
+        try:
+            repo = MscGitRepository(path)
+            remote_url, remote_access = operation(path, repo)
+            with self._get_host_semaphore(remote_url):
+                remote_access()
+            return RepositoryResult(path, True, time.time() - start_time)
+        except Exception as e:
+            return RepositoryResult(path, False, time.time() - start_time, str(e) or e.__class__.__name__)
+        finally:
+            if repo is not None:
+                repo.close()
+
+    def _run(self, operation_name, operation):
+        """
+        Run operation on all repositories and return the list of RepositoryResult (in the order of self.paths).
+        """
+        results = [None] * len(self.paths)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+             Log().create_progress(operation_name, total=len(self.paths)) as progress:
+            futures = {}
+            for idx, path in enumerate(self.paths):
+                futures[executor.submit(self._run_operation, path, operation)] = idx
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                results[futures[future]] = result
+                # Throttled: the progress line is refreshed at most every refresh interval of the renderer
+                progress.update()
+                if not result.success:
+                    Log().error("'%s': %s" % (result.path, result.error))
+        return results
+
+    def update(self):
+        """
+        Pull all repositories from origin.
+        """
+        def operation(path, repo):
+            origin = repo.remotes.origin
+            return origin.url, origin.pull
+        return self._run("update", operation)
+
+    def sync_to_public(self, dry_run=False, all=True, force=False, sync_server=MSC_PUBLIC_GIT_SERVER, sync_targets=None):
+        """
+        Sync all repositories to the public mirror.
+        sync_targets can map repository paths to explicit sync targets, otherwise the target is derived from sync_server.
+        """
+        sync_targets = sync_targets or {}
+        def operation(path, repo):
+            sync_target = sync_targets.get(path) or repo._get_sync_target(sync_server)
+            return sync_target, lambda: repo.sync_to_public(dry_run=dry_run, all=all, force=force, sync_target=sync_target)
+        return self._run("sync_to_public", operation)
+
+# Private per user directory: a cache file in a shared directory could be forged by other users
+GIT_ACCESS_CACHE_FILE_NAME = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "msc", "git_access.json")
+
+class GitEndpointStatus(object):
+    """
+    Reachability of a git server, see probe_git_servers()
+    """
+    def __init__(self, url, reachable, latency=None, error=None):
+        self.url = url
+        self.reachable = reachable
+        ## Duration of the probe in seconds
+        self.latency = latency
+        self.error = error
+
+    def __repr__(self):
+        if self.reachable:
+            return "<GitEndpointStatus %s: reachable (%.3fs)>" % (self.url, self.latency)
+        return "<GitEndpointStatus %s: unreachable (%s)>" % (self.url, self.error)
+
+async def _probe_tcp(host, port, timeout):
+    """
+    Open (and close) a TCP connection to host:port.
+    """
+    import asyncio # not at module level: importing asyncio is slow
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+async def _probe_ssh(user_and_host, port, timeout):
+    """
+    Run 'ssh -p port user_and_host info' without prompting for passwords.
+    """
+    import asyncio
+    process = await asyncio.create_subprocess_exec(
+        "ssh", "-p", str(port), "-o", "BatchMode=yes", "-o", "ConnectTimeout=%d" % max(1, int(timeout)), user_and_host, "info",
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        dummy, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        raise GitException("ssh %s failed: %s" % (user_and_host, stderr.decode(errors="replace").strip()))
+
+async def _probe_git_server(url, timeout, ssh_handshake):
+    """
+    Probe a single git server: TCP connect first, then the optional ssh handshake.
+    Local repositories are reachable when their directory exists.
+    """
+    import asyncio
+    scheme, user_and_host, port = _split_remote_url(url)
+    start = time.monotonic()
+    try:
+        if scheme == "file":
+            if get_local_repository_path(url) is None:
+                raise GitException("No such directory")
+        else:
+            await _probe_tcp(user_and_host.rpartition("@")[2], port, timeout)
+            if ssh_handshake and scheme == "ssh":
+                await _probe_ssh(user_and_host, port, max(0, timeout - (time.monotonic() - start)))
+    except asyncio.TimeoutError:
+        return GitEndpointStatus(url, False, time.monotonic() - start, "Timeout after %ss" % timeout)
+    except (OSError, GitException) as e:
+        return GitEndpointStatus(url, False, time.monotonic() - start, str(e))
+    return GitEndpointStatus(url, True, time.monotonic() - start)
+
+def _is_private(st):
+    """
+    Check whether the file with the os.stat() result st belongs to the current user and can't be written by others.
+    """
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+def _load_git_access_cache():
+    try:
+        with open(GIT_ACCESS_CACHE_FILE_NAME) as f:
+            if not _is_private(os.fstat(f.fileno())):
+                Log().out(2, "Ignoring %s: not private", GIT_ACCESS_CACHE_FILE_NAME)
+                return {}
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def _save_git_access_cache(cache):
+    cache_dir = os.path.dirname(GIT_ACCESS_CACHE_FILE_NAME)
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if not _is_private(os.stat(cache_dir)):
+            raise OSError("Directory %s is not private" % cache_dir)
+        fd, tmp_file_name = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_file_name, GIT_ACCESS_CACHE_FILE_NAME)
+        except BaseException:
+            os.unlink(tmp_file_name)
+            raise
+    except OSError as e:
+        Log().out(2, "Could not write %s: %s", GIT_ACCESS_CACHE_FILE_NAME, e)
+
+def _get_cached_status(url, entry, now, ttl):
+    """
+    Return the GitEndpointStatus of a git access cache entry, None when it is expired or malformed
+    (e.g. written by an older version).
+    """
+    try:
+        if 0 <= now - entry["time"] < ttl:
+            return GitEndpointStatus(url, bool(entry["reachable"]), float(entry["latency"]), entry["error"])
+    except (KeyError, TypeError, ValueError):
+        pass
+    return None
+
+def probe_git_servers(urls, timeout=None, ssh_handshake=True, use_cache=True):
+    """
+    Check concurrently whether the git servers in urls can be reached.
+    Each server gets a TCP connect probe, ssh servers additionally an 'ssh info' handshake when ssh_handshake is set.
+    The whole probe of a server is limited by timeout (default: MSC_GIT_ACCESS_TIMEOUT).
+    The results are cached for MSC_GIT_ACCESS_CACHE_TTL seconds in GIT_ACCESS_CACHE_FILE_NAME when use_cache is set,
+    so that consecutive tool invocations don't probe again.
+    Returns a list of GitEndpointStatus in the order of urls.
+    """
+    import asyncio
+    if timeout is None:
+        timeout = float(MSC_GIT_ACCESS_TIMEOUT.get_value())
+    cache = _load_git_access_cache() if use_cache else {}
+    ttl = float(MSC_GIT_ACCESS_CACHE_TTL.get_value())
+    now = time.time()
+    results = {}
+    for url in urls:
+        status = _get_cached_status(url, cache.get("%s ssh=%d" % (url, ssh_handshake)), now, ttl)
+        if status is not None:
+            results[url] = status
+    urls_to_probe = [url for url in dict.fromkeys(urls) if url not in results]
+    if urls_to_probe:
+        async def probe_all():
+            return await asyncio.gather(*[_probe_git_server(url, timeout, ssh_handshake) for url in urls_to_probe])
+        for status in asyncio.run(probe_all()):
+            Log().out(2, "probe_git_servers: %r", status)
+            results[status.url] = status
+            if _split_remote_url(status.url)[0] != "file":
+                cache["%s ssh=%d" % (status.url, ssh_handshake)] = {"time": now, "reachable": status.reachable,
+                                                                    "latency": status.latency, "error": status.error}
+        if use_cache:
+            cache = dict((key, entry) for (key, entry) in cache.items() if _get_cached_status(key, entry, now, ttl) is not None)
+            _save_git_access_cache(cache)
+    return [results[url] for url in urls]
+
+def select_git_endpoint(urls, ssh_handshake=False):
+    """
+    Return the fastest reachable url of urls, None when none of them can be reached.
+    """
+    statuses = [status for status in probe_git_servers(urls, ssh_handshake=ssh_handshake) if status.reachable]
+    if not statuses:
+        return None
+    return min(statuses, key=lambda status: status.latency).url
+
 def check_git_access(dry_run=False):
     """
     Check whether the git server can be accessed.
+    The git server and the git server cache (if any) are probed concurrently, see probe_git_servers().
     """
     git_server = get_git_server()
     if git_server.startswith("ssh://"):
-        git_ssh_server = git_server.partition("ssh://")[2].rstrip("/")
-        ssh_server, dummy, ssh_port = git_ssh_server.partition(":")
-        cmd = "ssh -p %s %s info" % (ssh_port, ssh_server)
-        Log().out(2, "check_git_access: %s" % cmd)
+        urls = [git_server]
+        git_server_cache = get_git_server_cache()
+        if git_server_cache is not None:
+            urls.append(git_server_cache)
+        Log().out(2, "check_git_access: probing %s",
+                  ", ".join("%s:%s" % (get_remote_host(url), _split_remote_url(url)[2]) for url in urls))
         if not dry_run:
-            return subprocess.getstatusoutput(cmd)[0] == 0
+            return probe_git_servers(urls)[0].reachable
     return True
 
-def clone(remote_url, where_to):
+def get_local_repository_path(url):
+    """
+    Return the local path for a file:// URL or a local path of an existing directory, None otherwise.
+    """
+    if url.startswith("file://"):
+        path = url[len("file://"):]
+    elif "://" in url or get_remote_host(url):
+        return None
+    else:
+        path = url
+    path = path.rstrip("/") or "/"
+    if os.path.isdir(path):
+        return path
+    return None
+
+def _get_clone_options(branch, depth, single_branch, filter, sparse_paths):
+    """
+    Return the keyword arguments of git.Repo.clone_from() for the parameters of clone().
+    """
+    clone_options = {}
+    if branch:
+        clone_options["branch"] = branch
+    if depth:
+        clone_options["depth"] = depth
+    if single_branch:
+        clone_options["single_branch"] = True
+    if filter:
+        clone_options["filter"] = filter
+    if sparse_paths:
+        clone_options["sparse"] = True
+    return clone_options
+
+def _update_cache(cache_path):
+    """
+    Fetch the git cache at cache_path from its origin.
+    """
+    cache_repo = git.Repo(cache_path)
+    if "origin" in [r.name for r in cache_repo.remotes]:
+        Log().out(2, "Updating git cache: %s", cache_path)
+        cache_repo.remotes.origin.fetch(prune=True)
+    cache_repo.close()
+
+def _clone_from_remote_cache(cached_remote_url, remote_url, where_to, depth, clone_options):
+    """
+    Clone from the remote git cache and update the clone from remote_url.
+    """
+    Log().out(2, "Cloning from git cache: %s", cached_remote_url)
+    repo = git.Repo.clone_from(cached_remote_url, where_to, **clone_options)
+    # Replace git cache url by the server url
+    origin = repo.remotes.origin
+    cw = origin.config_writer
+    cw.set("url", remote_url)
+    cw.release()
+    update_options = {}
+    if depth:
+        update_options["depth"] = depth
+    if repo.head.is_detached:
+        # e.g. a TAG was cloned
+        origin.fetch(**update_options)
+    else:
+        origin.pull(**update_options)
+    return repo
+
+def _clone_via_cache(remote_url, where_to, dissociate, update_cache, depth, clone_options):
+    """
+    Clone remote_url using the git server cache. Returns None when no cache is used.
+    """
+    git_server = get_git_server()
+    git_server_cache = get_git_server_cache()
+    if not remote_url.startswith(git_server) or git_server_cache is None:
+        return None
+    cached_remote_url = git_server_cache + remote_url[len(git_server):]
+    cache_path = get_local_repository_path(cached_remote_url)
+    if cache_path is not None:
+        Log().out(2, "Cloning from git cache: %s", cached_remote_url)
+        if update_cache:
+            _update_cache(cache_path)
+        return git.Repo.clone_from(remote_url, where_to, reference_if_able=cache_path, dissociate=dissociate, **clone_options)
+    if select_git_endpoint([git_server_cache, git_server]) == git_server_cache:
+        return _clone_from_remote_cache(cached_remote_url, remote_url, where_to, depth, clone_options)
+    return None
+
+def clone(remote_url, where_to, dissociate=False, update_cache=False, branch=None, depth=None, single_branch=False, filter=None, sparse_paths=None):
     """
     Clone git repository from remote_url at local path where_to
     Respects MSC_GIT_SERVER and MSC_GIT_SERVER_CACHE
+    When the cache is a local directory it is used as reference repository (git clone --reference):
+    Only the objects that are missing in the cache are fetched from remote_url.
+    When dissociate is set: the objects are copied from the cache, otherwise the clone borrows them via alternates.
+    When update_cache is set: the cache is fetched from its origin before cloning.
+    The remaining parameters restrict the amount of cloned data:
+      branch        ... branch or tag to check out
+      depth         ... create a shallow clone with the given number of commits (implies single_branch)
+      single_branch ... only clone the history of branch (or the remote HEAD)
+      filter        ... partial clone filter, e.g. 'blob:none' or 'tree:0'
+      sparse_paths  ... only check out the given directories (sparse checkout in cone mode)
     """
-    git_server = get_git_server()
-    repo = None
-    if remote_url.startswith(git_server):
-        git_server_cache = get_git_server_cache()
-        if git_server_cache is not None:
-            relative_url = remote_url[len(git_server):]
-            cached_remote_url = git_server_cache + relative_url
-            Log().out(2, "Cloning from git cache: %s" % cached_remote_url)
-            repo = git.Repo.clone_from(cached_remote_url, where_to)
-            # Replace git cache url by the server url
-            origin = repo.remotes.origin
-            cw = origin.config_writer
-            cw.set("url", remote_url)
-            cw.release()
-            origin.pull()
+    clone_options = _get_clone_options(branch, depth, single_branch, filter, sparse_paths)
+    repo = _clone_via_cache(remote_url, where_to, dissociate, update_cache, depth, clone_options)
     if repo is None:
-        repo = git.Repo.clone_from(remote_url, where_to)
+        repo = git.Repo.clone_from(remote_url, where_to, **clone_options)
+    if sparse_paths:
+        repo.git.sparse_checkout("set", *sparse_paths)
     return repo
@@ -12,15 +12,33 @@
 #  Copyright (c) 2016 -- MSC Technologies
 # ----------------------------------------------------------------------------------
 
+import atexit
+import datetime
+import functools
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import select
 import sys
+import threading
+import time
 
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 
+from .Conversions import ConvertStorageSize
 from .EnvironmentVariable import EnvironmentVariable
 
 MSC_FD3_IS_WARNING_PIPE = EnvironmentVariable("MSC_FD3_IS_WARNING_PIPE", "Output Warnings on file descriptor 3.")
+MSC_FD3_BATCH_SIZE = EnvironmentVariable("MSC_FD3_BATCH_SIZE", "Collect warnings up to this number of bytes before writing them to file descriptor 3.")
+MSC_LOG_JSON_FILE = EnvironmentVariable("MSC_LOG_JSON_FILE", "Additionally write the log records as JSON lines to this file.")
+MSC_LOG_JSON_FILE_MAX_SIZE = EnvironmentVariable("MSC_LOG_JSON_FILE_MAX_SIZE", "Rotate the JSON lines log file at this size.", default_value="10MB")
+MSC_LOG_SUPPRESS_REPEATED = EnvironmentVariable("MSC_LOG_SUPPRESS_REPEATED", "Collapse repeated identical warnings and errors within this number of seconds.")
+MSC_LOG_RING_BUFFER_SIZE = EnvironmentVariable("MSC_LOG_RING_BUFFER_SIZE", "Number of recent log messages (including suppressed verbose messages) written to the application log file on errors.", default_value="1000")
+MSC_LOG_RING_BUFFER_VERBOSITY = EnvironmentVariable("MSC_LOG_RING_BUFFER_VERBOSITY", "Highest verbosity level of the suppressed Log().out() messages that are kept in the ring buffer.", default_value="1")
+MSC_LOG_ASYNC = EnvironmentVariable("MSC_LOG_ASYNC", "Write the log output from a background thread.")
+MSC_LOG_FLUSH_INTERVAL = EnvironmentVariable("MSC_LOG_FLUSH_INTERVAL", "Flush interval in seconds for the background log writer.", default_value="0.1")
 
 ESC = chr(27)
 CURSOR_UP = ESC+"[1A"+ESC+"[K" # Move cursor up one line and delete to the end of line
@@ -54,9 +72,269 @@ def colorize(color, txt):
 # For unit testing: allow to force the usage of colors
 FORCE_COLORS = False
 
-LOG_CALL_COUNT = defaultdict(int)
-class MscLogStreamHandler(logging.Handler):
+# Writes of up to PIPE_BUF bytes to a pipe are atomic, they don't interleave with writes of other processes
+PIPE_BUF = getattr(select, "PIPE_BUF", 512)
+
+class Fd3Channel(object):
+    """
+    Writer for the warnings on file descriptor 3.
+    Each write is done with a single os.write call (for up to PIPE_BUF bytes), longer data is split at line ends.
+    When batch_size is set, the data is collected until batch_size bytes are reached or batch_delay seconds are over.
+    When file descriptor 3 is not available the data is written to stderr.
+    """
+    def __init__(self, fd=3, batch_size=0, batch_delay=0.1):
+        self.fd = fd
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.buffer = []
+        self.buffer_size = 0
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def write(self, txt):
+        """
+        Write txt, which consists of complete lines.
+        """
+        data = txt.encode()
+        if not self.batch_size:
+            self._write(data)
+            return
+        with self.lock:
+            self.buffer.append(data)
+            self.buffer_size += len(data)
+            if self.buffer_size < self.batch_size:
+                if self.timer is None:
+                    self.timer = threading.Timer(self.batch_delay, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+            self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.buffer:
+            data = b"".join(self.buffer)
+            self.buffer = []
+            self.buffer_size = 0
+            self._write(data)
+
+    def _write(self, data):
+        try:
+            while data:
+                end = len(data)
+                if end > PIPE_BUF:
+                    end = data.rfind(b"\n", 0, PIPE_BUF) + 1 or data.find(b"\n", PIPE_BUF) + 1 or len(data)
+                data = data[os.write(self.fd, data[:end]):]
+        except OSError:
+            sys.stderr.write(data.decode(errors="replace"))
+
+class AsyncLogWriter(object):
+    """
+    Write log messages from a background thread.
+    The messages are queued as (stream, msg) - stream is None for messages to fd3_channel.
+    The queue is bounded: when it is full the logging thread waits, no message is dropped.
+    Consecutive messages for the same stream are written with a single write call,
+    the streams are flushed when the queue is empty or after flush_interval seconds.
+    """
+    _STOP = object()
+
+    def __init__(self, queue_size=10000, flush_interval=0.1, batch_size=1000, fd3_channel=None):
+        self.queue = queue.Queue(queue_size)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fd3_channel = fd3_channel
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="MscLogWriter", daemon=True)
+        self.thread.start()
+
+    def put(self, stream, msg):
+        with self.lock:
+            if not self.closed:
+                self.queue.put((stream, msg))
+                return
+        # Keep the order: the queued messages are written first
+        self.thread.join()
+        self.write([(stream, msg)])
+
+    def write(self, items):
+        """
+        Write the items, return the set of streams that were written.
+        """
+        written_streams = set()
+        start = 0
+        while start < len(items):
+            stream = items[start][0]
+            end = start + 1
+            while end < len(items) and items[end][0] is stream:
+                end += 1
+            data = "\n".join(item[1] for item in items[start:end]) + "\n"
+            if stream is None:
+                self.fd3_channel.write(data)
+            else:
+                stream.write(data)
+                written_streams.add(stream)
+            start = end
+        return written_streams
+
+    def _get_items(self):
+        """
+        Wait for up to batch_size items, return (items, stop).
+        """
+        try:
+            items = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            items = []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = self._STOP in items
+        if stop:
+            items.remove(self._STOP)
+        return items, stop
+
+    def _run(self):
+        streams_to_flush = set()
+        last_flush = time.monotonic()
+        stop = False
+        while not stop:
+            items, stop = self._get_items()
+            try:
+                streams_to_flush.update(self.write(items))
+                if streams_to_flush and (self.queue.empty() or time.monotonic() - last_flush >= self.flush_interval):
+                    for stream in streams_to_flush:
+                        stream.flush()
+                    streams_to_flush.clear()
+                    last_flush = time.monotonic()
+            except Exception:  # pragma: no cover
+                # The streams may have been closed at interpreter shutdown
+                streams_to_flush.clear()
+            for dummy in range(len(items) + stop):
+                self.queue.task_done()
+
+    def drain(self):
+        """
+        Wait until all queued messages are written.
+        """
+        if self.thread.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """
+        Write the queued messages and stop the background thread.
+        Messages logged afterwards are written synchronously.
+        """
+        # closed is set together with queuing _STOP: no message is queued after it
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.queue.put(self._STOP)
+        self.thread.join()
+
+## Process wide Fd3Channel and AsyncLogWriter, shared by all MscLogStreamHandlers to keep the order of the messages
+_shared_fd3_channel = None
+_shared_async_log_writer = None
+_shared_lock = threading.Lock()
+
+def get_fd3_channel():
+    """
+    Return the process wide Fd3Channel.
+    """
+    global _shared_fd3_channel
+    with _shared_lock:
+        if _shared_fd3_channel is None:
+            _shared_fd3_channel = Fd3Channel(batch_size=int(MSC_FD3_BATCH_SIZE.get_value() or 0))
+            atexit.register(_shared_fd3_channel.flush)
+        return _shared_fd3_channel
+
+def get_async_log_writer(queue_size=10000, flush_interval=0.1):
+    """
+    Return the process wide AsyncLogWriter.
+    queue_size and flush_interval are used when the writer is started, i.e. by the first caller.
+    """
+    global _shared_async_log_writer
+    fd3_channel = get_fd3_channel()
+    with _shared_lock:
+        if _shared_async_log_writer is None or _shared_async_log_writer.closed:
+            _shared_async_log_writer = AsyncLogWriter(queue_size, flush_interval, fd3_channel=fd3_channel)
+            atexit.register(_shared_async_log_writer.close)
+        return _shared_async_log_writer
+
+def close_async_log_writer():
+    """
+    Write the queued messages and stop the process wide AsyncLogWriter.
+    Messages logged afterwards by the existing handlers are written synchronously.
+    """
+    with _shared_lock:
+        writer = _shared_async_log_writer
+    if writer is not None:
+        writer.close()
+
+class LogCallCounter(object):
+    """
+    Thread safe counter of the logging calls per logger name and level name.
+    Counts of other processes can be added with merge(), see call_with_log_call_counts().
+    """
     def __init__(self):
+        self.counts = defaultdict(int)
+        self.lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # The lock might be held by another thread while forking
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self.lock = threading.Lock()
+
+    def increment(self, logger_name, level_name, count=1):
+        with self.lock:
+            self.counts[(logger_name, level_name)] += count
+
+    def get(self, level_name, logger_name=None):
+        """
+        Return the count for level_name, for all loggers when logger_name is None.
+        """
+        with self.lock:
+            if logger_name is not None:
+                return self.counts.get((logger_name, level_name), 0)
+            return sum(count for ((name, level), count) in self.counts.items() if level == level_name)
+
+    def __getitem__(self, level_name):
+        return self.get(level_name)
+
+    def snapshot(self):
+        """
+        Return a copy of the counts: {(logger_name, level_name): count}
+        """
+        with self.lock:
+            return dict(self.counts)
+
+    def merge(self, counts):
+        """
+        Add counts, e.g. the result of snapshot() or call_with_log_call_counts() of another process.
+        """
+        with self.lock:
+            for key, count in counts.items():
+                self.counts[key] += count
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+
+LOG_CALL_COUNT = LogCallCounter()
+class MscLogStreamHandler(logging.Handler):
+    def __init__(self, asynchronous=None, queue_size=10000, flush_interval=None):
+        """
+        When asynchronous is set (default: MSC_LOG_ASYNC is set) the messages are written by the process wide
+        AsyncLogWriter, see get_async_log_writer().
+        """
         logging.Handler.__init__(self)
         # self.warn_file_stream uses file descriptor 3 when available, otherwise stderr
         # shell% ./1.py 3 > warn_log_file
@@ -64,60 +342,318 @@ class MscLogStreamHandler(logging.Handler):
             self.use_fd3_as_warning_stream = True
         else:
             self.use_fd3_as_warning_stream = False
+        ## {"stdout"/"stderr": (stream, stream.isatty())}, refreshed when sys.stdout/sys.stderr are replaced
+        self.tty_cache = {}
+        self.fd3_channel = get_fd3_channel()
+        if asynchronous is None:
+            asynchronous = MSC_LOG_ASYNC.get_value() is not None
+        if flush_interval is None:
+            flush_interval = float(MSC_LOG_FLUSH_INTERVAL.get_value())
+        self.writer = get_async_log_writer(queue_size, flush_interval) if asynchronous else None
+
+    @property
+    def use_fd3_as_warning_stream(self):
+        return self._use_fd3_as_warning_stream
+
+    @use_fd3_as_warning_stream.setter
+    def use_fd3_as_warning_stream(self, value):
+        self._use_fd3_as_warning_stream = value
+        ## {levelno: (target, color, label, level_name)} with target "stdout", "stderr" or "fd3"
+        self.routes = {}
+
+    def _add_route(self, levelno):
+        level_name = logging.getLevelName(levelno)
+        target = "stdout"
+        color = None
+        label = "%s: " % level_name
+        if levelno == logging.ERROR:
+            target = "stderr"
+            color = COLOR.ERROR
+        elif levelno == logging.WARNING:
+            target = "fd3" if self.use_fd3_as_warning_stream else "stderr"
+            color = COLOR.WARNING
+        elif levelno == logging.DEBUG:
+            color = COLOR.DEBUG
+        elif levelno == logging.INFO:
+            color = COLOR.INFO
+        elif levelno == logging.NOTICE:
+            color = COLOR.NOTICE
+        elif levelno == logging.OUT:
+            label = ""
+        route = self.routes[levelno] = (target, color, label, level_name)
+        return route
+
+    def _isatty(self, target, stream):
+        tty_info = self.tty_cache.get(target)
+        if tty_info is None or tty_info[0] is not stream:
+            tty_info = self.tty_cache[target] = (stream, stream.isatty())
+        return tty_info[1]
+
+    def flush(self):
+        if self.writer is not None:
+            self.writer.drain()
+        self.fd3_channel.flush()
+
+    def close(self):
+        # The process wide writer is shared with the other handlers, it is stopped at exit
+        self.flush()
+        logging.Handler.close(self)
 
     def emit(self, record):
         # Based on logging.StreamHandler
-        # pylama:ignore=C901: C901 'MscLogStreamHandler.emit' is too complex (15) [mccabe]
         try:
             msg = self.format(record)
-            log_level_name = logging.getLevelName(record.levelno)
-            LOG_CALL_COUNT[log_level_name] += 1
-            if record.levelno == logging.OUT:
-                pass
-            else:
-                msg = "%s: %s" % (log_level_name, msg)
-            stream = sys.stdout
-            color = None
-            is_fd3_warning = False
-            if record.levelno == logging.ERROR:
+            target, color, label, log_level_name = self.routes.get(record.levelno) or self._add_route(record.levelno)
+            if "suppressed_count" not in record.__dict__:
+                # Summaries of LogSuppressionFilter: the suppressed records were already counted
+                LOG_CALL_COUNT.increment(record.name, log_level_name)
+            if label:
+                msg = label + msg
+            if target == "stderr":
                 stream = sys.stderr
-                color = COLOR.ERROR
-            elif record.levelno == logging.WARNING:
-                color = COLOR.WARNING
-                if self.use_fd3_as_warning_stream:
-                    is_fd3_warning = True
-                else:
-                    stream = sys.stderr
-            elif record.levelno == logging.DEBUG:
-                color = COLOR.DEBUG
-            elif record.levelno == logging.INFO:
-                color = COLOR.INFO
-            elif record.levelno == logging.NOTICE:
-                color = COLOR.NOTICE
-            if color is not None and (stream.isatty() or FORCE_COLORS):
+            else:
+                # fd3 warnings are colorized when stdout is a terminal
+                stream = sys.stdout
+            if color is not None and (FORCE_COLORS or self._isatty(target, stream)):
                 msg = colorize(color, msg)
             if sys.flush_stdout_required:
                 sys.flush_stdout_required = False
                 sys.stdout.flush()
-            if is_fd3_warning:
-                try:
-                    os.write(3, str.encode(msg))
-                    os.write(3, str.encode("\n"))
-                    stream = None
-                except OSError:
-                    stream = sys.stderr
-            if stream is not None:
-                self.stream = stream
-                stream.write(msg)
-                stream.write("\n")
-                self.flush()
+            self._write(None if target == "fd3" else stream, msg)
         except Exception:  # pragma: no cover
             self.handleError(record)
 
+    def _write(self, stream, msg):
+        """
+        Write msg to stream, to the fd3 channel when stream is None.
+        """
+        if self.writer is not None:
+            self.writer.put(stream, msg)
+        elif stream is None:
+            self.fd3_channel.write(msg + "\n")
+        else:
+            self.stream = stream
+            stream.write(msg + "\n")
+
+class LogSuppressionFilter(logging.Filter):
+    """
+    Suppress repeated log records of a logger, for records with level >= min_level:
+    * Identical messages within window seconds after the first one are suppressed,
+      afterwards a summary 'msg (repeated N times)' is logged.
+    * rate_limits: {level_name: (records_per_second, burst)} token bucket rate limits,
+      the number of suppressed records is logged with the next record that passes.
+    The suppressed records are counted in LOG_CALL_COUNT.
+    """
+    RATE_LIMIT_SUMMARY = "%d %s messages were suppressed (rate limit)"
+
+    def __init__(self, logger, window=10.0, rate_limits=None, min_level=logging.WARNING):
+        logging.Filter.__init__(self)
+        self.logger = logger
+        self.window = window
+        self.rate_limits = rate_limits or {}
+        self.min_level = min_level
+        ## {key: [start_time, suppressed_count, record]} in the order of start_time
+        self.repeated = OrderedDict()
+        ## {level_name: [tokens, last_time, suppressed_count]}
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.min_level or "suppressed_count" in record.__dict__:
+            return True
+        summaries = []
+        now = time.monotonic()
+        with self.lock:
+            self._collect_expired(now, summaries)
+            passed = self._check_repeated(record, now) and self._check_rate_limit(record, now, summaries)
+        if not passed:
+            LOG_CALL_COUNT.increment(record.name, record.levelname)
+        for summary in summaries:
+            self.logger.handle(summary)
+        return passed
+
+    def _check_repeated(self, record, now):
+        if not self.window:
+            return True
+        try:
+            key = (record.levelno, record.msg, record.args)
+            entry = self.repeated.get(key)
+        except TypeError:
+            key = (record.levelno, record.getMessage())
+            entry = self.repeated.get(key)
+        if entry is None:
+            self.repeated[key] = [now, 0, record]
+            return True
+        entry[1] += 1
+        return False
+
+    def _check_rate_limit(self, record, now, summaries):
+        rate_limit = self.rate_limits.get(record.levelname)
+        if rate_limit is None:
+            return True
+        rate, burst = rate_limit
+        bucket = self.buckets.get(record.levelname)
+        if bucket is None:
+            bucket = self.buckets[record.levelname] = [burst, now, 0]
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            summaries.append(self._make_summary(record.levelno, self.RATE_LIMIT_SUMMARY, (bucket[2], record.levelname), bucket[2]))
+            bucket[2] = 0
+        return True
+
+    def _collect_expired(self, now, summaries):
+        while self.repeated:
+            key, (start_time, suppressed_count, record) = next(iter(self.repeated.items()))
+            if now - start_time < self.window:
+                break
+            del self.repeated[key]
+            if suppressed_count:
+                summaries.append(self._make_summary(record.levelno, "%s (repeated %d times)", (record.getMessage(), suppressed_count), suppressed_count))
+
+    def _make_summary(self, levelno, msg, args, suppressed_count):
+        return logging.makeLogRecord({"name": self.logger.name, "levelno": levelno, "levelname": logging.getLevelName(levelno),
+                                      "msg": msg, "args": args, "suppressed_count": suppressed_count})
+
+    def flush(self):
+        """
+        Log the summaries of all pending repeated messages and rate limits.
+        """
+        summaries = []
+        with self.lock:
+            self._collect_expired(float("inf"), summaries)
+            for level_name, bucket in self.buckets.items():
+                if bucket[2]:
+                    summaries.append(self._make_summary(logging.getLevelName(level_name), self.RATE_LIMIT_SUMMARY, (bucket[2], level_name), bucket[2]))
+                    bucket[2] = 0
+        for summary in summaries:
+            self.logger.handle(summary)
+
+# Fast JSON string encoding (C implementation when available)
+encode_json_string = getattr(json.encoder, "c_encode_basestring", None) or json.encoder.py_encode_basestring
+
+class JsonLinesHandler(logging.handlers.RotatingFileHandler):
+    """
+    Write the log records as JSON lines:
+    {"time": 1700000000.123456, "level": "WARNING", "logger": "Main", "verbosity": null, "message": "..."}
+    verbosity is the verbosity level of Log().out() records.
+    The message formatted for the console (record.message) is reused.
+    The file is rotated when it reaches max_bytes, backup_count rotated files are kept.
+    """
+    LINE_FORMAT = '{"time": %.6f, "level": %s, "logger": %s, "verbosity": %s, "message": %s}\n'
+
+    def __init__(self, file_name, max_bytes=0, backup_count=3):
+        logging.handlers.RotatingFileHandler.__init__(self, file_name, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.encoded_names = {}
+
+    def _encode_name(self, name):
+        encoded_name = self.encoded_names.get(name)
+        if encoded_name is None:
+            encoded_name = self.encoded_names[name] = encode_json_string(name)
+        return encoded_name
+
+    def format(self, record):
+        message = record.__dict__.get("message")
+        if message is None:
+            message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            message = "%s\n%s" % (message, record.exc_text)
+        verbosity = record.__dict__.get("verbosity")
+        return self.LINE_FORMAT % (record.created, self._encode_name(record.levelname), self._encode_name(record.name),
+                                   "null" if verbosity is None else verbosity, encode_json_string(message))
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+            if self.stream is None:
+                self.stream = self._open()
+            # The size is in bytes: non-ASCII characters take several bytes in UTF-8
+            if self.maxBytes and self.stream.tell() + len(line.encode("utf-8")) > self.maxBytes:
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(line)
+        except Exception:  # pragma: no cover
+            self.handleError(record)
+
+class LogRingBuffer(object):
+    """
+    Fixed size buffer of the recent log messages, including the suppressed Log().out() messages.
+    The suppressed Log().out() messages are only formatted by get_lines().
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # deque.append is atomic, the oldest entries are dropped
+        self.entries = deque(maxlen=capacity)
+        ## append((created, logger_name, level_name, verbosity, suppressed, msg, args))
+        self.append = self.entries.append
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_lines(self):
+        """
+        Return the buffered messages, the oldest first.
+        """
+        lines = []
+        for (created, logger_name, level_name, verbosity, suppressed, msg, args) in list(self.entries):
+            try:
+                if callable(msg):
+                    msg = msg(*args)
+                elif args:
+                    msg = msg % args
+            except Exception as e:
+                msg = "%r %% %r (%s)" % (msg, args, e)
+            if verbosity is not None:
+                level_name = "%s(%d%s)" % (level_name, verbosity, ", suppressed" if suppressed else "")
+            timestamp = datetime.datetime.fromtimestamp(created).strftime("%Y-%m-%d, %H:%M:%S.%f")[:-3]
+            lines.append("%s %s %s: %s" % (timestamp, logger_name, level_name, msg))
+        return lines
+
+class LogRingBufferHandler(logging.Handler):
+    """
+    Add the log records to a LogRingBuffer.
+    """
+    def __init__(self, ring_buffer):
+        logging.Handler.__init__(self)
+        self.ring_buffer = ring_buffer
+
+    def handle(self, record):
+        # The message is stored formatted: the arguments may be changed after logging.
+        # It was usually formatted by the MscLogStreamHandler already.
+        message = record.__dict__.get("message")
+        if message is None:
+            message = record.getMessage()
+        # No locking required: LogRingBuffer.append is thread safe
+        self.ring_buffer.append((record.created, record.name, record.levelname, record.__dict__.get("verbosity"), False, message, ()))
+        return True
+
+    def emit(self, record):
+        self.handle(record)
+
+LOG_RING_BUFFER = None
+## {absolute file name: JsonLinesHandler}, one handler per file is shared by all loggers
+JSON_LINES_HANDLERS = {}
+
+def _disabled_out(msg, *args, **kwargs):
+    pass
+
 class MscLogger(logging.Logger):
     def __init__(self, name, level=logging.NOTSET):
         super().__init__(name, level)
         self.out_level = 0
+        # Cached functions for get_out()
+        self.out_functions = {}
+        ## LogRingBuffer for the suppressed out() messages, see Log()
+        self.ring_buffer = None
+        ## Suppressed out() messages up to this verbosity level are added to the ring buffer, -1: none
+        self.ring_buffer_verbosity = -1
         sys.flush_stdout_required = False
 
     def __repr__(self):
@@ -127,8 +663,77 @@ class MscLogger(logging.Logger):
         self.out_level = level
 
     def out(self, verbosity_level, msg, *args, **kwargs):
+        """
+        Log 'msg % args' when verbosity_level is enabled.
+        Pass the arguments in args instead of formatting msg: then no formatting is done for suppressed levels.
+        """
+        if verbosity_level <= self.out_level:
+            self._out(verbosity_level, msg, args, **kwargs)
+        elif verbosity_level <= self.ring_buffer_verbosity:
+            self.ring_buffer.append((time.time(), self.name, "OUT", verbosity_level, True, msg, args))
+
+    def out_lazy(self, verbosity_level, func, *args):
+        """
+        Log the message returned by func(*args) - func is only called when verbosity_level is enabled
+        or the message is kept in the ring buffer, e.g.
+        Log().out_lazy(1, traceback.format_exc)
+        """
         if verbosity_level <= self.out_level:
-            self._log(logging.OUT, msg, args, **kwargs)
+            self._out(verbosity_level, func(*args), ())
+        elif verbosity_level <= self.ring_buffer_verbosity:
+            # Called now: func may depend on the current state, e.g. the exception that is handled
+            self.ring_buffer.append((time.time(), self.name, "OUT", verbosity_level, True, func(*args), ()))
+
+    def _out(self, verbosity_level, msg, args, **kwargs):
+        # The verbosity level is available as record.verbosity, e.g. for the JSON lines log
+        kwargs["extra"] = dict(kwargs.get("extra") or (), verbosity=verbosity_level)
+        self._log(logging.OUT, msg, args, **kwargs)
+
+    def _get_ring_buffer_out(self, verbosity_level):
+        """
+        Return a function f(msg, *args) that only adds the message to the ring buffer.
+        """
+        append = self.ring_buffer.append
+        name = self.name
+        now = time.time
+        def ring_buffer_out(msg, *args, **kwargs):
+            append((now(), name, "OUT", verbosity_level, True, msg, args))
+        return ring_buffer_out
+
+    def get_out(self, verbosity_level):
+        """
+        Return a function f(msg, *args) that logs like out(verbosity_level, msg, *args).
+        The verbosity is checked once: for suppressed levels a function that only adds the message to the
+        ring buffer (or a no-op function) is returned.
+        Use it for hot loops, but call it again after the verbosity was changed:
+        out = Log().get_out(2)
+        for item in items:
+            out("Processing %s", item)
+        """
+        if verbosity_level <= self.out_level:
+            key = verbosity_level
+        elif verbosity_level <= self.ring_buffer_verbosity:
+            key = (verbosity_level, "suppressed")
+        else:
+            return _disabled_out
+        out_function = self.out_functions.get(key)
+        if out_function is None:
+            if verbosity_level <= self.out_level:
+                out_function = functools.partial(self.out, verbosity_level)
+            else:
+                out_function = self._get_ring_buffer_out(verbosity_level)
+            self.out_functions[key] = out_function
+        return out_function
+
+    def enable_suppression(self, window=10.0, rate_limits=None, min_level=logging.WARNING):
+        """
+        Suppress repeated messages and apply rate limits, see LogSuppressionFilter.
+        The pending summaries are logged at exit.
+        """
+        suppression_filter = LogSuppressionFilter(self, window, rate_limits, min_level)
+        self.addFilter(suppression_filter)
+        atexit.register(suppression_filter.flush)
+        return suppression_filter
 
     def notice(self, msg, *args, **kwargs):
         """
@@ -142,24 +747,141 @@ class MscLogger(logging.Logger):
         if self.isEnabledFor(logging.NOTICE):
             self._log(logging.NOTICE, msg, args, **kwargs)
 
+    def create_progress(self, label, total=None):
+        """
+        Return a Progress with throttled output, rate and ETA - to be used instead of progress() in loops with many items.
+        """
+        return PROGRESS_RENDERER.add(label, total)
+
     def progress(self, msg):
         """
         Show a progress message that will be overwritten with the next progress step.
         This is handled by moving the terminal cursor up after writing the message.
+        Each call writes to the terminal, use create_progress() for frequent (e.g. per item) updates.
         """
+        for handler in self.handlers:
+            handler.flush() # Write the queued messages of an asynchronous handler first
         print(msg, flush=True)
         print(CURSOR_UP, end="") # Don't call flush here - otherwise the msg above would be erased immediately
         # Remember that a flush on stdout is required before writing data to e.g. stderr
         sys.flush_stdout_required = True
 
+def format_duration(seconds):
+    """
+    Return seconds as H:MM:SS.
+    """
+    seconds = int(seconds + 0.5)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+class Progress(object):
+    """
+    A progress line of a ProgressRenderer, e.g.
+    with Log().create_progress("Converting", total=len(file_names)) as progress:
+        for file_name in file_names:
+            convert(file_name)
+            progress.update()
+    """
+    def __init__(self, renderer, label, total=None):
+        self.renderer = renderer
+        self.label = label
+        self.total = total
+        self.current = 0
+        self.start_time = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish()
+
+    def update(self, count=1):
+        """
+        Add count processed items. The output is only refreshed when the refresh interval of the renderer is over.
+        """
+        self.current += count
+        if time.monotonic() >= self.renderer.next_render_time:
+            self.renderer.render()
+
+    def finish(self):
+        self.renderer.remove(self)
+
+    def get_text(self, now):
+        elapsed = now - self.start_time
+        rate = self.current / elapsed if elapsed > 0 else 0.0
+        if not self.total:
+            return "%s: %d (%.1f/s)" % (self.label, self.current, rate)
+        eta = format_duration((self.total - self.current) / rate) if rate > 0 else "-:--:--"
+        return "%s: %d/%d (%d%%, %.1f/s, ETA %s)" % (self.label, self.current, self.total, self.current * 100 // self.total, rate, eta)
+
+class ProgressRenderer(object):
+    """
+    Render the lines of several Progress objects (e.g. of parallel workers).
+    On a terminal the lines are refreshed in place at most every refresh_interval seconds,
+    the next output overwrites them (like MscLogger.progress()).
+    Otherwise plain lines are written every plain_interval seconds.
+    """
+    def __init__(self, refresh_interval=0.1, plain_interval=10.0, stream=None, is_tty=None):
+        self.refresh_interval = refresh_interval
+        self.plain_interval = plain_interval
+        ## The output stream, sys.stdout when None
+        self.stream = stream
+        self.is_tty = is_tty
+        self.progresses = []
+        self.next_render_time = 0
+        self.lock = threading.Lock()
+
+    def add(self, label, total=None):
+        progress = Progress(self, label, total)
+        with self.lock:
+            self.progresses.append(progress)
+        return progress
+
+    def remove(self, progress):
+        """
+        Remove a finished progress. Its final state is written as plain line.
+        """
+        self.render(progresses=[progress], final=True)
+        with self.lock:
+            if progress in self.progresses:
+                self.progresses.remove(progress)
+
+    def render(self, progresses=None, final=False):
+        with self.lock:
+            now = time.monotonic()
+            stream = self.stream or sys.stdout
+            is_tty = stream.isatty() if self.is_tty is None else self.is_tty
+            lines = [progress.get_text(now) for progress in (progresses or self.progresses)]
+            if not lines:
+                return
+            for handler in Log().handlers:
+                handler.flush() # Write the queued messages of an asynchronous handler first
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+            if final:
+                pass
+            elif is_tty:
+                self.next_render_time = now + self.refresh_interval
+                # Don't flush here - otherwise the lines above would be erased immediately
+                stream.write(CURSOR_UP * len(lines))
+                # Remember that a flush on stdout is required before writing data to e.g. stderr
+                if stream is sys.stdout:
+                    sys.flush_stdout_required = True
+            else:
+                self.next_render_time = now + self.plain_interval
+
+PROGRESS_RENDERER = ProgressRenderer()
+
 LOGGERS = {}
 def Log(name=None):
     """
     Setup and get a logger.
     """
+    global LOG_RING_BUFFER
+    try:
+        return LOGGERS[name or "Main"]
+    except KeyError:
+        pass
     name = name or "Main"
-    if name in LOGGERS:
-        return LOGGERS[name]
     logging.NOTICE = 25
     logging.addLevelName(logging.NOTICE, "NOTICE")
     logging.OUT = 22
@@ -169,11 +891,49 @@ def Log(name=None):
     logger.setLevel(logging.DEBUG)
     msc_log_handler = MscLogStreamHandler()
     logger.addHandler(msc_log_handler)
+    suppression_window = MSC_LOG_SUPPRESS_REPEATED.get_value()
+    if suppression_window:
+        logger.enable_suppression(float(suppression_window))
+    json_file_name = MSC_LOG_JSON_FILE.get_value()
+    if json_file_name:
+        json_file_name = os.path.abspath(json_file_name)
+        json_handler = JSON_LINES_HANDLERS.get(json_file_name)
+        if json_handler is None:
+            max_bytes = ConvertStorageSize().convert(MSC_LOG_JSON_FILE_MAX_SIZE.get_value())
+            json_handler = JSON_LINES_HANDLERS[json_file_name] = JsonLinesHandler(json_file_name, max_bytes=max_bytes)
+        logger.addHandler(json_handler)
+    ring_buffer_size = int(MSC_LOG_RING_BUFFER_SIZE.get_value() or 0)
+    if ring_buffer_size > 0:
+        if LOG_RING_BUFFER is None:
+            LOG_RING_BUFFER = LogRingBuffer(ring_buffer_size)
+        logger.ring_buffer = LOG_RING_BUFFER
+        logger.ring_buffer_verbosity = int(MSC_LOG_RING_BUFFER_VERBOSITY.get_value())
+        logger.addHandler(LogRingBufferHandler(LOG_RING_BUFFER))
     LOGGERS[name] = logger
     return logger
 
-def get_log_call_count(level_name):
+def get_log_call_count(level_name, logger_name=None):
     """
     Return how many logging calls using level_name were done up to now.
+    When logger_name is given only the calls of that logger are counted.
+    """
+    return LOG_CALL_COUNT.get(level_name, logger_name)
+
+def call_with_log_call_counts(func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs) and return (result, log_call_counts) with the logging calls done by func.
+    Use it to run functions in worker processes and add the counts in the parent process, e.g.
+    with multiprocessing.Pool() as pool:
+        for result, counts in pool.starmap(call_with_log_call_counts, [(convert, file_name) for file_name in file_names]):
+            merge_log_call_counts(counts)
+    """
+    before = LOG_CALL_COUNT.snapshot()
+    result = func(*args, **kwargs)
+    counts = dict((key, count - before.get(key, 0)) for (key, count) in LOG_CALL_COUNT.snapshot().items() if count != before.get(key, 0))
+    return result, counts
+
+def merge_log_call_counts(counts):
+    """
+    Add the log call counts returned by call_with_log_call_counts() in a worker process.
     """
-    return LOG_CALL_COUNT[level_name]
+    LOG_CALL_COUNT.merge(counts)
@@ -0,0 +1,69 @@
+#! /usr/bin/python3
+# ----------------------------------------------------------------------------------
+#  Title      : Application benchmarks
+#  Project    : libMscBoostPython
+# ----------------------------------------------------------------------------------
+#  File       : bench_Application.py
+#  Author     : Stefan Reichoer
+#  Company    : MSC Technologies
+#  Created    : 2026-10-17
+# ----------------------------------------------------------------------------------
+#  Description: Application log file benchmarks
+# ----------------------------------------------------------------------------------
+#  Copyright (c) 2026 -- MSC Technologies
+# ----------------------------------------------------------------------------------
+
+# Usage: bench_Application.py [benchmark_name ...]
+# The log files are created below the current working directory.
+
+import os
+import shutil
+import sys
+import time
+
+# Use MscBoost from this libMscBoostPython checkout
+sys.path.insert(0, "{0}/../".format(os.path.dirname(os.path.abspath(__file__))))
+from MscBoost.Application import AppLogFile
+from MscBoost.Util import get_timestamp_string
+
+def timed(func):
+    """
+    Return the duration of func() in seconds.
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def legacy_log_invocation(log_file_name, txt):
+    """
+    The former Application._log_invocation: append with print().
+    """
+    with open(log_file_name, "a") as f:
+        print(txt, file=f)
+
+def bench_log_invocation(nr_of_invocations=20000):
+    path = os.path.abspath("bench_log_invocation")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    txt = "%s [%s]: %s" % (get_timestamp_string(), path, "app --option value")
+    print("log_invocation: %d invocations" % nr_of_invocations)
+    log_file_name = os.path.join(path, "legacy.log")
+    duration = timed(lambda: [legacy_log_invocation(log_file_name, txt) for i in range(nr_of_invocations)])
+    print("  open/print (unbounded)         : %6.1fus per invocation, %8d bytes" % (duration * 1E6 / nr_of_invocations, os.path.getsize(log_file_name)))
+    for name, max_size, compress in (("AppLogFile (no rotation)", 0, False), ("AppLogFile (100kB, rotation)", 100000, False),
+                                     ("AppLogFile (100kB, gzip)", 100000, True)):
+        log_file = AppLogFile(os.path.join(path, "%d_%d.log" % (max_size, compress)), max_size=max_size, max_total_size=500000, compress=compress)
+        duration = timed(lambda: [log_file.append(txt + "\n") for i in range(nr_of_invocations)])
+        print("  %-31s: %6.1fus per invocation, %8d bytes, %d rotated files" %
+              (name, duration * 1E6 / nr_of_invocations, os.path.getsize(log_file.file_name), len(log_file.get_rotated_file_names())))
+    shutil.rmtree(path)
+
+BENCHMARKS = [
+    bench_log_invocation,
+]
+
+if __name__ == "__main__":
+    selection = sys.argv[1:]
+    for benchmark in BENCHMARKS:
+        if not selection or benchmark.__name__[len("bench_"):] in selection:
+            benchmark()
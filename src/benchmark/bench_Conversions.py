@@ -0,0 +1,338 @@
+#! /usr/bin/python3
+# ----------------------------------------------------------------------------------
+#  Title      : Conversion benchmarks
+#  Project    : libMscBoostPython
+# ----------------------------------------------------------------------------------
+#  File       : bench_Conversions.py
+#  Author     : Stefan Reichoer
+#  Company    : MSC Technologies
+#  Created    : 2026-10-17
+# ----------------------------------------------------------------------------------
+#  Description: Benchmarks of the unit conversions
+# ----------------------------------------------------------------------------------
+#  Copyright (c) 2026 -- MSC Technologies
+# ----------------------------------------------------------------------------------
+
+# Usage: bench_Conversions.py [benchmark_name ...]
+
+import os
+import csv
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Use MscBoost from this libMscBoostPython checkout
+sys.path.insert(0, "{0}/../".format(os.path.dirname(os.path.abspath(__file__))))
+import MscBoost.Conversions as Conversions
+
+def timed(func):
+    """
+    Return the duration of func() in seconds.
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def create_storage_sizes(nr_of_values, seed=1):
+    """
+    Mixed storage sizes like in config dumps: byte counts, integers and decimals with all units.
+    """
+    rnd = random.Random(seed)
+    units = ["B", "KB", "KiB", "MB", "MiB", "GB", "GiB", "TB", "TiB"]
+    values = []
+    for i in range(nr_of_values):
+        unit = rnd.choice(units)
+        if rnd.random() < 0.3:
+            values.append("%.1f%s" % (rnd.random() * 1000, unit))
+        elif unit == "B":
+            values.append("%d%s" % (rnd.randrange(1, 10**rnd.randrange(1, 13)), unit))
+        else:
+            values.append("%d%s" % (rnd.randrange(1, 10**rnd.randrange(1, 5)), unit))
+    return values
+
+def create_times(nr_of_values, seed=1):
+    """
+    Mixed durations like in device logs: all units and H:MM:SS values.
+    """
+    rnd = random.Random(seed)
+    units = ["ps", "ns", "us", "ms", "s", "min", "h"]
+    values = []
+    for i in range(nr_of_values):
+        if rnd.random() < 0.1:
+            values.append("%d:%02d:%05.2f" % (rnd.randrange(24), rnd.randrange(60), rnd.random() * 60))
+        else:
+            values.append("%.1f%s" % (rnd.random() * 1000, rnd.choice(units)))
+    return values
+
+def legacy_convert_storage_size(value):
+    """
+    The former ConvertStorageSize.convert: endswith() chain and float parsing.
+    """
+    retval = None
+    if type(value) == str:
+        if value.endswith("TiB"):
+            retval = Conversions.int_val(value, "TiB", 1024**4)
+        elif value.endswith("TB"):
+            retval = Conversions.int_val(value, "TB", 1000**4)
+        elif value.endswith("GiB"):
+            retval = Conversions.int_val(value, "GiB", 1024**3)
+        elif value.endswith("GB"):
+            retval = Conversions.int_val(value, "GB", 1000**3)
+        elif value.endswith("MiB"):
+            retval = Conversions.int_val(value, "MiB", 1024**2)
+        elif value.endswith("MB"):
+            retval = Conversions.int_val(value, "MB", 1000**2)
+        elif value.endswith("KiB"):
+            retval = Conversions.int_val(value, "KiB", 1024)
+        elif value.endswith("KB"):
+            retval = Conversions.int_val(value, "kB", 1000)
+        elif value.endswith("B"):
+            retval = Conversions.int_val(value, "B")
+    else:
+        retval = value
+    return retval
+
+def legacy_convert_time(value):
+    """
+    The former ConvertTime.convert: endswith() chain.
+    """
+    retval = None
+    if type(value) == str:
+        if value.endswith("ps"):
+            retval = Conversions.float_val(value, "ps", 1E-12)
+        elif value.endswith("ns"):
+            retval = Conversions.float_val(value, "ns", 1E-9)
+        elif value.endswith("us"):
+            retval = Conversions.float_val(value, "us", 1E-6)
+        elif value.endswith("ms"):
+            retval = Conversions.float_val(value, "ms", 1E-3)
+        elif value.endswith("s"):
+            retval = Conversions.float_val(value, "s")
+        elif value.endswith("min"):
+            retval = Conversions.float_val(value, "min", 60)
+        elif value.endswith("h"):
+            retval = Conversions.float_val(value, "h", 3600)
+        elif value.count(":") == 2:
+            hr, min, sec = value.split(":")
+            retval = int(hr)*3600 + int(min)*60 + float(sec)
+    else:
+        retval = value
+    return retval
+
+def legacy_time_string_repr(value):
+    """
+    The former ConvertTime.string_repr: H:MM:SS with time.mktime() and time.localtime().
+    """
+    if value < 0:
+        sign_str = "-"
+        value = abs(value)
+    else:
+        sign_str = ""
+    if value < 1.0:
+        for level, unit in [(1E-3, "ms"), (1E-6, "us"), (1E-9, "ns"), (None, "ps")]:
+            if level:
+                if value >= level:
+                    val = value / level
+                    break
+            else:
+                val = value / 1E-12
+    else:
+        int_value = int(value)
+        if int_value % 3600 == 0:
+            val = int_value / 3600
+            unit = "h"
+        elif int_value % 60 == 0:
+            val = int_value / 60
+            unit = "min"
+        else:
+            if int_value < 60:
+                val = value
+                unit = "s"
+            else:
+                midnight = time.mktime((0, 1, 2, 0, 0, 0, 0, 1, 0))
+                msecs = ("%.2f" % (value-int_value))[1:]
+                time_str = "%s%s" % (time.strftime("%H:%M:%S", time.localtime(midnight + int_value)), msecs)
+                time_str = time_str.rstrip("0")
+                time_str = time_str.rstrip(".")
+                if time_str.startswith("0"):
+                    time_str = time_str[1:]
+                return time_str
+    str_val = "%1.2f" % val
+    str_val = str_val.rstrip("0")
+    str_val = str_val.rstrip(".")
+    return "%s%s%s" % (sign_str, str_val, unit)
+
+def with_cache_size(size, func):
+    """
+    Call func() with a conversion cache of size values, return the duration.
+    """
+    Conversions.CONVERSION_CACHE.set_size(size)
+    try:
+        return timed(func)
+    finally:
+        Conversions.CONVERSION_CACHE.set_size(int(Conversions.MSC_CONVERSION_CACHE_SIZE.get_value()))
+
+def bench_string_repr(nr_of_refreshes=100, nr_of_distinct_values=2000):
+    """
+    A status report table that renders the same values every refresh.
+    """
+    rnd = random.Random(1)
+    durations = [rnd.randrange(60, 20 * 3600) + rnd.randrange(100) / 100 for i in range(nr_of_distinct_values)]
+    sizes = [rnd.randrange(1, 10**rnd.randrange(1, 13)) for i in range(nr_of_distinct_values)]
+    nr_of_calls = nr_of_refreshes * nr_of_distinct_values
+    print("string_repr: %d refreshes of %d values" % (nr_of_refreshes, nr_of_distinct_values))
+    legacy_duration = timed(lambda: [[legacy_time_string_repr(value) for value in durations] for i in range(nr_of_refreshes)])
+    print("  %-12s: mktime/localtime %6.0fns per value" % ("time", legacy_duration * 1E9 / nr_of_calls))
+    for interpretation, values in (("time", durations), ("storage-size", sizes)):
+        def render():
+            for i in range(nr_of_refreshes):
+                [Conversions.string_repr(value, interpretation) for value in values]
+        uncached_duration = with_cache_size(0, render)
+        cached_duration = with_cache_size(2 * nr_of_distinct_values, render)
+        print("  %-12s: uncached %6.0fns, cached %6.0fns per value (%.1fx)" %
+              (interpretation, uncached_duration * 1E9 / nr_of_calls, cached_duration * 1E9 / nr_of_calls,
+               uncached_duration / cached_duration))
+
+def bench_convert_cached(nr_of_refreshes=100, nr_of_distinct_values=2000):
+    """
+    Parsing the same values again, e.g. from a periodically read status file.
+    """
+    nr_of_calls = nr_of_refreshes * nr_of_distinct_values
+    print("convert_value: %d refreshes of %d values" % (nr_of_refreshes, nr_of_distinct_values))
+    for interpretation, values in (("storage-size", create_storage_sizes(nr_of_distinct_values)),
+                                   ("time", create_times(nr_of_distinct_values))):
+        def parse():
+            for i in range(nr_of_refreshes):
+                [Conversions.convert_value(value, interpretation) for value in values]
+        uncached_duration = with_cache_size(0, parse)
+        cached_duration = with_cache_size(2 * nr_of_distinct_values, parse)
+        print("  %-12s: uncached %6.0fns, cached %6.0fns per value (%.1fx)" %
+              (interpretation, uncached_duration * 1E9 / nr_of_calls, cached_duration * 1E9 / nr_of_calls,
+               uncached_duration / cached_duration))
+
+def bench_convert(nr_of_values=500000):
+    print("convert: %d mixed values" % nr_of_values)
+    for name, values, legacy_convert, converter in (
+            ("storage-size", create_storage_sizes(nr_of_values), legacy_convert_storage_size, Conversions.ConvertStorageSize()),
+            ("time", create_times(nr_of_values), legacy_convert_time, Conversions.ConvertTime())):
+        legacy_duration = timed(lambda: [legacy_convert(value) for value in values])
+        duration = timed(lambda: [converter.convert(value) for value in values])
+        print("  %-12s: endswith chain %6.0fns, suffix table %6.0fns per value (%.1fx)" %
+              (name, legacy_duration * 1E9 / nr_of_values, duration * 1E9 / nr_of_values, legacy_duration / duration))
+
+def bench_convert_values(nr_of_values=500000):
+    print("convert_values: %d mixed values (numpy %s)" % (nr_of_values, "available" if Conversions._get_numpy() else "not available"))
+    for interpretation, values in (("storage-size", create_storage_sizes(nr_of_values)), ("time", create_times(nr_of_values))):
+        scalar_duration = timed(lambda: [Conversions.convert_value(value, interpretation) for value in values])
+        python_duration = timed(lambda: Conversions.convert_values(values, interpretation, use_numpy=False))
+        print("  %-12s: convert_value loop %6.0fns, convert_values %6.0fns per value (%.1fx)" %
+              (interpretation, scalar_duration * 1E9 / nr_of_values, python_duration * 1E9 / nr_of_values,
+               scalar_duration / python_duration))
+        if Conversions._get_numpy():
+            numpy_duration = timed(lambda: Conversions.convert_values(values, interpretation))
+            print("  %-12s: convert_values with numpy %6.0fns per value (%.1fx)" %
+                  ("", numpy_duration * 1E9 / nr_of_values, scalar_duration / numpy_duration))
+
+def legacy_convert_csv_file(input_file_name, output_file_name, columns):
+    """
+    The former way: read all rows into a list and convert the fields with convert_value().
+    """
+    with open(input_file_name, newline="") as f:
+        rows = list(csv.reader(f))
+    header = rows[0]
+    indices = [(header.index(name), interpretation) for name, interpretation in columns.items()]
+    for row in rows[1:]:
+        for index, interpretation in indices:
+            row[index] = Conversions.convert_value(row[index], interpretation, raise_error=True)
+    with open(output_file_name, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+def peak_memory(func):
+    """
+    Return the peak memory allocated by func() in bytes.
+    """
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def bench_convert_csv(nr_of_rows=200000):
+    columns = {"size": "storage-size", "duration": "time"}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_file_name = os.path.join(tmp_dir, "input.csv")
+        output_file_name = os.path.join(tmp_dir, "output.csv")
+        with open(input_file_name, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "size", "duration", "comment"])
+            for i, size, duration in zip(range(nr_of_rows), create_storage_sizes(nr_of_rows), create_times(nr_of_rows)):
+                writer.writerow(["device%d" % i, size, duration, "measured"])
+        print("convert_csv: %d rows, %.1fMB" % (nr_of_rows, os.path.getsize(input_file_name) / 1E6))
+        runs = [("read all + convert_value", lambda: legacy_convert_csv_file(input_file_name, output_file_name, columns)),
+                ("convert_csv_file", lambda: Conversions.convert_csv_file(input_file_name, output_file_name, columns))]
+        if os.cpu_count() > 1:
+            runs.append(("convert_csv_file processes=%d" % os.cpu_count(),
+                         lambda: Conversions.convert_csv_file(input_file_name, output_file_name, columns,
+                                                              processes=os.cpu_count())))
+        for name, func in runs:
+            duration = timed(func)
+            print("  %-32s: %6.2fs, peak memory %6.1fMB" % (name, duration, peak_memory(func) / 1E6))
+
+class LegacyValueWithUnit(object):
+    """
+    The former ValueWithUnit with __dict__ (arithmetic reduced to + and *).
+    """
+    def __init__(self, value, converter):
+        self.value = value
+        self.converter = converter
+    def _build_retval(self, value):
+        return self.__class__(value, self.converter)
+    def __add__(self, other):
+        if isinstance(other, LegacyValueWithUnit):
+            return self._build_retval(self.value + other.value)
+        else:
+            return self._build_retval(self.value + other)
+    def __radd__(self, other):
+        return self._build_retval(other + self.value)
+    def __mul__(self, other):
+        if isinstance(other, LegacyValueWithUnit):
+            return self._build_retval(self.value * other.value)
+        else:
+            return self._build_retval(self.value * other)
+
+def bench_value_with_unit(nr_of_values=1000000):
+    print("ValueWithUnit: %d measured durations" % nr_of_values)
+    converter = Conversions.CONVERSION_MAPPING["time"]
+    rnd = random.Random(1)
+    durations = [rnd.random() for i in range(nr_of_values)]
+    for name, create in (("__dict__ (legacy)", lambda: [LegacyValueWithUnit(value, converter) for value in durations]),
+                         ("__slots__", lambda: [Conversions.ValueWithUnit(value, converter) for value in durations]),
+                         ("ValueWithUnitArray", lambda: Conversions.ValueWithUnitArray(durations, "time"))):
+        # The floats are shared, count the containers only
+        print("  %-20s: %5.1f bytes per value" % (name, peak_memory(create) / nr_of_values))
+    legacy_values = [LegacyValueWithUnit(value, converter) for value in durations]
+    values = [Conversions.ValueWithUnit(value, converter) for value in durations]
+    value_array = Conversions.ValueWithUnitArray(durations, "time")
+    print("  sum(): legacy %.0fms, ValueWithUnit %.0fms, sum_values_with_unit() %.0fms, ValueWithUnitArray.sum() %.1fms" %
+          (timed(lambda: sum(legacy_values[1:], legacy_values[0])) * 1E3, timed(lambda: sum(values[1:], values[0])) * 1E3,
+           timed(lambda: Conversions.sum_values_with_unit(values)) * 1E3, timed(value_array.sum) * 1E3))
+    print("  v * 2 for all values: legacy %.0fms, ValueWithUnit %.0fms, ValueWithUnitArray %.1fms" %
+          (timed(lambda: [value * 2 for value in legacy_values]) * 1E3, timed(lambda: [value * 2 for value in values]) * 1E3,
+           timed(lambda: value_array * 2) * 1E3))
+
+BENCHMARKS = [
+    bench_convert,
+    bench_convert_values,
+    bench_convert_csv,
+    bench_string_repr,
+    bench_convert_cached,
+    bench_value_with_unit,
+]
+
+if __name__ == "__main__":
+    selection = sys.argv[1:]
+    for benchmark in BENCHMARKS:
+        if not selection or benchmark.__name__[len("bench_"):] in selection:
+            benchmark()
@@ -0,0 +1,234 @@
+#! /usr/bin/python3
+# ----------------------------------------------------------------------------------
+#  Title      : git benchmarks
+#  Project    : libMscBoostPython
+# ----------------------------------------------------------------------------------
+#  File       : bench_Git.py
+#  Author     : Stefan Reichoer
+#  Company    : MSC Technologies
+#  Created    : 2026-10-17
+# ----------------------------------------------------------------------------------
+#  Description: Git benchmarks on synthetic repositories
+# ----------------------------------------------------------------------------------
+#  Copyright (c) 2026 -- MSC Technologies
+# ----------------------------------------------------------------------------------
+
+# Usage: bench_Git.py [benchmark_name ...]
+# The synthetic repositories are created below the current working directory.
+
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+# Use MscBoost from this libMscBoostPython checkout
+sys.path.insert(0, "{0}/../".format(os.path.dirname(os.path.abspath(__file__))))
+import MscBoost.Git as Git
+
+def create_synthetic_repo(path, nr_of_commits, branch_names=(), tag_names=(), file_size=0, nr_of_dirs=10):
+    """
+    Create a repository with a linear history of nr_of_commits commits using git fast-import.
+    When file_size is 0 the commits are empty, otherwise every commit changes one file of file_size bytes (hex digits)
+    in one of nr_of_dirs directories.
+    The branches and tags are spread equally over the history.
+    """
+    subprocess.check_call(["rm", "-rf", path])
+    subprocess.check_call(["git", "init", "-q", path])
+    lines = []
+    for i in range(1, nr_of_commits + 1):
+        msg = "commit %d\n" % i
+        lines.append("commit refs/heads/master\nmark :%d\ncommitter Bench <bench@msc> %d +0000\ndata %d\n%s" % (i, 1500000000 + i, len(msg), msg))
+        if i > 1:
+            lines.append("from :%d\n" % (i - 1))
+        if file_size:
+            digest = hashlib.sha256(str(i).encode()).hexdigest()
+            content = (digest * (file_size // len(digest) + 1))[:file_size]
+            lines.append("M 644 inline dir_%d/file_%d.txt\ndata %d\n%s\n" % (i % nr_of_dirs, i % 100, len(content), content))
+        lines.append("\n")
+    for ref_prefix, names in (("refs/heads/", branch_names), ("refs/tags/", tag_names)):
+        for idx, name in enumerate(names):
+            mark = 1 + (idx * nr_of_commits) // max(len(names), 1)
+            lines.append("reset %s%s\nfrom :%d\n\n" % (ref_prefix, name, mark))
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=path, input="".join(lines).encode(), check=True)
+    subprocess.check_call(["git", "checkout", "-q", "master"], cwd=path)
+
+def timed(func, *args, repeat=1):
+    """
+    Return the result of the last call and the average duration of func(*args) in seconds.
+    """
+    start = time.perf_counter()
+    for i in range(repeat):
+        result = func(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+def legacy_find_branch_containing(repo, sha1):
+    """
+    The former detached HEAD implementation: one 'git log' per branch.
+    """
+    branch_names = sorted(repo.get_branch_names(), key=Git.branch_name_sort_key)
+    for b_name in branch_names:
+        if sha1 in repo.git.log("--pretty=format:%H", b_name):
+            return b_name
+    return None
+
+def bench_detached_head_branch(nr_of_commits=20000, nr_of_branches=300):
+    path = os.path.abspath("bench_detached_head")
+    branch_names = ["branch_%04d" % i for i in range(nr_of_branches)]
+    create_synthetic_repo(path, nr_of_commits, branch_names)
+    repo = Git.GitRepository(path)
+    # The commit in the middle of the history is contained in about half of the branches.
+    # master is moved to the root commit, so the search has to check the other branches.
+    sha1 = repo.git.rev_parse("master~%d" % (nr_of_commits // 2))
+    repo.git.checkout("-q", sha1)
+    repo.git.update_ref("refs/heads/master", "master~%d" % (nr_of_commits - 1))
+    legacy_branch, legacy_duration = timed(legacy_find_branch_containing, repo, sha1)
+    branch_name, duration = timed(repo.get_active_branch_name, repeat=5)
+    assert branch_name == legacy_branch
+    print("detached_head_branch: %d commits, %d branches" % (nr_of_commits, nr_of_branches))
+    print("  git log per branch     : %8.3fs" % legacy_duration)
+    print("  for-each-ref --contains: %8.3fs" % duration)
+
+def bench_ref_snapshot(nr_of_commits=2000, nr_of_branches=200, nr_of_tags=2000, repeat=200):
+    path = os.path.abspath("bench_ref_snapshot")
+    create_synthetic_repo(path, nr_of_commits, ["branch_%04d" % i for i in range(nr_of_branches)], ["v%d" % i for i in range(nr_of_tags)])
+    # Ref modification times that are too recent are not trusted by the snapshot
+    time.sleep(Git.RACY_REF_STAMP_NS / 1E9)
+    repo = Git.GitRepository(path)
+    print("ref_snapshot: %d branches, %d tags, %d calls" % (nr_of_branches, nr_of_tags, repeat))
+    legacy_duration = timed(lambda: [b.name for b in repo.branches], repeat=repeat)[1]
+    duration = timed(repo.get_branch_names, repeat=repeat)[1]
+    print("  get_branch_names         : %8.3fms (GitPython refs: %8.3fms)" % (duration * 1E3, legacy_duration * 1E3))
+    legacy_duration = timed(lambda: [t.name for t in repo.tags], repeat=repeat // 10)[1]
+    duration = timed(repo.get_tag_names, repeat=repeat)[1]
+    print("  get_tag_names            : %8.3fms (GitPython refs: %8.3fms)" % (duration * 1E3, legacy_duration * 1E3))
+    duration = timed(repo.is_in_detached_head_state, repeat=repeat)[1]
+    print("  is_in_detached_head_state: %8.3fms" % (duration * 1E3))
+    duration = timed(repo.get_checkout_info_string, repeat=repeat // 10)[1]
+    print("  get_checkout_info_string : %8.3fms" % (duration * 1E3))
+
+def bench_tag_index(nr_of_commits=5000, nr_of_tags=20000, repeat=50):
+    path = os.path.abspath("bench_tag_index")
+    create_synthetic_repo(path, nr_of_commits, tag_names=["v%d" % i for i in range(nr_of_tags)])
+    time.sleep(Git.RACY_REF_STAMP_NS / 1E9)
+    repo = Git.GitRepository(path)
+    sha1 = repo.git.rev_parse("master~%d" % (nr_of_commits // 2))
+    legacy_tag_names, legacy_duration = timed(lambda: repo.git.tag("--points-at", sha1).split(), repeat=repeat)
+    tag_names, duration = timed(repo.get_tag_names, sha1, repeat=repeat)
+    assert tag_names == legacy_tag_names
+    print("tag_index: %d commits, %d tags" % (nr_of_commits, nr_of_tags))
+    print("  git tag --points-at      : %8.3fms" % (legacy_duration * 1E3))
+    print("  get_tag_names(commit_id) : %8.3fms" % (duration * 1E3))
+    legacy_duration = timed(lambda: "v1" in [t.name for t in repo.tags], repeat=3)[1]
+    duration = timed(lambda: "v1" in repo.get_ref_snapshot().tags, repeat=repeat)[1]
+    print("  tag membership (GitPython): %8.3fms" % (legacy_duration * 1E3))
+    print("  tag membership (snapshot) : %8.3fms" % (duration * 1E3))
+
+def legacy_push(repo, where_to="origin"):
+    """
+    The former GitRepository.push(with_tags=True, all=True): one connection for the branches, one for the tags.
+    """
+    infos = []
+    infos.extend(repo.remotes[where_to].push("--all"))
+    infos.extend(repo.remotes[where_to].push("--tags"))
+    return infos
+
+def bench_push(nr_of_commits=2000, nr_of_branches=200, nr_of_tags=2000, repeat=10):
+    path = os.path.abspath("bench_push")
+    remote_path = os.path.abspath("bench_push_remote.git")
+    create_synthetic_repo(path, nr_of_commits, ["branch_%04d" % i for i in range(nr_of_branches)], ["v%d" % i for i in range(nr_of_tags)])
+    subprocess.check_call(["rm", "-rf", remote_path])
+    subprocess.check_call(["git", "clone", "-q", "--mirror", path, remote_path])
+    repo = Git.GitRepository(path)
+    repo.create_remote("origin", remote_path)
+    # All refs are up to date: the ref advertisement of each connection dominates
+    legacy_duration = timed(legacy_push, repo, repeat=repeat)[1]
+    duration = timed(lambda: repo.push(with_tags=True, all=True), repeat=repeat)[1]
+    print("push: %d branches, %d tags to a local bare repository" % (nr_of_branches, nr_of_tags))
+    print("  --all and --tags pushes: %8.3fms" % (legacy_duration * 1E3))
+    print("  single refspec push    : %8.3fms" % (duration * 1E3))
+
+def get_directory_size(path):
+    size = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.lstat(os.path.join(dir_path, file_name)).st_size
+    return size
+
+def bench_clone(nr_of_commits=3000, file_size=20000):
+    path = os.path.abspath("bench_clone")
+    create_synthetic_repo(path, nr_of_commits, ["develop"], ["v1.0"], file_size=file_size)
+    subprocess.check_call(["git", "config", "uploadpack.allowFilter", "true"], cwd=path)
+    cache_path = os.path.abspath("bench_clone_cache.git")
+    subprocess.check_call(["rm", "-rf", cache_path])
+    subprocess.check_call(["git", "clone", "-q", "--mirror", path, cache_path])
+    url = "file://%s/" % path
+    where_to = os.path.abspath("bench_clone_result")
+    print("clone: %d commits, one %d bytes file per commit" % (nr_of_commits, file_size))
+    print("  %-34s %10s %10s %8s" % ("mode", ".git bytes", "worktree", "time"))
+    variants = [
+        ("full", {}),
+        ("depth=1", {"depth": 1}),
+        ("single_branch", {"single_branch": True}),
+        ("filter=blob:none", {"filter": "blob:none"}),
+        ("filter=tree:0", {"filter": "tree:0"}),
+        ("filter=blob:none, sparse_paths", {"filter": "blob:none", "sparse_paths": ["dir_1"]}),
+        ("MSC_GIT_SERVER_CACHE reference", {"_cache": True}),
+    ]
+    for name, options in variants:
+        os.environ["MSC_GIT_SERVER"] = url
+        os.environ.pop("MSC_GIT_SERVER_CACHE", None)
+        if options.pop("_cache", False):
+            os.environ["MSC_GIT_SERVER_CACHE"] = "file://%s/" % cache_path
+        subprocess.check_call(["rm", "-rf", where_to])
+        duration = timed(lambda: Git.clone(url, where_to, **options))[1]
+        git_size = get_directory_size(os.path.join(where_to, ".git"))
+        work_tree_size = get_directory_size(where_to) - git_size
+        print("  %-34s %10d %10d %7.3fs" % (name, git_size, work_tree_size, duration))
+
+def bench_status(nr_of_commits=2000, file_size=200, repeat=20):
+    path = os.path.abspath("bench_status")
+    create_synthetic_repo(path, nr_of_commits, tag_names=["v%d" % i for i in range(100)], file_size=file_size, nr_of_dirs=100)
+    repo = Git.GitRepository(path)
+    def separate_queries():
+        return (repo.get_branch_and_tag_info(), repo.get_head_version(), repo.is_in_detached_head_state(), repo.is_dirty())
+    print("status: %d files" % len(repo.git.ls_files().splitlines()))
+    duration = timed(separate_queries, repeat=repeat)[1]
+    print("  separate queries                 : %8.3fms" % (duration * 1E3))
+    duration = timed(repo.get_status, repeat=repeat)[1]
+    print("  get_status()                     : %8.3fms" % (duration * 1E3))
+    duration = timed(lambda: repo.get_status(untracked_files="no", fast=True), repeat=repeat)[1]
+    print("  get_status(untracked 'no', fast) : %8.3fms" % (duration * 1E3))
+
+def bench_sha1_for_version(nr_of_commits=2000, nr_of_tags=500):
+    path = os.path.abspath("bench_sha1_for_version")
+    tag_names = ["v%d" % i for i in range(nr_of_tags)]
+    create_synthetic_repo(path, nr_of_commits, tag_names=tag_names)
+    repo = Git.GitRepository(path)
+    print("sha1_for_version: %d versions" % nr_of_tags)
+    legacy_sha1s, legacy_duration = timed(lambda: [repo.git.rev_parse(tag_name + "^0") for tag_name in tag_names])
+    print("  git rev-parse per version  : %8.3fms per query" % (legacy_duration * 1E3 / nr_of_tags))
+    repo.get_sha1_for_version("master")  # start the git process
+    sha1s, duration = timed(lambda: [repo.get_sha1_for_version(tag_name) for tag_name in tag_names])
+    assert sha1s == legacy_sha1s
+    print("  get_sha1_for_version       : %8.3fms per query" % (duration * 1E3 / nr_of_tags))
+    sha1s, duration = timed(repo.get_sha1_for_versions, tag_names)
+    assert sha1s == legacy_sha1s
+    print("  get_sha1_for_versions(list): %8.3fms per query" % (duration * 1E3 / nr_of_tags))
+    repo.close()
+
+BENCHMARKS = [
+    bench_detached_head_branch,
+    bench_ref_snapshot,
+    bench_tag_index,
+    bench_push,
+    bench_clone,
+    bench_status,
+    bench_sha1_for_version,
+]
+
+if __name__ == "__main__":
+    selection = sys.argv[1:]
+    for benchmark in BENCHMARKS:
+        if not selection or benchmark.__name__[len("bench_"):] in selection:
+            benchmark()
@@ -0,0 +1,230 @@
+#! /usr/bin/python3
+# ----------------------------------------------------------------------------------
+#  Title      : Logging benchmarks
+#  Project    : libMscBoostPython
+# ----------------------------------------------------------------------------------
+#  File       : bench_Logging.py
+#  Author     : Stefan Reichoer
+#  Company    : MSC Technologies
+#  Created    : 2026-10-17
+# ----------------------------------------------------------------------------------
+#  Description: Logging throughput benchmarks
+# ----------------------------------------------------------------------------------
+#  Copyright (c) 2026 -- MSC Technologies
+# ----------------------------------------------------------------------------------
+
+# Usage: bench_Logging.py [benchmark_name ...]
+
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+# Use MscBoost from this libMscBoostPython checkout
+sys.path.insert(0, "{0}/../".format(os.path.dirname(os.path.abspath(__file__))))
+import MscBoost.Logging as Logging
+
+class SlowStream(io.StringIO):
+    """
+    A stream that simulates a slow terminal or pipe: every write costs write_delay seconds.
+    """
+    def __init__(self, write_delay):
+        super().__init__()
+        self.write_delay = write_delay
+
+    def write(self, txt):
+        time.sleep(self.write_delay)
+        return super().write(txt)
+
+    def isatty(self):
+        return False
+
+def timed(func):
+    """
+    Return the duration of func() in seconds.
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+class LegacyMscLogStreamHandler(Logging.MscLogStreamHandler):
+    """
+    The former emit(): if/elif chain per record, isatty() per record.
+    """
+    def emit(self, record):
+        msg = self.format(record)
+        log_level_name = logging.getLevelName(record.levelno)
+        Logging.LOG_CALL_COUNT.increment(record.name, log_level_name)
+        if record.levelno != logging.OUT:
+            msg = "%s: %s" % (log_level_name, msg)
+        stream = sys.stdout
+        color = None
+        if record.levelno == logging.ERROR:
+            stream = sys.stderr
+            color = Logging.COLOR.ERROR
+        elif record.levelno == logging.WARNING:
+            color = Logging.COLOR.WARNING
+            stream = sys.stderr
+        elif record.levelno == logging.DEBUG:
+            color = Logging.COLOR.DEBUG
+        elif record.levelno == logging.INFO:
+            color = Logging.COLOR.INFO
+        elif record.levelno == logging.NOTICE:
+            color = Logging.COLOR.NOTICE
+        if color is not None and (stream.isatty() or Logging.FORCE_COLORS):
+            msg = Logging.colorize(color, msg)
+        if sys.flush_stdout_required:
+            sys.flush_stdout_required = False
+            sys.stdout.flush()
+        stream.write(msg)
+        stream.write("\n")
+
+class NullStream(io.StringIO):
+    def write(self, txt):
+        return len(txt)
+
+    def isatty(self):
+        return False
+
+def create_logger(name, handler):
+    logger = Logging.Log(name)
+    logger.removeHandler(logger.handlers[0])
+    logger.addHandler(handler)
+    return logger
+
+def log_records(logger, nr_of_records):
+    for i in range(nr_of_records):
+        logger.info("record %d of the benchmark", i)
+
+def bench_async_handler(nr_of_records=50000, write_delay=20E-6):
+    print("async_handler: %d records, %dus per write" % (nr_of_records, write_delay * 1E6))
+    saved_stdout = sys.stdout
+    for name, asynchronous in (("sync", False), ("async", True)):
+        stream = SlowStream(write_delay)
+        handler = Logging.MscLogStreamHandler(asynchronous=asynchronous)
+        logger = create_logger("bench_%s" % name, handler)
+        sys.stdout = stream
+        try:
+            start = time.perf_counter()
+            log_records(logger, nr_of_records)
+            caller_duration = time.perf_counter() - start
+            handler.close()
+            total_duration = time.perf_counter() - start
+        finally:
+            sys.stdout = saved_stdout
+        assert stream.getvalue().count("\n") == nr_of_records
+        print("  %-5s: %10.0f records/s in the logging thread, %10.0f records/s until written" %
+              (name, nr_of_records / caller_duration, nr_of_records / total_duration))
+
+def bench_disabled_out(nr_of_calls=1000000):
+    Logging.Log().set_verbosity(0)
+    source, target = "ssh://msc-git02.msc-ge.com/libmscboost.git", "https://github.com/novaspring/libmscboost.git"
+    def baseline():
+        for i in range(nr_of_calls):
+            pass
+    def eager():
+        for i in range(nr_of_calls):
+            Logging.Log().out(2, "sync_to_public: %s -> %s" % (source, target))
+    def deferred():
+        for i in range(nr_of_calls):
+            Logging.Log().out(2, "sync_to_public: %s -> %s", source, target)
+    def lazy():
+        for i in range(nr_of_calls):
+            Logging.Log().out_lazy(2, lambda: "sync_to_public: %s -> %s" % (source, target))
+    def get_out():
+        out = Logging.Log().get_out(2)
+        for i in range(nr_of_calls):
+            out("sync_to_public: %s -> %s", source, target)
+    print("disabled_out: %d calls" % nr_of_calls)
+    baseline_duration = timed(baseline)
+    for name, func in (("empty loop", baseline), ("out(2, msg % args)", eager), ("out(2, msg, *args)", deferred),
+                       ("out_lazy(2, func)", lazy), ("get_out(2)(msg, *args)", get_out)):
+        duration = timed(func)
+        print("  %-22s: %6.1fns per call (%6.1fns above the empty loop)" %
+              (name, duration * 1E9 / nr_of_calls, (duration - baseline_duration) * 1E9 / nr_of_calls))
+
+def bench_json_lines(nr_of_records=100000):
+    record = logging.LogRecord("Main", logging.WARNING, __file__, 1, "conversion of %s failed", ("file_1.txt",), None)
+    record.message = record.getMessage()
+    handler = Logging.JsonLinesHandler(os.devnull)
+    def json_dumps():
+        for i in range(nr_of_records):
+            json.dumps({"time": record.created, "level": record.levelname, "logger": record.name,
+                        "verbosity": getattr(record, "verbosity", None), "message": record.getMessage()})
+    def json_lines_handler():
+        for i in range(nr_of_records):
+            handler.format(record)
+    print("json_lines: %d records" % nr_of_records)
+    for name, func in (("json.dumps(dict)", json_dumps), ("JsonLinesHandler", json_lines_handler)):
+        duration = timed(func)
+        print("  %-16s: %6.2fus per record" % (name, duration * 1E6 / nr_of_records))
+    handler.close()
+
+def bench_duplicate_warnings(nr_of_records=100000, write_delay=20E-6):
+    print("duplicate_warnings: %d warnings, %dus per write" % (nr_of_records, write_delay * 1E6))
+    saved_stderr = sys.stderr
+    for name, window in (("no suppression", 0), ("suppression", 10.0)):
+        stream = SlowStream(write_delay)
+        logger = create_logger("bench_duplicate_%d" % window, Logging.MscLogStreamHandler(asynchronous=False))
+        suppression_filter = logger.enable_suppression(window) if window else None
+        sys.stderr = stream
+        try:
+            duration = timed(lambda: [logger.warning("conversion of %s failed", "file_%d" % (i % 10)) for i in range(nr_of_records)])
+            if suppression_filter is not None:
+                suppression_filter.flush()
+        finally:
+            sys.stderr = saved_stderr
+        assert Logging.get_log_call_count("WARNING", logger.name) == nr_of_records
+        print("  %-14s: %10.0f warnings/s, %6d lines written" % (name, nr_of_records / duration, stream.getvalue().count("\n")))
+
+def bench_progress(nr_of_items=20000, write_delay=20E-6):
+    print("progress: %d items, %dus per write" % (nr_of_items, write_delay * 1E6))
+    logger = Logging.Log()
+    saved_stdout = sys.stdout
+    def progress_per_item():
+        for i in range(nr_of_items):
+            logger.progress("Item %d/%d" % (i, nr_of_items))
+    def throttled_progress():
+        with Logging.ProgressRenderer(is_tty=True).add("Item", total=nr_of_items) as progress:
+            for i in range(nr_of_items):
+                progress.update()
+    for name, func in (("progress()", progress_per_item), ("Progress.update()", throttled_progress)):
+        sys.stdout = SlowStream(write_delay)
+        try:
+            duration = timed(func)
+        finally:
+            sys.stdout = saved_stdout
+        print("  %-17s: %8.3fs" % (name, duration))
+
+def bench_emit(nr_of_records=200000):
+    print("emit: %d records (INFO, WARNING, OUT)" % nr_of_records)
+    saved_streams = sys.stdout, sys.stderr
+    for name, handler_class in (("before", LegacyMscLogStreamHandler), ("after", Logging.MscLogStreamHandler)):
+        handler = handler_class(asynchronous=False)
+        handler.use_fd3_as_warning_stream = False
+        logger = create_logger("bench_emit_%s" % name, handler)
+        levels = [logging.INFO, logging.WARNING, logging.OUT]
+        records = [logger.makeRecord(logger.name, levels[i % 3], __file__, 1, "record %d", (i,), None) for i in range(nr_of_records)]
+        sys.stdout = sys.stderr = NullStream()
+        try:
+            duration = timed(lambda: [handler.emit(record) for record in records])
+        finally:
+            sys.stdout, sys.stderr = saved_streams
+        print("  %-6s: %10.0f records/s" % (name, nr_of_records / duration))
+
+BENCHMARKS = [
+    bench_async_handler,
+    bench_disabled_out,
+    bench_json_lines,
+    bench_duplicate_warnings,
+    bench_progress,
+    bench_emit,
+]
+
+if __name__ == "__main__":
+    selection = sys.argv[1:]
+    for benchmark in BENCHMARKS:
+        if not selection or benchmark.__name__[len("bench_"):] in selection:
+            benchmark()
@@ -1,4 +1,7 @@
+import datetime
+import gzip
 import io
+import multiprocessing
 import os
 import signal
 import subprocess
@@ -9,10 +12,12 @@ import pytest
 
 from MscBoost.Application import _CompliantArgumentParser
 from MscBoost.Application import Application
+from MscBoost.Application import AppLogFile
 from MscBoost.Application import TerminationHandler
 from MscBoost.EnvironmentVariable import EnvironmentVariable
 from MscBoost.Logging import Log
 from MscBoost.UsageException import UsageException
+from MscBoost.Util import get_timestamp_string
 from MscBoost.MscProject import MscProject
 
 the_main_exception_message = "as requested"
@@ -400,6 +405,96 @@ def test_log_errors(monkeypatch, capsys):
     out, err = capsys.readouterr()
     assert ("--unknown" in err) and ("for error details" not in out)
 
+def test_log_ring_buffer(monkeypatch, capsys):
+    monkeypatch.setenv("MSC_APP_LOGGING", "app-error")
+    x = MyApplication("ring_buffer_app", "Help.", main_will_raise_exception=True)
+    log_file_name = x._get_logfile_name()
+    if os.path.exists(log_file_name):
+        os.unlink(log_file_name)
+    sys.argv = ["test_Application.py"]
+    Log().out(1, "Suppressed context %s", "message")
+    # Above MSC_LOG_RING_BUFFER_VERBOSITY (default: 1) suppressed messages are not kept
+    Log().out(2, "Dropped context message")
+    x.run()
+    out, err = capsys.readouterr()
+    assert "for error details" in out
+    log_file_content = open(log_file_name).read()
+    os.unlink(log_file_name)
+    assert "Recent log messages:" in log_file_content
+    assert "Main OUT(1, suppressed): Suppressed context message\n" in log_file_content
+    assert "Dropped context message" not in log_file_content
+    assert "Main ERROR: *** ERROR: %s\n" % the_main_exception_message in log_file_content
+    # The traceback of Log().out_lazy(1, traceback.format_exc) is kept, not formatted when the buffer is written
+    recent_messages = log_file_content.split("Recent log messages:")[1]
+    assert "Traceback (most recent call last):" in recent_messages
+    assert "Exception: %s\n" % the_main_exception_message in recent_messages
+    assert "NoneType: None" not in recent_messages
+
+def test_app_log_file_rotation(tmpdir):
+    log_file_name = str(tmpdir.join("app.log"))
+    log_file = AppLogFile(log_file_name, max_size=100, max_total_size=250, compress=False)
+    for i in range(4):
+        log_file.append("%s: entry %d %s\n" % (get_timestamp_string(), i, 40 * "x"))
+    assert open(log_file_name).read().count("\n") == 1
+    rotated_file_names = log_file.get_rotated_file_names()
+    assert len(rotated_file_names) == 3
+    assert [open(f).read().count("entry") for f in rotated_file_names] == [1, 1, 1]
+    # Total size cap
+    for i in range(4):
+        log_file.append("%s: entry %d %s\n" % (get_timestamp_string(), i, 40 * "x"))
+    assert sum(os.path.getsize(f) for f in log_file.get_rotated_file_names()) <= 250
+    # Compression
+    log_file = AppLogFile(log_file_name, max_size=100, max_total_size=0, compress=True)
+    log_file.append(60 * "y" + "\n")
+    gz_file_names = [f for f in log_file.get_rotated_file_names() if f.endswith(".gz")]
+    assert len(gz_file_names) == 1
+    assert gzip.open(gz_file_names[0]).read().decode().endswith(40 * "x" + "\n")
+    # Age
+    age_file_name = str(tmpdir.join("age.log"))
+    log_file = AppLogFile(age_file_name, max_size=0, max_age=3600, max_total_size=0, compress=False)
+    old_timestamp = datetime.datetime.now() - datetime.timedelta(hours=2)
+    log_file.append("%s: old entry\n" % get_timestamp_string(old_timestamp))
+    log_file.append("%s: new entry\n" % get_timestamp_string())
+    log_file.append("%s: newer entry\n" % get_timestamp_string())
+    assert open(age_file_name).read().count("entry") == 2
+    assert len(log_file.get_rotated_file_names()) == 1
+
+def append_log_entries(log_file_name, nr):
+    log_file = AppLogFile(log_file_name, max_size=2000, max_total_size=10**6, compress=False)
+    for i in range(200):
+        log_file.append("%s: process %d entry %d\n" % (get_timestamp_string(), nr, i))
+
+def test_app_log_file_concurrent_append(tmpdir):
+    log_file_name = str(tmpdir.join("concurrent.log"))
+    processes = [multiprocessing.Process(target=append_log_entries, args=(log_file_name, nr)) for nr in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    lines = []
+    for file_name in [log_file_name] + AppLogFile(log_file_name).get_rotated_file_names():
+        lines.extend(open(file_name).read().splitlines())
+    assert len(lines) == 800
+    assert all(line.count("entry") == 1 for line in lines)
+
+def append_compressed_log_entries(log_file_name, nr):
+    log_file = AppLogFile(log_file_name, max_size=500, max_total_size=1000, compress=True)
+    for i in range(200):
+        log_file.append("%s: process %d entry %d\n" % (get_timestamp_string(), nr, i))
+
+def test_app_log_file_concurrent_cleanup(tmpdir):
+    log_file_name = str(tmpdir.join("cleanup.log"))
+    # A rotated file that was removed by another process before it was compressed is skipped
+    AppLogFile(log_file_name, max_total_size=1000, compress=True)._cleanup(log_file_name + ".missing")
+    processes = [multiprocessing.Process(target=append_compressed_log_entries, args=(log_file_name, nr)) for nr in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0, 0]
+    # No temporary files are left
+    assert sorted(os.listdir(str(tmpdir))) == [os.path.basename(f) for f in [log_file_name] + AppLogFile(log_file_name).get_rotated_file_names()]
+
 def test_termination_handler(msc_boost_python_dir):
     test_prg = """
 import os
@@ -12,6 +12,9 @@
 #  Copyright (c) 2016 -- MSC Technologies
 # ----------------------------------------------------------------------------------
 
+import subprocess
+import sys
+
 import pytest
 
 import MscBoost.Conversions as Conversions
@@ -102,6 +105,81 @@ def test_value_with_unit():
     assert str(8.6*v) == "8.6KiB"
     assert str(2048/v) == "2B"
     assert str(2048//v2) == "1B"
+    assert v == Conversions.create_value_with_unit("1KiB", "storage-size")
+    assert v != v2
+    assert v == 1024
+    assert v <= v2 and v <= v and v < 2048
+    assert v2 >= v and v2 >= v2 and v2 > 1024
+    assert not v >= v2
+    assert len({v, v2, Conversions.create_value_with_unit("2KiB", "storage-size")}) == 2
+    # Values of different interpretations differ
+    t = Conversions.create_value_with_unit("1s", "time")
+    b = Conversions.create_value_with_unit("1B", "storage-size")
+    assert t == 1 and b == 1
+    assert t != b
+    assert len({t, b}) == 2
+    with pytest.raises(TypeError):
+        assert t <= b
+    with pytest.raises(TypeError):
+        assert t > b
+    # Equal values hash equal: plain numbers find ValueWithUnit keys and vice versa
+    assert hash(v) == hash(1024)
+    assert {1024: "x"}[v] == "x"
+    assert {v: "x"}[1024] == "x"
+    assert len({v, 1024}) == 1
+    assert v != "1KiB"
+    assert v.__eq__(None) is NotImplemented
+    with pytest.raises(AttributeError):
+        v.unit = "KiB" # __slots__
+
+def test_frozen_value_with_unit():
+    converter = Conversions.CONVERSION_MAPPING["time"]
+    v = Conversions.FrozenValueWithUnit(90, converter)
+    assert str(v) == "0:01:30"
+    with pytest.raises(AttributeError):
+        v.value = 60
+    assert type(v + 30) is Conversions.FrozenValueWithUnit
+    assert str(v + 30) == "2min"
+    assert v.value == 90
+    assert {v: "x"}[Conversions.ValueWithUnit(90, converter)] == "x"
+
+def test_sum_mean_values_with_unit():
+    values = [Conversions.create_value_with_unit(size, "storage-size") for size in ("1KiB", "2KiB", "3KiB")]
+    assert str(Conversions.sum_values_with_unit(values)) == "6KiB"
+    assert str(Conversions.sum_values_with_unit(iter(values))) == "6KiB"
+    assert str(Conversions.mean_values_with_unit(values)) == "2KiB"
+    assert Conversions.sum_values_with_unit([]) == 0
+    with pytest.raises(ValueError):
+        Conversions.mean_values_with_unit([])
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_value_with_unit_array(use_numpy):
+    sizes = Conversions.ValueWithUnitArray.from_strings(["1KiB", "2KiB", "3KiB"], "storage-size", use_numpy=use_numpy)
+    assert len(sizes) == 3
+    assert repr(sizes) == "[1KiB, 2KiB, 3KiB]"
+    assert str(sizes[1]) == "2KiB"
+    assert type(sizes[1].value) is int
+    assert repr(sizes[1:]) == "[2KiB, 3KiB]"
+    assert [str(size) for size in sizes] == ["1KiB", "2KiB", "3KiB"]
+    assert str(sizes.sum()) == "6KiB"
+    assert str(sizes.mean()) == "2KiB"
+    assert str(sizes.min()) == "1KiB"
+    assert str(sizes.max()) == "3KiB"
+    assert repr(sizes + 1024) == "[2KiB, 3KiB, 4KiB]"
+    assert repr(1024 + sizes) == "[2KiB, 3KiB, 4KiB]"
+    assert repr(sizes + sizes) == "[2KiB, 4KiB, 6KiB]"
+    assert repr(sizes - sizes[0]) == "[0B, 1KiB, 2KiB]"
+    assert repr(sizes * 2) == "[2KiB, 4KiB, 6KiB]"
+    assert repr(2 * sizes) == "[2KiB, 4KiB, 6KiB]"
+    assert repr(sizes / 2) == "[512B, 1KiB, 1.5KiB]"
+    assert repr(-sizes) == "[-1KiB, -2KiB, -3KiB]"
+    times = Conversions.ValueWithUnitArray([0.5, 1.5], "time", use_numpy=use_numpy)
+    assert repr(times) == "[500ms, 1.5s]"
+    with pytest.raises(ValueError):
+        Conversions.ValueWithUnitArray([], "time", use_numpy=use_numpy).mean()
+    with pytest.raises(Exception) as e:
+        Conversions.ValueWithUnitArray.from_strings(["1KiB", "2k"], "storage-size", use_numpy=use_numpy)
+    assert str(e.value).startswith("Couldn't convert '2k' as storage-size\n")
 
 def test_storage_size():
     assert Conversions.convert_value(1, "storage-size") == 1
@@ -116,6 +194,17 @@ def test_storage_size():
     assert Conversions.convert_value("1GB", "storage-size") == 1000**3
     assert Conversions.convert_value("1TB", "storage-size") == 1000**4
     assert Conversions.convert_value("100byte", "storage-size") is None
+    assert Conversions.convert_value("123456789012345678B", "storage-size") == 123456789012345678
+    assert Conversions.convert_value("123456789012345678KiB", "storage-size") == 123456789012345678*1024
+    assert Conversions.convert_value("123456789012345678 B", "storage-size") == 123456789012345678
+    assert Conversions.convert_value("123456789012345678 KiB", "storage-size") == 123456789012345678*1024
+    assert Conversions.convert_value("-9007199254740993B", "storage-size") == -9007199254740993
+    assert Conversions.convert_value("+9007199254740993 B", "storage-size") == 9007199254740993
+    assert Conversions.convert_value(" 6 KiB ", "storage-size") == 6*1024
+    assert Conversions.convert_value("2kB", "storage-size") == 2000
+    assert Conversions.convert_value("1e3B", "storage-size") == 1000
+    assert Conversions.convert_value("2kib", "storage-size") is None
+    assert Conversions.convert_value("KiB", "storage-size") is None
     assert Conversions.string_repr(1, "storage-size") == "1B"
     assert Conversions.string_repr(1024*56, "storage-size") == "56KiB"
     assert Conversions.string_repr(18*1024**2, "storage-size") == "18MiB"
@@ -134,6 +223,10 @@ def test_time():
     assert Conversions.convert_value("30min", "time") == 30*60
     assert Conversions.convert_value("4h", "time") == 4*3600
     assert Conversions.convert_value("1:02:07.5", "time") == 1*3600+2*60+7.5
+    assert Conversions.convert_value(" 2.5 ms ", "time") == 2.5E-3
+    assert Conversions.convert_value("2mins", "time") is None
+    assert Conversions.convert_value("2S", "time") is None
+    assert Conversions.convert_value("min", "time") is None
     assert Conversions.string_repr(4E-3, "time") == "4ms"
     assert Conversions.string_repr(8E-6, "time") == "8us"
     assert Conversions.string_repr(17E-9, "time") == "17ns"
@@ -147,3 +240,75 @@ def test_time():
     assert Conversions.string_repr(62.8, "time") == "0:01:02.8"
     assert Conversions.string_repr(121.5, "time") == "0:02:01.5"
     assert Conversions.string_repr(14*3600+4.33, "time") == "14:00:04.33"
+    assert Conversions.string_repr(30*3600+70, "time") == "30:01:10"
+
+def test_numpy_is_imported_lazily(msc_boost_python_dir):
+    cmd = "import sys, MscBoost.Application, MscBoost.Conversions; print('numpy' in sys.modules)"
+    output = subprocess.check_output([sys.executable, "-c", cmd], cwd=msc_boost_python_dir)
+    assert output == b"False\n"
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_convert_values(use_numpy):
+    sizes = ["1KiB", " 6 KiB ", "1.5KiB", "123456789012345678B", "99999999999999999999B", "x", "2kB", "12", 7, "-3KB", "nanB", "-9007199254740993B"]
+    values, valid = Conversions.convert_values(sizes, "storage-size", use_numpy=use_numpy)
+    assert list(valid) == [True, True, True, True, False, False, True, False, True, True, False, True]
+    assert list(values) == [1024, 6*1024, 1536, 123456789012345678, 0, 0, 2000, 0, 7, -3000, 0, -9007199254740993]
+    times = ["1ps", "8.5ms", "bad", "30min", "1:02:07.5", 12.5]
+    values, valid = Conversions.convert_values(iter(times), "time", use_numpy=use_numpy)
+    assert list(valid) == [True, True, False, True, True, True]
+    assert list(values) == [Conversions.convert_value(t, "time") or 0 for t in times]
+    values, valid = Conversions.convert_values([], "time", use_numpy=use_numpy)
+    assert len(values) == 0
+    with pytest.raises(Exception) as e:
+        Conversions.convert_values(["1B"], "dummy")
+    assert str(e.value).startswith("Couldn't convert values as dummy\nPossible interpretations: ")
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_convert_csv_rows(processes):
+    lines = ["name,size,duration\n", "a,1KiB,4ms\n", "b,2MB,1:02:07.5\n", "c,12k,30min\n", "d,8B,2x\n", "e,3GiB,8s\n"]
+    errors = []
+    rows = list(Conversions.convert_csv_rows(lines, {"size": "storage-size", "duration": "time"}, chunk_size=2,
+                                             processes=processes, errors=errors))
+    assert rows == [["name", "size", "duration"], ["a", 1024, 0.004], ["b", 2000000, 3727.5], ["c", None, 1800.0],
+                    ["d", 8, None], ["e", 3*1024**3, 8.0]]
+    assert errors == ["Line 4, column 'size': Couldn't convert '12k' as storage-size\nExamples: 2B. Possible units are B,KB,KiB,MB,MiB,GB,GiB,TB,TiB. KB has factor 1000, KiB factor 1024",
+                      "Line 5, column 'duration': Couldn't convert '2x' as time\nExamples: 1ps, 2.3ns, 8us, 8.5ms, 1s, 6min, 2h, 2:15:59.25"]
+    with pytest.raises(Exception) as e:
+        list(Conversions.convert_csv_rows(lines, {"size": "storage-size"}, processes=processes))
+    assert str(e.value).startswith("Line 4, column 'size': Couldn't convert '12k' as storage-size\n")
+    with pytest.raises(Exception) as e:
+        list(Conversions.convert_csv_rows(lines, {"volume": "storage-size"}))
+    assert str(e.value) == "Column 'volume' not found in CSV header: name, size, duration"
+    assert list(Conversions.convert_csv_rows([], {"size": "storage-size"})) == []
+
+def test_convert_csv_file(tmpdir):
+    input_file_name = str(tmpdir.join("input.csv"))
+    output_file_name = str(tmpdir.join("output.csv"))
+    with open(input_file_name, "w") as f:
+        f.write("name;size\na;1KiB\nb;\"2 MB\"\n")
+    Conversions.convert_csv_file(input_file_name, output_file_name, {"size": "storage-size"}, delimiter=";")
+    with open(output_file_name) as f:
+        assert f.read() == "name;size\na;1024\nb;2000000\n"
+
+def test_conversion_cache():
+    cache = Conversions.CONVERSION_CACHE
+    try:
+        cache.set_size(2)
+        assert cache.get_statistics()["time"] == {"convert": (0, 0), "string_repr": (0, 0)}
+        for value in ("1s", "2s", "1s", "3s", "2s"):
+            Conversions.convert_value(value, "time")
+        # 2s was evicted by 3s
+        assert cache.get_statistics()["time"]["convert"] == (1, 4)
+        assert Conversions.convert_value("bad", "time") is None
+        assert Conversions.string_repr(62, "time") == "0:01:02"
+        assert Conversions.string_repr(62, "time") == "0:01:02"
+        assert Conversions.string_repr(62.0, "time") == "0:01:02"
+        assert cache.get_statistics()["time"]["string_repr"] == (1, 2)
+        assert cache.get_statistics()["storage-size"] == {"convert": (0, 0), "string_repr": (0, 0)}
+        cache.clear()
+        assert cache.get_statistics()["time"] == {"convert": (0, 0), "string_repr": (0, 0)}
+        cache.set_size(0)
+        assert Conversions.convert_value("1s", "time") == 1
+        assert cache.get_statistics()["time"] == {"convert": (0, 0), "string_repr": (0, 0)}
+    finally:
+        cache.set_size(int(Conversions.MSC_CONVERSION_CACHE_SIZE.get_value()))
@@ -12,9 +12,13 @@
 #  Copyright (c) 2016-2017 -- MSC Technologies
 # ----------------------------------------------------------------------------------
 
+import json
 import os
-import subprocess
+import socket
+import threading
+import time
 
+import git
 import pytest
 
 import MscBoost.Git as Git
@@ -97,20 +101,55 @@ def test_git_remotes():
     g1.push(all=True)
 
 def test_check_git_access(monkeypatch, capsys):
-    ssh_test_cmd = "ssh -p 9418 gitolite@msc-git02.msc-ge.com info"
     monkeypatch.setenv("MSC_GIT_SERVER", "ssh://gitolite@msc-git02.msc-ge.com:9418")
-    def getstatusoutput_mock(cmd):
-        assert cmd == ssh_test_cmd
-        return 0, "o.k"
-    monkeypatch.setattr(subprocess, "getstatusoutput", getstatusoutput_mock)
+    monkeypatch.setenv("MSC_GIT_SERVER_CACHE", "ssh://gitolite@msc-git-cache:9418")
+    def probe_git_servers_mock(urls):
+        assert urls == ["ssh://gitolite@msc-git02.msc-ge.com:9418/", "ssh://gitolite@msc-git-cache:9418/"]
+        return [Git.GitEndpointStatus(urls[0], True, 0.1), Git.GitEndpointStatus(urls[1], False, 5, "Timeout")]
+    monkeypatch.setattr(Git, "probe_git_servers", probe_git_servers_mock)
     assert Git.check_git_access()
     monkeypatch.setattr(Log(), "out_level", 2)
     assert Git.check_git_access(dry_run=True)
     out, err = capsys.readouterr()
-    assert out == "check_git_access: %s\n" % ssh_test_cmd
+    assert out == "check_git_access: probing msc-git02.msc-ge.com:9418, msc-git-cache:9418\n"
     monkeypatch.setattr(Git, "get_git_server", lambda: "huhu")
     assert Git.check_git_access()
 
+def test_probe_git_servers(monkeypatch, tmpdir):
+    cache_file_name = str(tmpdir.join("cache", "git_access.json"))
+    monkeypatch.setattr(Git, "GIT_ACCESS_CACHE_FILE_NAME", cache_file_name)
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    open_url = "git://127.0.0.1:%d/" % server.getsockname()[1]
+    closed_url = "git://127.0.0.1:%d/" % closed.getsockname()[1]
+    closed.close()
+    urls = [open_url, closed_url, str(tmpdir), str(tmpdir.join("missing"))]
+    statuses = Git.probe_git_servers(urls, timeout=2)
+    assert [status.url for status in statuses] == urls
+    assert [status.reachable for status in statuses] == [True, False, True, False]
+    assert statuses[1].error
+    assert Git.select_git_endpoint([closed_url, open_url]) == open_url
+    assert Git.select_git_endpoint([closed_url]) is None
+    # Results are cached: a closed server is still reported as reachable until the ttl has expired
+    server.close()
+    assert Git.probe_git_servers([open_url])[0].reachable
+    assert not Git.probe_git_servers([open_url], use_cache=False)[0].reachable
+    assert os.stat(os.path.dirname(cache_file_name)).st_mode & 0o777 == 0o700
+    # A cache file that others can write is ignored
+    os.chmod(cache_file_name, 0o666)
+    assert not Git.probe_git_servers([open_url])[0].reachable
+    assert os.stat(cache_file_name).st_mode & 0o022 == 0
+    # Malformed entries (e.g. of an older version) are probed again
+    for entry in ({"time": time.time(), "reachable": True}, [True], {"time": "now", "reachable": True, "latency": 0, "error": None}):
+        with open(cache_file_name, "w") as f:
+            json.dump({"%s ssh=1" % open_url: entry}, f)
+        assert not Git.probe_git_servers([open_url])[0].reachable
+    monkeypatch.setenv("MSC_GIT_ACCESS_CACHE_TTL", "0")
+    assert not Git.probe_git_servers([open_url])[0].reachable
+
 def test_sync_to_public_default_branch():
     os.system("rm -rf gw2 gw3 gw4")
     os.system("git clone w1 gw2 --mirror")
@@ -240,6 +279,63 @@ def test_clone(capsys, monkeypatch):
     g3 = Git.GitRepository("w3")
     assert g3.remotes.origin.url == git_url("w1")
     assert g3.head.commit.message == "6th\n"
+    # The local cache is used as reference repository
+    alternates_file_name = "w3/.git/objects/info/alternates"
+    assert open(alternates_file_name).read().strip() == os.path.abspath("w2/.git/objects")
+
+    # c) Use cache without alternates, update the cache before cloning
+    os.system("rm -fr w3")
+    Git.clone(git_url("w1"), "w3", dissociate=True, update_cache=True)
+    out, err = capsys.readouterr()
+    assert out == "Cloning from git cache: %s\nUpdating git cache: %s\n" % (git_url("w2"), os.path.abspath("w2"))
+    g3 = Git.GitRepository("w3")
+    assert g3.head.commit.message == "6th\n"
+    assert not os.path.exists(alternates_file_name)
+
+def test_clone_options():
+    os.system("rm -fr sc1 sc2 sc3 sc4")
+    os.makedirs("sc1")
+    with Util.WorkingDirectory("sc1"):
+        os.system("git init > /dev/null")
+        os.system("git config uploadpack.allowFilter true")
+        for nr, dir_name in enumerate(["dir1", "dir2", "dir1"]):
+            os.system("mkdir -p %s && echo %d > %s/file.txt && echo %d > readme.txt" % (dir_name, nr, dir_name, nr))
+            os.system("git add . && git commit -m'commit %d' > /dev/null" % nr)
+            if nr == 0:
+                os.system("git tag v1")
+    # Shallow clone: deepened when the branch of a detached HEAD is requested
+    g2 = Git.MscGitRepository(Git.clone(git_url("sc1"), "sc2", depth=1).working_tree_dir)
+    assert g2.is_shallow()
+    assert len(list(g2.iter_commits())) == 1
+    g2.git.fetch("--depth=1", "origin", "tag", "v1")
+    g2.git.checkout("v1")
+    assert g2.get_branch_and_tag_info() == ("master", ("v1",))
+    assert not g2.is_shallow()
+    assert len(list(g2.iter_commits("master"))) == 3
+    # Partial and sparse clone
+    g3 = Git.clone(git_url("sc1"), "sc3", filter="blob:none", sparse_paths=["dir2"])
+    assert os.path.exists("sc3/readme.txt") and os.path.exists("sc3/dir2/file.txt")
+    assert not os.path.exists("sc3/dir1")
+    assert g3.git.config("remote.origin.partialclonefilter") == "blob:none"
+    # A single TAG
+    g4 = Git.GitRepository(Git.clone(git_url("sc1"), "sc4", branch="v1", single_branch=True).working_tree_dir)
+    assert g4.get_branch_and_tag_info() == (None, ("v1",))
+    assert g4.get_branch_names(remote=True) == []
+    # A shallow TAG clone without local branches isn't deepened, also not when origin can't be reached
+    os.system("rm -fr sc4")
+    g4 = Git.GitRepository(Git.clone(git_url("sc1"), "sc4", branch="v1", depth=1).working_tree_dir)
+    g4.git.remote("set-url", "origin", os.path.abspath("sc_missing"))
+    assert g4.get_branch_and_tag_info() == (None, ("v1",))
+    assert g4.is_shallow()
+    assert g4.get_checkout_info_string().startswith("TAG: ")
+    # Deepening fails: no branch is found
+    os.system("rm -fr sc4")
+    g4 = Git.GitRepository(Git.clone(git_url("sc1"), "sc4", depth=1).working_tree_dir)
+    g4.git.checkout("--detach")
+    g4.git.commit("--allow-empty", "-m", "detached")
+    g4.git.remote("set-url", "origin", os.path.abspath("sc_missing"))
+    assert g4.get_branch_and_tag_info() == (None, None)
+    assert g4.is_shallow()
 
 def test_branch_name_sort():
     b1_names = ["develop", "master", "b1"]
@@ -269,6 +365,156 @@ def test_detached_head_state():
     assert g1.get_active_branch_name() == "feature/3"
     assert g1.get_head_sha1() == sha1_feature_3
 
+def test_branch_names_containing():
+    os.system("rm -fr bc1 bc2")
+    os.makedirs("bc1")
+    with Util.WorkingDirectory("bc1"):
+        os.system("git init > /dev/null")
+        os.system("touch readme.txt")
+        os.system("git add readme.txt")
+        os.system("git commit -m'1st' > /dev/null")
+        os.system("git branch b1")
+        os.system("touch readme2.txt")
+        os.system("git add readme2.txt")
+        os.system("git commit -m'2nd' > /dev/null")
+        os.system("git branch develop")
+    g1 = Git.GitRepository("bc1")
+    sha1_1st = g1.get_sha1_for_version("b1")
+    sha1_2nd = g1.get_head_sha1()
+    assert g1.get_branch_names_containing(sha1_1st) == ["b1", "develop", "master"]
+    assert g1.get_branch_names_containing(sha1_2nd) == ["develop", "master"]
+    assert g1.get_branch_names_containing(sha1_2nd, local=False) == []
+    g1.git.checkout(sha1_1st)
+    assert g1.get_branch_and_tag_info() == ("master", None)
+    g1.git.checkout("master")
+
+    Git.clone("bc1", "bc2")
+    g2 = Git.GitRepository("bc2")
+    assert g2.get_branch_names_containing(sha1_1st) == ["master"]
+    assert g2.get_branch_names_containing(sha1_1st, local=False, remote=True) == ["b1", "develop", "master"]
+    # Only origin/<branchname> of existing local branches is considered
+    with Util.WorkingDirectory("bc2"):
+        os.system("git checkout --detach > /dev/null 2>&1")
+        os.system("git branch develop %s" % sha1_1st)
+        os.system("git branch -D master > /dev/null")
+    assert g2.get_branch_and_tag_info() == ("develop", None)
+    with Util.WorkingDirectory("bc2"):
+        os.system("git branch -D develop > /dev/null")
+    assert g2.get_branch_and_tag_info() == (None, None)
+
+def test_ref_snapshot(monkeypatch):
+    # Make the snapshots of this quickly changing test repository trustworthy
+    monkeypatch.setattr(Git, "RACY_REF_STAMP_NS", 0)
+    g1 = Git.GitRepository("bc1")
+    g2 = Git.GitRepository("bc1")
+    snapshot = g1.get_ref_snapshot()
+    assert g1.get_ref_snapshot() is snapshot
+    # The snapshot is shared between repository instances
+    assert g2.get_ref_snapshot() is snapshot
+    assert snapshot.get_head_branch_name() == "master"
+    assert snapshot.branches["b1"] == g1.get_sha1_for_version("b1")
+    # File system timestamps can be coarse: ensure that the modification time changes
+    time.sleep(0.05)
+    g1.git.tag("-a", "snapshot_tag", "-m", "annotated")
+    assert g2.get_ref_snapshot() is not snapshot
+    assert g2.get_tag_names() == ["snapshot_tag"]
+    assert g2.get_ref_snapshot().tags["snapshot_tag"] == g1.get_head_sha1()
+    time.sleep(0.05)
+    g1.git.checkout(g1.get_head_sha1())
+    assert g2.is_in_detached_head_state()
+    time.sleep(0.05)
+    g1.git.checkout("master")
+    assert not g2.is_in_detached_head_state()
+    assert g2.get_branch_and_tag_info() == ("master", ("snapshot_tag",))
+
+def test_tag_names_for_commit():
+    g1 = Git.GitRepository("bc1")
+    head_sha1 = g1.get_head_sha1()
+    g1.git.tag("light_tag")
+    assert g1.get_tag_names(head_sha1) == ["light_tag", "snapshot_tag"]
+    assert g1.get_tag_names("HEAD") == ["light_tag", "snapshot_tag"]
+    assert g1.get_tag_names("master") == ["light_tag", "snapshot_tag"]
+    assert g1.get_tag_names("b1") == []
+    # An annotated tag object only matches itself - like 'git tag --points-at'
+    assert g1.get_tag_names("snapshot_tag") == ["snapshot_tag"]
+    assert g1.get_tag_names(g1.git.rev_parse("snapshot_tag")) == ["snapshot_tag"]
+    # Abbreviated SHA1s are resolved by git
+    assert g1.get_tag_names(head_sha1[:8]) == ["light_tag", "snapshot_tag"]
+    assert g1.create_unique_tag("light_tag") == "light_tag"
+    g1.git.checkout("b1")
+    with pytest.raises(Git.GitException):
+        g1.create_unique_tag("light_tag")
+    g1.git.checkout("master")
+
+def test_status():
+    os.system("rm -fr st1 st2")
+    os.makedirs("st1")
+    with Util.WorkingDirectory("st1"):
+        os.system("git init > /dev/null")
+        os.system("touch readme.txt")
+        os.system("git add readme.txt")
+        os.system("git commit -m'1st' > /dev/null")
+        os.system("git tag v1.0")
+    Git.clone("st1", "st2")
+    g = Git.GitRepository("st2")
+    status = g.get_status()
+    assert (status.branch_name, status.upstream, status.ahead, status.behind) == ("master", "origin/master", 0, 0)
+    assert status.head_sha1 == g.get_head_sha1()
+    assert not status.is_detached
+    assert not status.is_dirty() and not status.untracked
+    assert status.tag_names == ("v1.0",)
+    assert status.version == "v1.0" == g.get_head_version()
+    with Util.WorkingDirectory("st2"):
+        os.system("touch readme2.txt")
+        os.system("git add readme2.txt")
+        os.system("git commit -m'2nd' > /dev/null")
+        os.system("echo changed > readme.txt")
+        os.system("touch untracked.txt")
+    status = g.get_status(fast=True)
+    assert (status.ahead, status.behind) == (1, 0)
+    assert status.unstaged and not status.staged and status.untracked
+    assert status.tag_names is None
+    assert status.version == g.get_head_version()
+    assert status.version.endswith("-dirty")
+    with Util.WorkingDirectory("st2"):
+        os.system("git add readme.txt")
+    status = g.get_status(untracked_files="no")
+    assert status.staged and not status.unstaged and not status.untracked
+    assert status.is_dirty(unstaged=False) and not status.is_dirty(staged=False)
+    g.git.stash()
+    g.git.checkout("v1.0")
+    status = g.get_status()
+    assert status.is_detached and status.branch_name is None and status.upstream is None
+    assert g.get_checkout_info_string() == "Branch: master, TAG: v1.0 [Detached HEAD]"
+
+def test_sha1_for_versions():
+    g = Git.GitRepository("st1")
+    head_sha1 = g.get_head_sha1()
+    assert g.get_sha1_for_version("v1.0") == head_sha1
+    assert g.get_sha1_for_versions(["master", "HEAD", "v1.0", head_sha1[:7]]) == [head_sha1] * 4
+    with pytest.raises(git.GitCommandError):
+        g.get_sha1_for_version("no-such-version")
+    with pytest.raises(git.GitCommandError):
+        g.get_sha1_for_versions(["master", "line\nbreak"])
+    batch_process = g._get_batch_process()
+    assert g._get_batch_process() is batch_process
+    # The git process is restarted when it died
+    batch_process.process.kill()
+    batch_process.process.wait()
+    assert g.get_sha1_for_version("master") == head_sha1
+    # Concurrent queries
+    results = []
+    def resolve():
+        results.append(g.get_sha1_for_versions(["master", "v1.0"] * 300))
+    threads = [threading.Thread(target=resolve) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [[head_sha1] * 600] * 4
+    g.close()
+    assert batch_process.process is None
+
 def test_is_dirty():
     g1 = Git.GitRepository("w1")
     with Util.WorkingDirectory("w1"):
@@ -343,3 +589,66 @@ def test_push_fails():
     os.system("""cd push_clone2.git && git pull""")
     # because of merge CONFLICT push must not have succeeded
     assert not os.path.isfile("push_clone2.git/COPYING.txt")
+
+def test_get_remote_host():
+    assert Git.get_remote_host("ssh://gitolite@msc-git02.msc-ge.com:9418/msc_0000/lib.git") == "msc-git02.msc-ge.com"
+    assert Git.get_remote_host("git@destsm3ux05bbct.emea.avnet.com:7999/msc_0000/lib.git") == "destsm3ux05bbct.emea.avnet.com"
+    assert Git.get_remote_host("git://msc-aac-debian01.msc-ge.mscnet/msc_0000/lib.git") == "msc-aac-debian01.msc-ge.mscnet"
+    assert Git.get_remote_host("file:///tmp/lib.git") == ""
+    assert Git.get_remote_host("/tmp/lib.git") == ""
+    assert Git.get_remote_host("../lib.git") == ""
+
+def test_workspace(capsys):
+    os.system("rm -rf ws && mkdir ws")
+    with Util.WorkingDirectory("ws"):
+        for name in ("r1", "r2"):
+            os.system("git init -q --bare %s.git && git init -q --bare %s_mirror.git" % (name, name))
+            os.system("git clone -q %s.git %s_a 2> /dev/null && git clone -q %s.git %s_b 2> /dev/null" % (name, name, name, name))
+            with Util.WorkingDirectory("%s_a" % name):
+                os.system("touch readme.txt && git add readme.txt && git commit -q -m'1st' && git push -q origin master")
+    paths = [os.path.join("ws", name) for name in ("r1_b", "r2_b", "no_repo")]
+    workspace = Git.MscGitWorkspace(paths, max_workers=2, max_connections_per_host=1)
+    results = workspace.update()
+    out, err = capsys.readouterr()
+    assert [r.path for r in results] == paths
+    assert [r.success for r in results] == [True, True, False]
+    assert results[2].error
+    assert results[0].duration >= 0
+    assert os.path.exists("ws/r1_b/readme.txt") and os.path.exists("ws/r2_b/readme.txt")
+    assert "update: 3/3" in out
+    assert "'ws/no_repo'" in err
+
+    sync_targets = dict([(os.path.join("ws", name + "_b"), os.path.abspath("ws/%s_mirror.git" % name)) for name in ("r1", "r2")])
+    workspace = Git.MscGitWorkspace(paths[:2])
+    results = workspace.sync_to_public(sync_targets=sync_targets)
+    assert [r.success for r in results] == [True, True]
+    for name in ("r1", "r2"):
+        assert Git.GitRepository("ws/%s_mirror.git" % name).get_branch_names() == ["master"]
+
+def test_push_force_and_atomic():
+    create_git_push_repos()
+    os.system("""
+    cd push_clone2.git &&
+    touch MAKEFILE &&
+    git add MAKEFILE &&
+    git commit -am MAKEFILE &&
+    git push &&
+    cd .. &&
+    cd push_clone.git &&
+    touch COPYING.txt &&
+    git add COPYING.txt &&
+    git commit -am COPYING &&
+    git tag v1.0 &&
+    git branch feature
+    """)
+    g = Git.GitRepository("push_clone.git")
+    src = Git.GitRepository("push_src.git")
+    # master is rejected -> an atomic push does not create the tag and the new branch either
+    with pytest.raises(Git.GitException):
+        g.push(with_tags=True, all=True, atomic=True)
+    assert src.get_tag_names() == []
+    assert src.get_branch_names() == ["master"]
+    g.push(with_tags=True, all=True, force=True, atomic=True)
+    assert src.get_tag_names() == ["v1.0"]
+    assert src.get_branch_names() == ["feature", "master"]
+    assert src.get_sha1_for_version("master") == g.get_head_sha1()
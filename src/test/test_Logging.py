@@ -12,8 +12,14 @@
 #  Copyright (c) 2016 -- MSC Technologies
 # ----------------------------------------------------------------------------------
 
+import io
+import json
 import logging
+import multiprocessing
 import os
+import sys
+import threading
+import time
 
 import py.io
 import pytest
@@ -132,3 +138,348 @@ def test_progress(logger, capsys):
     out, err = capsys.readouterr()
     CURSOR_UP = ESC+"[1A"+ESC+"[K"
     assert out == "step1\n"+CURSOR_UP+"step2\n"+CURSOR_UP+"done\n"
+
+def test_async_log_writer(capsys, monkeypatch):
+    monkeypatch.setenv("MSC_LOG_ASYNC", "1")
+    monkeypatch.delenv("MSC_FD3_IS_WARNING_PIPE")
+    async_logger = MscBoost.Logging.Log("async")
+    handler = async_logger.handlers[0]
+    assert handler.writer is not None
+    error_count = MscBoost.Logging.get_log_call_count("ERROR")
+    for i in range(2000):
+        async_logger.info("info %d" % i)
+        if i % 100 == 0:
+            async_logger.error("error %d" % i)
+    # The calls are counted immediately, not when they are written
+    assert MscBoost.Logging.get_log_call_count("ERROR") == error_count + 20
+    handler.flush()
+    out, err = capsys.readouterr()
+    assert out == "".join("INFO: info %d\n" % i for i in range(2000))
+    assert err == "".join("ERROR: error %d\n" % i for i in range(0, 2000, 100))
+    # All asynchronous handlers share one writer, the order of the messages of different loggers is kept
+    other_logger = MscBoost.Logging.Log("async_other")
+    assert other_logger.handlers[0].writer is handler.writer
+    for i in range(100):
+        async_logger.info("first %d" % i)
+        other_logger.info("second %d" % i)
+    other_logger.handlers[0].close()
+    out, err = capsys.readouterr()
+    assert out == "".join("INFO: first %d\nINFO: second %d\n" % (i, i) for i in range(100))
+    assert handler.writer.thread.is_alive()
+    async_logger.warning("queued warning")
+    MscBoost.Logging.close_async_log_writer()
+    assert not handler.writer.thread.is_alive()
+    async_logger.warning("written synchronously")
+    out, err = capsys.readouterr()
+    assert err == "WARNING: queued warning\nWARNING: written synchronously\n"
+
+def test_async_log_writer_close_race():
+    stream = io.StringIO()
+    writer = MscBoost.Logging.AsyncLogWriter(queue_size=100, flush_interval=0.01)
+    def put_messages(nr):
+        for i in range(2000):
+            writer.put(stream, "thread %d message %d" % (nr, i))
+    threads = [threading.Thread(target=put_messages, args=(nr,)) for nr in range(4)]
+    for thread in threads:
+        thread.start()
+    # Messages put while or after closing are written, none is lost
+    writer.close()
+    for thread in threads:
+        thread.join()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 8000
+    for nr in range(4):
+        assert [line for line in lines if line.startswith("thread %d " % nr)] == ["thread %d message %d" % (nr, i) for i in range(2000)]
+
+def test_lazy_out(capsys, monkeypatch):
+    lazy_logger = MscBoost.Logging.Log("lazy")
+    assert MscBoost.Logging.Log("lazy") is lazy_logger
+    # Suppressed messages are not kept in the ring buffer
+    monkeypatch.setattr(lazy_logger, "ring_buffer_verbosity", 0)
+    calls = []
+    def get_msg(txt):
+        calls.append(txt)
+        return "lazy %s 100%%" % txt
+    lazy_logger.out_lazy(1, get_msg, "hidden")
+    lazy_logger.out(1, "%s", calls)
+    out = lazy_logger.get_out(1)
+    out("get_out %s", "hidden")
+    assert calls == []
+    lazy_logger.set_verbosity(1)
+    lazy_logger.out_lazy(1, get_msg, "shown")
+    lazy_logger.out(1, "out %s", "shown")
+    out("get_out %s", "still hidden")
+    out = lazy_logger.get_out(1)
+    out("get_out %s", "shown")
+    assert lazy_logger.get_out(1) is out
+    assert calls == ["shown"]
+    out, err = capsys.readouterr()
+    assert out == "lazy shown 100%\nout shown\nget_out shown\n"
+    # Messages kept in the ring buffer are created immediately
+    lazy_logger.set_verbosity(0)
+    lazy_logger.ring_buffer_verbosity = 1
+    lazy_logger.out_lazy(1, get_msg, "buffered")
+    assert calls == ["shown", "buffered"]
+    assert lazy_logger.ring_buffer.get_lines()[-1].endswith("lazy OUT(1, suppressed): lazy buffered 100%")
+    assert capsys.readouterr() == ("", "")
+
+def test_fd3_channel(monkeypatch, capsys):
+    writes = []
+    def write_mock(fd, data):
+        writes.append((fd, data))
+        return len(data)
+    monkeypatch.setattr(MscBoost.Logging.os, "write", write_mock)
+    monkeypatch.setenv("MSC_FD3_IS_WARNING_PIPE", "")
+    handler = MscBoost.Logging.MscLogStreamHandler()
+    fd3_logger = MscBoost.Logging.Log("fd3")
+    fd3_logger.removeHandler(fd3_logger.handlers[0])
+    fd3_logger.addHandler(handler)
+    # One write per warning
+    fd3_logger.warning("warning1")
+    assert writes == [(3, b"WARNING: warning1\n")]
+    # Batched warnings: written when the batch size is reached, split at line ends into atomic writes
+    pipe_buf = MscBoost.Logging.PIPE_BUF
+    handler.fd3_channel = MscBoost.Logging.Fd3Channel(batch_size=2 * pipe_buf, batch_delay=60)
+    del writes[:]
+    line = "x" * 100
+    nr_of_lines = 2 * pipe_buf // (len("WARNING: ") + len(line) + 1) + 1
+    for i in range(nr_of_lines):
+        fd3_logger.warning(line)
+    assert len(writes) == 3
+    assert all(len(data) <= pipe_buf and data.endswith(b"\n") for (fd, data) in writes)
+    assert b"".join(data for (fd, data) in writes) == ("WARNING: %s\n" % line).encode() * nr_of_lines
+    # Incomplete batches are written on flush or after the batch delay
+    del writes[:]
+    fd3_logger.warning("warning2")
+    assert writes == []
+    handler.flush()
+    assert writes == [(3, b"WARNING: warning2\n")]
+    handler.fd3_channel = MscBoost.Logging.Fd3Channel(batch_size=pipe_buf, batch_delay=0.01)
+    fd3_logger.warning("warning3")
+    handler.fd3_channel.timer.join()
+    assert writes[-1] == (3, b"WARNING: warning3\n")
+    # Fallback to stderr
+    def failing_write_mock(fd, data):
+        raise OSError("Bad file descriptor")
+    monkeypatch.setattr(MscBoost.Logging.os, "write", failing_write_mock)
+    handler.fd3_channel = MscBoost.Logging.Fd3Channel()
+    capsys.readouterr()
+    fd3_logger.warning("warning4")
+    out, err = capsys.readouterr()
+    assert err == "WARNING: warning4\n"
+
+def test_json_lines_log(monkeypatch, tmpdir, capsys):
+    json_file_name = str(tmpdir.join("log.json"))
+    monkeypatch.setenv("MSC_LOG_JSON_FILE", json_file_name)
+    monkeypatch.setenv("MSC_LOG_JSON_FILE_MAX_SIZE", "1KB")
+    monkeypatch.delenv("MSC_FD3_IS_WARNING_PIPE")
+    json_logger = MscBoost.Logging.Log("json")
+    json_handler = json_logger.handlers[1]
+    assert isinstance(json_handler, MscBoost.Logging.JsonLinesHandler)
+    json_logger.set_verbosity(1)
+    json_logger.out(1, "out %s", "\"quoted\"")
+    json_logger.warning("warning: %d%%", 100)
+    json_handler.flush()
+    out, err = capsys.readouterr()
+    assert out == "out \"quoted\"\n"
+    assert err == "WARNING: warning: 100%\n"
+    records = [json.loads(line) for line in open(json_file_name)]
+    assert [(r["level"], r["logger"], r["verbosity"], r["message"]) for r in records] == [
+        ("OUT", "json", 1, "out \"quoted\""), ("WARNING", "json", None, "warning: 100%")]
+    assert abs(records[0]["time"] - time.time()) < 60
+    # Size based rotation
+    for i in range(20):
+        json_logger.out(0, "message %d", i)
+    json_handler.flush()
+    assert os.path.getsize(json_file_name) <= 1000
+    assert os.path.exists(json_file_name + ".1")
+    assert json.loads(open(json_file_name).readlines()[-1])["message"] == "message 19"
+    # The size limit counts bytes, not characters
+    for i in range(20):
+        json_logger.out(0, "\u20ac" * 40)
+    json_handler.flush()
+    assert os.path.getsize(json_file_name) <= 1000
+    assert os.path.getsize(json_file_name + ".1") <= 1000
+    # All loggers share one handler, the rotation doesn't lose the records of other loggers
+    other_logger = MscBoost.Logging.Log("json_other")
+    assert other_logger.handlers[1] is json_handler
+    for i in range(20):
+        json_logger.out(0, "first %d", i)
+        other_logger.out(0, "second %d", i)
+    json_handler.flush()
+    messages = [json.loads(line)["message"] for name in (json_file_name + ".1", json_file_name) for line in open(name)]
+    assert messages[-6:] == ["first 17", "second 17", "first 18", "second 18", "first 19", "second 19"]
+    json_handler.close()
+
+def log_errors(nr_of_errors):
+    counter_logger = MscBoost.Logging.Log("counter")
+    for i in range(nr_of_errors):
+        counter_logger.error("error %d", i)
+    return nr_of_errors
+
+def test_log_call_counter(capsys):
+    error_count = MscBoost.Logging.get_log_call_count("ERROR")
+    threads = [threading.Thread(target=log_errors, args=(500,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert MscBoost.Logging.get_log_call_count("ERROR") == error_count + 2000
+    assert MscBoost.Logging.get_log_call_count("ERROR", "counter") == 2000
+    assert MscBoost.Logging.get_log_call_count("WARNING", "counter") == 0
+    # Counts of worker processes
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        for result, counts in pool.starmap(MscBoost.Logging.call_with_log_call_counts, [(log_errors, 3), (log_errors, 5)]):
+            assert counts == {("counter", "ERROR"): result}
+            MscBoost.Logging.merge_log_call_counts(counts)
+    assert MscBoost.Logging.get_log_call_count("ERROR", "counter") == 2008
+    assert MscBoost.Logging.LOG_CALL_COUNT["ERROR"] == error_count + 2008
+    capsys.readouterr()
+
+def test_log_suppression(monkeypatch, capsys):
+    monkeypatch.delenv("MSC_FD3_IS_WARNING_PIPE")
+    monkeypatch.setenv("MSC_LOG_SUPPRESS_REPEATED", "60")
+    suppressing_logger = MscBoost.Logging.Log("suppressing")
+    suppression_filter = suppressing_logger.filters[0]
+    for i in range(100):
+        suppressing_logger.warning("conversion of %s failed", "file_1")
+        suppressing_logger.warning("conversion of %s failed", "file_2")
+    suppressing_logger.info("info")
+    suppressing_logger.info("info")
+    out, err = capsys.readouterr()
+    assert out == "INFO: info\nINFO: info\n"
+    assert err == "WARNING: conversion of file_1 failed\nWARNING: conversion of file_2 failed\n"
+    assert MscBoost.Logging.get_log_call_count("WARNING", "suppressing") == 200
+    suppression_filter.flush()
+    out, err = capsys.readouterr()
+    assert err == "WARNING: conversion of file_1 failed (repeated 99 times)\nWARNING: conversion of file_2 failed (repeated 99 times)\n"
+    assert MscBoost.Logging.get_log_call_count("WARNING", "suppressing") == 200
+    # Summaries after the window
+    suppression_filter.window = 0.01
+    suppressing_logger.error("error")
+    suppressing_logger.error("error")
+    time.sleep(0.02)
+    suppressing_logger.error("error")
+    out, err = capsys.readouterr()
+    assert err == "ERROR: error\nERROR: error (repeated 1 times)\nERROR: error\n"
+    # Rate limit
+    suppression_filter.window = 0
+    suppression_filter.rate_limits = {"ERROR": (0.0001, 2)}
+    for i in range(5):
+        suppressing_logger.error("error %d", i)
+    suppression_filter.rate_limits = {"ERROR": (1000000, 2)}
+    suppressing_logger.error("error 5")
+    out, err = capsys.readouterr()
+    assert err == "ERROR: error 0\nERROR: error 1\nERROR: 3 ERROR messages were suppressed (rate limit)\nERROR: error 5\n"
+    assert MscBoost.Logging.get_log_call_count("ERROR", "suppressing") == 9
+
+def test_progress_renderer(monkeypatch, capsys):
+    CURSOR_UP = ESC+"[1A"+ESC+"[K"
+    assert MscBoost.Logging.format_duration(3725.4) == "1:02:05"
+    now = [1000.0]
+    monkeypatch.setattr(MscBoost.Logging.time, "monotonic", lambda: now[0])
+    stream = io.StringIO()
+    renderer = MscBoost.Logging.ProgressRenderer(refresh_interval=0.1, plain_interval=10, stream=stream, is_tty=True)
+    progress1 = renderer.add("worker1", total=100)
+    progress2 = renderer.add("worker2")
+    now[0] += 1
+    progress1.update(10)
+    assert stream.getvalue() == "worker1: 10/100 (10%, 10.0/s, ETA 0:00:09)\nworker2: 0 (0.0/s)\n" + 2 * CURSOR_UP
+    # Updates within the refresh interval are coalesced
+    for i in range(10):
+        progress2.update()
+    now[0] += 0.06
+    progress1.update()
+    assert stream.getvalue().count("\n") == 2
+    now[0] += 0.06
+    progress1.update()
+    assert stream.getvalue().count("\n") == 4
+    assert stream.getvalue().endswith("worker2: 10 (8.9/s)\n" + 2 * CURSOR_UP)
+    progress1.finish()
+    assert stream.getvalue().endswith("worker1: 12/100 (12%, 10.7/s, ETA 0:00:08)\n")
+    assert renderer.progresses == [progress2]
+    # Plain lines when the output is not a terminal
+    stream = io.StringIO()
+    renderer = MscBoost.Logging.ProgressRenderer(refresh_interval=0.1, plain_interval=10, stream=stream, is_tty=False)
+    with renderer.add("copy", total=4) as progress:
+        for i in range(4):
+            now[0] += 1
+            progress.update()
+    assert stream.getvalue() == "copy: 1/4 (25%, 1.0/s, ETA 0:00:03)\ncopy: 4/4 (100%, 1.0/s, ETA 0:00:00)\n"
+    # sys.stdout: a flush is required before writing to stderr
+    monkeypatch.setattr(MscBoost.Logging.PROGRESS_RENDERER, "is_tty", True)
+    monkeypatch.setattr(MscBoost.Logging.PROGRESS_RENDERER, "next_render_time", 0)
+    with MscBoost.Logging.Log().create_progress("stdout", total=1) as progress:
+        progress.update()
+        assert sys.flush_stdout_required
+    MscBoost.Logging.Log().error("error")
+    assert not sys.flush_stdout_required
+    capsys.readouterr()
+
+class TtyStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.isatty_calls = 0
+
+    def isatty(self):
+        self.isatty_calls += 1
+        return True
+
+def test_handler_routes(monkeypatch):
+    monkeypatch.setattr(MscBoost.Logging, "USE_COLORS", True)
+    handler = MscBoost.Logging.MscLogStreamHandler(asynchronous=False)
+    handler.use_fd3_as_warning_stream = False
+    routes_logger = MscBoost.Logging.Log("routes")
+    routes_logger.removeHandler(routes_logger.handlers[0])
+    routes_logger.addHandler(handler)
+    stdout = TtyStream()
+    stderr = TtyStream()
+    monkeypatch.setattr(sys, "stdout", stdout)
+    monkeypatch.setattr(sys, "stderr", stderr)
+    for i in range(3):
+        routes_logger.info("info")
+        routes_logger.warning("warning")
+        routes_logger.out(0, "out")
+    assert handler.routes[logging.WARNING][0] == "stderr"
+    # isatty() is only called once per stream
+    assert (stdout.isatty_calls, stderr.isatty_calls) == (1, 1)
+    assert stdout.getvalue() == 3 * (ESC+"[38;5;6mINFO: info"+ESC+"[0m\nout\n")
+    assert stderr.getvalue() == 3 * (ESC+"[38;5;11mWARNING: warning"+ESC+"[0m\n")
+    # A replaced stream is checked again
+    stdout2 = TtyStream()
+    monkeypatch.setattr(sys, "stdout", stdout2)
+    routes_logger.info("info")
+    routes_logger.info("info")
+    assert stdout2.isatty_calls == 1
+    # The routes follow the fd3 setting
+    handler.use_fd3_as_warning_stream = True
+    assert handler.routes == {}
+    handler.fd3_channel = MscBoost.Logging.Fd3Channel(fd=-1)
+    routes_logger.warning("fd3")
+    assert handler.routes[logging.WARNING][0] == "fd3"
+
+def test_log_ring_buffer(capsys):
+    ring_buffer = MscBoost.Logging.LogRingBuffer(3)
+    for i in range(5):
+        ring_buffer.append((time.time(), "ring", "OUT", 2, True, "msg %d", (i,)))
+    ring_buffer.append((time.time(), "ring", "WARNING", None, False, str.upper, ("lazy",)))
+    lines = ring_buffer.get_lines()
+    assert [line.split(" ", 2)[2] for line in lines] == ["ring OUT(2, suppressed): msg 3", "ring OUT(2, suppressed): msg 4", "ring WARNING: LAZY"]
+    ring_buffer.clear()
+    assert ring_buffer.get_lines() == []
+    # Logged messages are stored formatted, later changes of the arguments are not reflected
+    ring_logger = MscBoost.Logging.Log("ring")
+    ring_logger.ring_buffer = ring_buffer
+    ring_logger.addHandler(MscBoost.Logging.LogRingBufferHandler(ring_buffer))
+    items = ["a"]
+    ring_logger.warning("items: %s", items)
+    items.append("b")
+    # Suppressed out() messages are only kept up to ring_buffer_verbosity
+    ring_logger.ring_buffer_verbosity = 1
+    ring_logger.out(1, "kept")
+    ring_logger.get_out(1)("kept by get_out")
+    ring_logger.out(2, "dropped")
+    ring_logger.get_out(2)("dropped by get_out")
+    lines = ring_buffer.get_lines()
+    assert [line.split(" ", 2)[2] for line in lines] == ["ring WARNING: items: ['a']", "ring OUT(1, suppressed): kept", "ring OUT(1, suppressed): kept by get_out"]
+    capsys.readouterr()